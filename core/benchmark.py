@@ -0,0 +1,170 @@
+"""
+Small built-in benchmarks.
+
+    python -m core.benchmark encoders [--images DIR] [--quality 70]
+    python -m core.benchmark startup [--repeat 3] [--max-seconds 2.0]
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from core.encoders import available_encoders, get_encoder
+
+
+def sample_images() -> list:
+    """Synthetic test pages: a photo-like cover, line art and a grey scan."""
+    photo = Image.merge('RGB', [
+        Image.effect_noise((800, 1200), 60).filter(ImageFilter.GaussianBlur(r))
+        for r in (1, 2, 3)
+    ])
+
+    line_art = Image.new('RGB', (800, 1200), 'white')
+    draw = ImageDraw.Draw(line_art)
+    for i in range(0, 800, 23):
+        draw.line([(i, 0), (800 - i, 1200)], fill=(20, 20, 20), width=2)
+    draw.rectangle([100, 300, 500, 700], fill=(200, 40, 40))
+
+    scan = Image.effect_noise((800, 1200), 20).filter(ImageFilter.GaussianBlur(1))
+    return [photo, line_art, scan]
+
+
+def load_images(folder, limit: int = 10) -> list:
+    """Loads up to limit JPG/PNG images from folder for benchmarking."""
+    images = []
+    for fp in sorted(Path(folder).rglob('*')):
+        if fp.suffix.lower() in ('.jpg', '.jpeg', '.png'):
+            with Image.open(fp) as img:
+                images.append(img.convert('L' if img.mode == 'L' else 'RGB'))
+            if len(images) >= limit:
+                break
+    return images
+
+
+def benchmark_encoders(images=None, names=None, quality: int = 70, repeat: int = 3) -> list:
+    """
+    Encodes every image with every encoder. Returns a list of
+    {"name", "seconds", "bytes"} dicts (best time of repeat runs, total size).
+    """
+    images = images or sample_images()
+    results = []
+    for name in names or available_encoders():
+        encode = get_encoder(name)
+        best = None
+        size = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            size = sum(len(encode(img, quality)) for img in images)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results.append({"name": name, "seconds": best, "bytes": size})
+    return results
+
+
+def pick_encoder(results: list, preset: str) -> str:
+    """
+    'fast' picks the quickest encoder, 'smallest' the smallest total output;
+    ties go to the smaller / quicker one respectively.
+    """
+    if preset == 'fast':
+        return min(results, key=lambda r: (r["seconds"], r["bytes"]))["name"]
+    return min(results, key=lambda r: (r["bytes"], r["seconds"]))["name"]
+
+
+# Modules the application must not import before a run starts. core.scheduler
+# is imported at launch on purpose: the window owns the app-wide governor.
+STARTUP_DEFERRED = (
+    'core.jpg_compressor', 'core.epub_compressor', 'core.pdf_compressor',
+    'core.cbz_compressor', 'core.library', 'core.watcher', 'core.runlog',
+    'core.imaging', 'core.encoders', 'rarfile',
+)
+
+_STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from ui.app import CompressorApp
+imported = time.perf_counter() - start
+window = None
+try:
+    app = CompressorApp()
+    app.update()
+    window = time.perf_counter() - start
+    app.destroy()
+except Exception:
+    pass  # no display: only the imports are timed
+print(json.dumps({"import": imported, "window": window, "modules": sorted(sys.modules)}))
+"""
+
+
+def measure_startup(repeat: int = 3) -> dict:
+    """
+    Starts the application in repeat fresh interpreters and times it: the
+    imports of ui.app, and — if a display is available — up to the first
+    drawn window. Returns {"import", "window"} (best seconds; window is None
+    without a display) and "deferred": the STARTUP_DEFERRED modules that
+    were imported anyway (should be empty).
+    """
+    root = Path(__file__).parent.parent
+    best = {"import": None, "window": None}
+    deferred = set()
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, '-c', _STARTUP_SCRIPT],
+            cwd=root, capture_output=True, text=True, check=True,
+        )
+        timing = json.loads(result.stdout.strip().splitlines()[-1])
+        for key in best:
+            if timing[key] is not None:
+                best[key] = timing[key] if best[key] is None else min(best[key], timing[key])
+        deferred.update(m for m in timing["modules"] if m in STARTUP_DEFERRED)
+    return {**best, "deferred": sorted(deferred)}
+
+
+def _cli(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m core.benchmark')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_enc = sub.add_parser('encoders', help='JPEG encoders vergelijken')
+    p_enc.add_argument('--images', help='map met voorbeeldafbeeldingen')
+    p_enc.add_argument('--quality', type=int, default=70)
+    p_enc.add_argument('--repeat', type=int, default=3)
+
+    p_start = sub.add_parser('startup', help='opstarttijd van de applicatie meten')
+    p_start.add_argument('--repeat', type=int, default=3)
+    p_start.add_argument('--max-seconds', type=float, help='mislukt (exit 1) boven deze tijd')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'encoders':
+        images = load_images(args.images) if args.images else sample_images()
+        results = benchmark_encoders(images, quality=args.quality, repeat=args.repeat)
+        for r in sorted(results, key=lambda r: r["seconds"]):
+            print(f"{r['name']:<20} {r['seconds'] * 1000:8.1f} ms  {r['bytes'] / 1024:9.1f} KB")
+        print(f"fast     -> {pick_encoder(results, 'fast')}")
+        print(f"smallest -> {pick_encoder(results, 'smallest')}")
+
+    elif args.command == 'startup':
+        result = measure_startup(args.repeat)
+        print(f"imports  {result['import'] * 1000:8.1f} ms")
+        if result["window"] is not None:
+            print(f"venster  {result['window'] * 1000:8.1f} ms")
+        else:
+            print("venster  — (geen display)")
+        failed = False
+        if result["deferred"]:
+            print(f"Te vroeg geïmporteerd: {', '.join(result['deferred'])}")
+            failed = True
+        total = result["window"] if result["window"] is not None else result["import"]
+        if args.max_seconds is not None and total > args.max_seconds:
+            print(f"Opstarten duurt langer dan {args.max_seconds:g} s")
+            failed = True
+        if failed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    _cli()
@@ -1,16 +1,67 @@
+import importlib.util
 import os
 import zipfile
-import subprocess
 import tempfile
 import shutil
 import threading
+import time
+from functools import lru_cache
 from pathlib import Path
 from io import BytesIO
 from PIL import Image
 
-from core.shared import should_process_file, mark_as_processed
-
-SUPPORTED_IMAGE_FORMATS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp'}
+from core.shared import (
+    should_process_file, needs_processing, mark_as_processed, estimate_archive_bytes,
+    zip_compress_type,
+)
+from core.encoders import DEFAULT_ENCODER, resolve_preset
+from core.stamp import make_stamp
+from core.scheduler import (
+    run_files, io_slot, write_behind, then, open_source, check_stop, StopRequested,
+    run_process, BudgetExceeded,
+)
+from core.watcher import Watcher, file_batches
+from core import metrics, quarantine
+from core.runlog import RunLog
+from core.imaging import (
+    to_grayscale_if_possible, auto_crop, encode_jpeg_auto, open_for_resize,
+    fit_size, has_transparency, is_line_art, encode_png_palette,
+)
+
+SUPPORTED_IMAGE_FORMATS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp', '.avif'}
+
+# output_format -> (Pillow format, file suffix, extra save kwargs)
+OUTPUT_FORMATS = {
+    'jpeg': ('JPEG', '.jpg', {'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', '.webp', {'method': 4}),
+    'webp_lossless': ('WEBP', '.webp', {'lossless': True, 'method': 4}),
+    'avif': ('AVIF', '.avif', {'speed': 6}),
+    # Not user-selectable: the palette candidate for line art and transparency
+    'png': ('PNG', '.png', {'optimize': True}),
+}
+
+
+# What to write for a CBR: repack as CBR (needs rar.exe), or convert to a CBZ
+# with the same name stem that replaces the CBR or is written next to it
+CBR_OUTPUTS = ('cbr', 'cbz', 'cbz_alongside')
+
+
+def available_output_formats() -> list:
+    """Returns the OUTPUT_FORMATS keys the installed Pillow can write."""
+    from PIL import features
+    formats = ['jpeg']
+    if features.check('webp'):
+        formats += ['webp', 'webp_lossless']
+    if features.check('avif'):
+        formats.append('avif')
+    return formats
+
+
+def _encode(img: Image.Image, output_format: str, quality: int) -> bytes:
+    pil_format, _, extra = OUTPUT_FORMATS[output_format]
+    buf = BytesIO()
+    img.save(buf, pil_format, quality=quality, **extra)
+    return buf.getvalue()
 
 
 def _compress_image_data(
@@ -18,16 +69,42 @@ def _compress_image_data(
     filename: str,
     target_width: int,
     quality: int,
+    output_format: str = 'jpeg',
+    keep_smaller: bool = False,
+    detect_grayscale: bool = False,
+    counters: dict = None,
+    crop_margins: bool = False,
+    target_ssim: float = None,
+    quality_range: tuple = (40, 90),
+    encoder: str = DEFAULT_ENCODER,
 ) -> tuple:
     """
     Compresses image bytes in memory.
     Returns (compressed_bytes, orig_size, new_size, new_filename).
-    Falls back to original data on error.
+    With keep_smaller, a non-JPEG page is also encoded as JPEG and whichever
+    is smaller is kept; new_filename carries the matching suffix.
+    With target_ssim, JPEG quality is searched per page within quality_range.
+    Line art and transparent pages also get a palette PNG candidate (see
+    core.imaging.encode_png_palette); transparent pages get no JPEG one.
+    Returns the original data and filename (the same bytes object) when the
+    re-encoded page isn't smaller, or on error; BudgetExceeded and
+    StopRequested propagate so the whole archive is failed/stopped.
     """
     try:
         with Image.open(BytesIO(image_data)) as img:
-            if img.mode in ('RGBA', 'P', 'LA'):
-                img = img.convert('RGB')
+            img = open_for_resize(img, fit_size(img.size, max_width=target_width), counters)
+
+            alpha = has_transparency(img)
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGBA' if alpha else 'RGB')
+
+            cropped = False
+            if crop_margins and not alpha:
+                img, cropped = auto_crop(img)
+
+            converted = False
+            if detect_grayscale and not alpha:
+                img, converted = to_grayscale_if_possible(img)
 
             orig_w, orig_h = img.size
 
@@ -36,13 +113,37 @@ def _compress_image_data(
                 new_h = int(target_width * ratio)
                 img = img.resize((target_width, new_h), Image.Resampling.LANCZOS)
 
-            # Always output as JPEG
-            out_filename = str(Path(filename).with_suffix('.jpg'))
-            buf = BytesIO()
-            img.save(buf, 'JPEG', quality=quality, optimize=True, progressive=True)
-            compressed = buf.getvalue()
+            candidates = []
+            jpeg_quality = None
+            if (output_format == 'jpeg' or keep_smaller) and not alpha:
+                jpeg, jpeg_quality = encode_jpeg_auto(
+                    img, quality, target_ssim, *quality_range, encoder
+                )
+                candidates.append((jpeg, 'jpeg'))
+            if output_format != 'jpeg':
+                candidates.append((_encode(img, output_format, quality), output_format))
+            if alpha or is_line_art(img):
+                candidates.append((encode_png_palette(img), 'png'))
+
+            compressed, chosen = min(candidates, key=lambda c: len(c[0]))
+
+            if len(compressed) >= len(image_data):
+                return image_data, len(image_data), len(image_data), filename
+
+            if counters is not None:
+                if cropped:
+                    counters["cropped"] = counters.get("cropped", 0) + 1
+                if converted:
+                    counters["grayscale"] = counters.get("grayscale", 0) + 1
+                if chosen == 'jpeg':
+                    counters["quality_sum"] = counters.get("quality_sum", 0) + jpeg_quality
+                    counters["encoded"] = counters.get("encoded", 0) + 1
+
+            out_filename = str(Path(filename).with_suffix(OUTPUT_FORMATS[chosen][1]))
             return compressed, len(image_data), len(compressed), out_filename
 
+    except (BudgetExceeded, StopRequested):
+        raise
     except Exception:
         return image_data, len(image_data), len(image_data), filename
 
@@ -68,9 +169,11 @@ def _extract_cbr(archive_path: Path, extract_dir: Path) -> bool:
         return False
 
 
-def _pack_cbz(source_dir: Path, output_path: str) -> bool:
+def _pack_cbz(source_dir: Path, output_path: str, comment: bytes = b'') -> bool:
+    """Packs the pages under source_dir; already-compressed pages are stored, not deflated."""
     try:
         with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+            zf.comment = comment
             files = []
             for root, _, filenames in os.walk(source_dir):
                 for fn in filenames:
@@ -79,7 +182,7 @@ def _pack_cbz(source_dir: Path, output_path: str) -> bool:
                         files.append((fp, os.path.relpath(fp, source_dir)))
             files.sort(key=lambda x: x[1].lower())
             for fp, arcname in files:
-                zf.write(fp, arcname)
+                zf.write(fp, arcname, zip_compress_type(arcname))
         return True
     except Exception:
         return False
@@ -97,49 +200,91 @@ def _pack_cbr(source_dir: Path, output_path: str) -> bool:
         files.sort(key=lambda x: Path(x).name.lower())
 
         cmd = ['rar', 'a', '-ep1', '-m0', output_path] + files
-        result = subprocess.run(cmd, capture_output=True, text=True, cwd=str(source_dir))
+        result = run_process(cmd, cwd=str(source_dir))
         return result.returncode == 0
+    except (StopRequested, BudgetExceeded):
+        raise
     except Exception:
         return False
 
 
+def fingerprint(
+    target_width, quality, output_format='jpeg', target_ssim=None, crop_margins=False
+) -> dict:
+    """Settings fingerprint recorded with each processed file (see core.shared)."""
+    return {
+        "target_width": target_width, "quality": quality, "output_format": output_format,
+        "target_ssim": target_ssim, "crop_margins": crop_margins,
+    }
+
+
 def _process_archive(
     archive_path: Path,
     target_width: int,
     quality: int,
     force: bool,
     log_callback,
+    output_format: str = 'jpeg',
+    keep_smaller: bool = False,
+    detect_grayscale: bool = False,
+    counters: dict = None,
+    crop_margins: bool = False,
+    target_ssim: float = None,
+    quality_range: tuple = (40, 90),
+    encoder: str = DEFAULT_ENCODER,
+    cbr_output: str = 'cbr',
 ) -> tuple:
     """
     Processes one CBZ or CBR archive.
     Returns ('success', bytes_saved), ('skipped', 0), ('no_gain', 0), or ('failed', 0).
+    Writing back goes through core.scheduler.write_behind(), so inside
+    run_files a processed file returns a Future of that tuple instead.
+    A stop between images or during rar returns ('stopped', 0) with the
+    original untouched.
     CBR output requires rar.exe in PATH; falls back to failed if unavailable.
+    With cbr_output 'cbz' / 'cbz_alongside' a CBR is converted instead
+    (_convert_cbr), which needs neither rar.exe nor a temp extraction.
+    CBZ output carries a provenance stamp (core.stamp) as ZIP comment.
+    Already processed files are redone only when the settings fingerprint is
+    more aggressive than the recorded one (or with force).
     """
     def log(msg):
         if log_callback:
             log_callback(msg)
 
-    if not should_process_file(archive_path) and not force:
+    settings = fingerprint(target_width, quality, output_format, target_ssim, crop_margins)
+    if not needs_processing(archive_path, settings, force):
         return 'skipped', 0
 
     ext = archive_path.suffix.lower()
+    if ext == '.cbr' and cbr_output != 'cbr':
+        return _convert_cbr(
+            archive_path, target_width, quality, log_callback,
+            output_format, keep_smaller, detect_grayscale, counters, crop_margins,
+            target_ssim, quality_range, encoder, keep_original=cbr_output == 'cbz_alongside',
+        )
+
     temp_dir = None
     temp_output = None
 
     try:
         original_size = os.path.getsize(archive_path)
+        if counters is not None:
+            counters["bytes_before"] = original_size
 
         temp_dir = tempfile.mkdtemp()
         extract_dir = Path(temp_dir) / 'extracted'
         extract_dir.mkdir()
 
-        if ext == '.cbz':
-            ok = _extract_cbz(archive_path, extract_dir)
-        elif ext == '.cbr':
-            ok = _extract_cbr(archive_path, extract_dir)
-        else:
+        if ext not in ('.cbz', '.cbr'):
             return 'failed', 0
 
+        with open_source(archive_path) as src:
+            if ext == '.cbz':
+                ok = _extract_cbz(src, extract_dir)
+            else:
+                ok = _extract_cbr(src, extract_dir)
+
         if not ok:
             log(f"Kan niet uitpakken: {archive_path.name}")
             return 'failed', 0
@@ -150,17 +295,27 @@ def _process_archive(
             for fn in sorted(files):
                 fp = Path(root) / fn
                 if fp.suffix.lower() in SUPPORTED_IMAGE_FORMATS:
+                    check_stop()
                     try:
                         original_data = fp.read_bytes()
                         comp_data, _, _, new_fn = _compress_image_data(
-                            original_data, fn, target_width, quality
+                            original_data, fn, target_width, quality,
+                            output_format, keep_smaller, detect_grayscale, counters,
+                            crop_margins, target_ssim, quality_range, encoder,
                         )
+                        if comp_data is original_data:
+                            continue  # not smaller: the page stays as it is
                         if new_fn != fn:
                             new_fp = fp.parent / new_fn
+                            if new_fp.exists():
+                                # e.g. 001.png next to 001.jpg — don't overwrite a page
+                                continue
                             fp.unlink()
                             fp = new_fp
                         fp.write_bytes(comp_data)
                         images_processed += 1
+                    except (BudgetExceeded, StopRequested):
+                        raise
                     except Exception as e:
                         log(f"Afbeelding fout {fn}: {e}")
 
@@ -169,7 +324,7 @@ def _process_archive(
             temp_output = f.name
 
         if ext == '.cbz':
-            packed = _pack_cbz(extract_dir, temp_output)
+            packed = _pack_cbz(extract_dir, temp_output, make_stamp('cbz', settings))
         else:
             packed = _pack_cbr(extract_dir, temp_output)
             if not packed:
@@ -181,14 +336,31 @@ def _process_archive(
             return 'failed', 0
 
         new_size = os.path.getsize(temp_output)
+        output, temp_output = temp_output, None  # owned by _commit from here on
 
-        if new_size < original_size:
+        def _commit():
+            try:
+                if new_size < original_size:
+                    return _replace(output)
+                mark_as_processed(archive_path, 'cbz', settings)
+                log(f"Geen winst: {archive_path.name}")
+                return 'no_gain', 0
+            except Exception as e:
+                log(f"Fout bij {archive_path.name}: {e}")
+                return 'failed', 0
+            finally:
+                if os.path.exists(output):
+                    os.unlink(output)
+
+        def _replace(output):
             backup = str(archive_path) + '.backup'
-            shutil.copy2(archive_path, backup)
+            with io_slot():
+                shutil.copy2(archive_path, backup)
             try:
-                shutil.copy2(temp_output, archive_path)
+                with io_slot():
+                    shutil.copy2(output, archive_path)
                 os.remove(backup)
-                mark_as_processed(archive_path)
+                mark_as_processed(archive_path, 'cbz', settings)
                 saved = original_size - new_size
                 pct = saved / original_size * 100
                 log(
@@ -202,10 +374,18 @@ def _process_archive(
                     os.remove(backup)
                 log(f"Fout bij vervangen, backup hersteld: {archive_path.name}: {e}")
                 return 'failed', 0
-        else:
-            mark_as_processed(archive_path)
-            log(f"Geen winst: {archive_path.name}")
-            return 'no_gain', 0
+
+        return write_behind(_commit)
+
+    except StopRequested:
+        log(f"Onderbroken: {archive_path.name}")
+        return 'stopped', 0
+
+    except BudgetExceeded as e:
+        log(f"Over budget: {archive_path.name} — {e}")
+        if counters is not None:
+            counters["over_budget"] = str(e)
+        return 'failed', 0
 
     except Exception as e:
         log(f"Fout bij {archive_path.name}: {e}")
@@ -221,15 +401,185 @@ def _process_archive(
                 pass
 
 
+def _convert_cbr(
+    archive_path: Path,
+    target_width: int,
+    quality: int,
+    log_callback,
+    output_format: str = 'jpeg',
+    keep_smaller: bool = False,
+    detect_grayscale: bool = False,
+    counters: dict = None,
+    crop_margins: bool = False,
+    target_ssim: float = None,
+    quality_range: tuple = (40, 90),
+    encoder: str = DEFAULT_ENCODER,
+    keep_original: bool = False,
+) -> tuple:
+    """
+    Converts one CBR to a CBZ with the same name stem. Entries are read one at
+    a time from rarfile into memory, pages are recompressed and streamed into
+    a local temp ZIP; other entries (e.g. ComicInfo.xml) are copied as-is.
+    The CBZ replaces the CBR (and its marker), or with keep_original is
+    written next to it and both get a marker. This happens even if the pages
+    don't shrink, so the comic no longer needs rar.exe. Bytes saved is 0
+    without gain and with keep_original. An existing CBZ of the same name
+    is never overwritten.
+    Returns the same statuses as _process_archive.
+    """
+    def log(msg):
+        if log_callback:
+            log_callback(msg)
+
+    settings = fingerprint(target_width, quality, output_format, target_ssim, crop_margins)
+    target = archive_path.with_suffix('.cbz')
+    if target.exists():
+        log(f"Overgeslagen, {target.name} bestaat al: {archive_path.name}")
+        return 'skipped', 0
+
+    temp_output = None
+    try:
+        import rarfile
+        original_size = os.path.getsize(archive_path)
+        if counters is not None:
+            counters["bytes_before"] = original_size
+
+        with tempfile.NamedTemporaryFile(suffix='.cbz', delete=False) as f:
+            temp_output = f.name
+
+        images_processed = 0
+        names = set()
+        with open_source(archive_path) as src, rarfile.RarFile(src) as rf, \
+                zipfile.ZipFile(temp_output, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+            zf.comment = make_stamp('cbz', settings)
+            entries = [i for i in rf.infolist() if not i.is_dir()]
+            original_names = {i.filename.replace('\\', '/') for i in entries}
+            for info in sorted(entries, key=lambda i: i.filename.lower()):
+                check_stop()
+                data = rf.read(info)
+                arcname = info.filename.replace('\\', '/')
+                if Path(arcname).suffix.lower() in SUPPORTED_IMAGE_FORMATS:
+                    comp_data, _, _, new_name = _compress_image_data(
+                        data, arcname, target_width, quality,
+                        output_format, keep_smaller, detect_grayscale, counters,
+                        crop_margins, target_ssim, quality_range, encoder,
+                    )
+                    # e.g. 001.png next to 001.jpg — don't let a renamed page
+                    # replace another one; keep the original instead
+                    if comp_data is not data and (new_name == arcname or (
+                        new_name not in original_names and new_name not in names
+                    )):
+                        data, arcname = comp_data, new_name
+                        images_processed += 1
+                if arcname in names:
+                    continue
+                names.add(arcname)
+                zf.writestr(arcname, data, zip_compress_type(arcname))
+
+        new_size = os.path.getsize(temp_output)
+        output, temp_output = temp_output, None  # owned by _commit from here on
+
+        def _commit():
+            try:
+                # Converted even without gain: the point is not needing rar.exe
+                with io_slot():
+                    shutil.copy2(output, target)
+                mark_as_processed(target, 'cbz', settings)
+                if keep_original:
+                    # Both copies stay on disk: nothing is freed
+                    mark_as_processed(archive_path, 'cbz', settings)
+                    log(
+                        f"Omgezet naar CBZ (origineel behouden): {archive_path.name} "
+                        f"— {images_processed} afb."
+                    )
+                    return 'success', 0
+                os.remove(archive_path)
+                Path(str(archive_path) + '.compressed').unlink(missing_ok=True)
+                saved = max(0, original_size - new_size)
+                pct = saved / original_size * 100 if original_size else 0
+                log(
+                    f"Omgezet naar CBZ: {archive_path.name} "
+                    f"— {images_processed} afb. — bespaard: {pct:.1f}%"
+                )
+                return 'success', saved
+            except Exception as e:
+                log(f"Fout bij {archive_path.name}: {e}")
+                return 'failed', 0
+            finally:
+                if os.path.exists(output):
+                    os.unlink(output)
+
+        return write_behind(_commit)
+
+    except StopRequested:
+        log(f"Onderbroken: {archive_path.name}")
+        return 'stopped', 0
+
+    except BudgetExceeded as e:
+        log(f"Over budget: {archive_path.name} — {e}")
+        if counters is not None:
+            counters["over_budget"] = str(e)
+        return 'failed', 0
+
+    except Exception as e:
+        log(f"Fout bij {archive_path.name}: {e}")
+        return 'failed', 0
+
+    finally:
+        if temp_output and os.path.exists(temp_output):
+            try:
+                os.unlink(temp_output)
+            except Exception:
+                pass
+
+
+@lru_cache(maxsize=None)
+def _rarfile_available() -> bool:
+    """
+    Whether rarfile is installed. Looked up once per process without
+    importing it; rarfile is only imported when a CBR is actually opened.
+    """
+    return importlib.util.find_spec('rarfile') is not None
+
+
+# Extensions handled by this tool (watch mode)
+EXTENSIONS = ('.cbz', '.cbr')
+
+
+def find_files(path) -> list:
+    """Returns all CBZ files (and CBR files if rarfile is installed) under path."""
+    start_dir = Path(path)
+    extensions = ['*.cbz']
+    if _rarfile_available():
+        extensions.append('*.cbr')
+
+    files = []
+    for ext in extensions:
+        files.extend(start_dir.rglob(ext))
+    return files
+
+
 def main(
     path,
     target_width=1200,
     quality=70,
     force=False,
+    output_format='jpeg',
+    keep_smaller=True,
+    detect_grayscale=True,
+    crop_margins=False,
+    target_ssim=None,
+    min_quality=40,
+    max_quality=90,
+    encoder_preset='smallest',
+    cbr_output='cbr',
+    watch=False,
+    watch_backend='auto',
     stop_event: threading.Event = None,
     progress_callback=None,
     log_callback=None,
     stats_callback=None,
+    lease=None,
 ):
     """
     Compresses all CBZ (and CBR if rarfile is installed) files recursively under path.
@@ -239,62 +589,149 @@ def main(
       log_callback(message)
       stats_callback(successful, skipped, failed, bytes_saved)
 
-    Returns dict: {total, successful, skipped, failed, bytes_saved}
+    output_format: one of available_output_formats(); pages are renamed to the
+    matching suffix inside the repacked archive. keep_smaller also encodes
+    each non-JPEG page as JPEG and keeps the smaller of the two.
+
+    cbr_output: 'cbr' repacks CBRs with rar.exe; 'cbz' converts them to a CBZ
+    that replaces the CBR, 'cbz_alongside' writes the CBZ next to it.
+
+    detect_grayscale: effectively grey images are encoded single-channel;
+    the count is returned as stats["grayscale"].
+
+    crop_margins: uniform white/black page margins are trimmed before
+    resizing (at most 40% of width or height); count in stats["cropped"].
+
+    target_ssim: if set, JPEG quality is chosen per image (binary search, at
+    most 4 encodes) as the lowest in [min_quality, max_quality] that reaches
+    this SSIM; stats["avg_quality"] is the mean quality used.
+
+    encoder_preset: 'fast' or 'smallest' (or an encoder name from
+    core.encoders); resolved once per run to the best available backend.
+
+    lease: optional core.scheduler.Lease; files then run in parallel within
+    the tool's share of the app-wide CPU/I/O budget, and are admitted only
+    while their estimated memory fits the app-wide memory budget. Images
+    too large to decode comfortably take a reduced-decode path
+    (stats["low_memory"]). The next files are read ahead (see
+    core.scheduler.Prefetcher) while the current one is processed.
+
+    watch: after the initial pass, keep watching path and process new or
+    changed files once they have stopped changing (core.watcher), until
+    stop_event is set. watch_backend: 'auto', 'inotify' or 'poll'.
+
+    Returns dict: {total, successful, skipped, failed, bytes_saved, grayscale, cropped,
+                  avg_quality, low_memory}
     """
+    runlog = RunLog('cbz', log_callback)
+    log_callback = runlog.message
+
     def log(msg):
         if log_callback:
             log_callback(msg)
 
-    start_dir = Path(path)
-    stats = {"total": 0, "successful": 0, "skipped": 0, "failed": 0, "bytes_saved": 0}
+    stats = {
+        "total": 0, "successful": 0, "skipped": 0, "failed": 0, "bytes_saved": 0,
+        "grayscale": 0, "cropped": 0, "avg_quality": 0, "low_memory": 0,
+    }
+    tracked = metrics.track("cbz", stats)
 
-    extensions = ['*.cbz']
     try:
-        import rarfile  # noqa: F401
-        extensions.append('*.cbr')
-    except ImportError:
-        log("rarfile niet beschikbaar — CBR bestanden worden overgeslagen")
+        if output_format not in available_output_formats():
+            log(f"Uitvoerformaat {output_format} niet ondersteund door Pillow — JPEG gebruikt")
+            output_format = 'jpeg'
 
-    files = []
-    for ext in extensions:
-        files.extend(start_dir.rglob(ext))
+        if not _rarfile_available():
+            log("rarfile niet beschikbaar — CBR bestanden worden overgeslagen")
 
-    stats["total"] = len(files)
-    log(f"Start verwerking — {stats['total']} comic bestanden gevonden")
+        if cbr_output not in CBR_OUTPUTS:
+            log(f"Onbekende CBR uitvoer {cbr_output} — CBR gebruikt")
+            cbr_output = 'cbr'
 
-    for i, comic_file in enumerate(files):
-        if stop_event and stop_event.is_set():
-            log("Verwerking gestopt door gebruiker")
-            break
+        # Created before the walk, so files added during the first pass are seen
+        watcher = (
+            Watcher(path, EXTENSIONS, backend=watch_backend, log_callback=log_callback)
+            if watch else None
+        )
+        files = find_files(path)
 
-        if progress_callback:
-            progress_callback(i, stats["total"], comic_file.name)
+        stats["total"] = len(files)
+        log(f"Start verwerking — {stats['total']} comic bestanden gevonden")
 
-        status, saved = _process_archive(
-            comic_file, target_width, quality, force, log_callback
-        )
+        encoder = resolve_preset(encoder_preset)
+        log(f"Encoder: {encoder}")
 
-        if status == 'success':
-            stats["successful"] += 1
-            stats["bytes_saved"] += saved
-        elif status in ('skipped', 'no_gain'):
-            stats["skipped"] += 1
-        else:
-            stats["failed"] += 1
+        settings = fingerprint(target_width, quality, output_format, target_ssim, crop_margins)
 
-        if stats_callback:
-            stats_callback(
-                stats["successful"], stats["skipped"],
-                stats["failed"], stats["bytes_saved"]
+        def _one(comic_file):
+            counters = {"started": time.monotonic()}
+            result = _process_archive(
+                comic_file, target_width, quality, force, log_callback,
+                output_format, keep_smaller, detect_grayscale, counters, crop_margins,
+                target_ssim, (min_quality, max_quality), encoder, cbr_output,
             )
+            return then(result, lambda r: (*r, counters))
+
+        done = 0
+        quality_sum = encoded = 0
+        for batch in file_batches(files, watcher, stop_event, log_callback, stats):
+            for comic_file, (status, saved, counters) in run_files(
+                batch, _one, stop_event, lease, estimate=estimate_archive_bytes,
+                wanted=lambda f: force or should_process_file(f, settings),
+            ):
+                done += 1
+                if progress_callback:
+                    progress_callback(done, stats["total"], comic_file.name)
+
+                if status == 'success':
+                    stats["successful"] += 1
+                    stats["bytes_saved"] += saved
+                elif status in ('skipped', 'no_gain', 'stopped'):
+                    stats["skipped"] += 1
+                else:
+                    stats["failed"] += 1
+                stats["grayscale"] += counters.get("grayscale", 0)
+                stats["low_memory"] += counters.get("low_memory", 0)
+                quality_sum += counters.get("quality_sum", 0)
+                encoded += counters.get("encoded", 0)
+                stats["cropped"] += counters.get("cropped", 0)
+
+                runlog.file_result(
+                    comic_file, status, counters.get("bytes_before"), saved,
+                    time.monotonic() - counters["started"],
+                )
+                quarantine.record(comic_file, status, counters.get("over_budget"))
+
+                if lease:
+                    lease.record(saved)
 
-    if progress_callback:
-        progress_callback(stats["total"], stats["total"], "")
+                if stats_callback:
+                    stats_callback(
+                        stats["successful"], stats["skipped"],
+                        stats["failed"], stats["bytes_saved"]
+                    )
 
-    log(
-        f"Klaar — Succesvol: {stats['successful']}, "
-        f"Overgeslagen: {stats['skipped']}, "
-        f"Mislukt: {stats['failed']}, "
-        f"Bespaard: {stats['bytes_saved'] / (1024 * 1024):.1f} MB"
-    )
+        if stop_event and stop_event.is_set():
+            log("Verwerking gestopt door gebruiker")
+
+        if encoded:
+            stats["avg_quality"] = round(quality_sum / encoded, 1)
+
+        if progress_callback:
+            progress_callback(stats["total"], stats["total"], "")
+
+        log(
+            f"Klaar — Succesvol: {stats['successful']}, "
+            f"Overgeslagen: {stats['skipped']}, "
+            f"Mislukt: {stats['failed']}, "
+            f"Bespaard: {stats['bytes_saved'] / (1024 * 1024):.1f} MB, "
+            f"Grijswaarden: {stats['grayscale']}, "
+            f"Bijgesneden: {stats['cropped']}, "
+            f"Gem. kwaliteit: {stats['avg_quality']}"
+        )
+        if stats["low_memory"]:
+            log(f"Geheugenzuinig gedecodeerd: {stats['low_memory']} afbeelding(en)")
+    finally:
+        metrics.untrack(tracked)
+        runlog.close()
     return stats
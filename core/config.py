@@ -0,0 +1,102 @@
+import copy
+import json
+from pathlib import Path
+
+DEFAULT_GS_PATH = r'C:\Program Files (x86)\gs\gs10.04.0\bin\gswin32c.exe'
+
+CONFIG_FILE = Path(__file__).parent.parent / "config.json"
+
+DEFAULT_CONFIG = {
+    "app": {
+        "cpu_workers": 0,  # 0 = number of CPU cores
+        "io_workers": 4,
+        "memory_mb": 2048,  # estimated decode/extract memory admitted at once
+        "prefetch_depth": 4,  # files read ahead to local temp storage
+        "write_behind_depth": 4,  # finished files queued for write-back
+        "adaptive_workers": True,  # tune files in flight per tool (hill climbing)
+        "min_workers": 1,
+        "max_workers": 0,  # 0 = up to the tool's CPU share
+        "file_timeout": 600,  # seconds per file before it is stopped and quarantined (0 = off)
+        "max_megapixels": 150,  # larger images fail the file and quarantine it (0 = off)
+        "metrics_port": 0,  # 0 = no HTTP endpoint; else http://127.0.0.1:<port>/metrics
+        "metrics_file": "",  # JSON snapshot rewritten every 15 s ("" = off)
+    },
+    "jpg": {
+        "path": "",
+        "target_width": 180,
+        "target_height": 270,
+        "quality": 70,
+        "detect_grayscale": True,
+        "target_ssim": None,  # None = fixed quality
+        "min_quality": 40,
+        "max_quality": 90,
+        "encoder_preset": "smallest",  # "fast" / "smallest"
+        "force": False,
+        "watch": False,
+    },
+    "epub": {
+        "path": "",
+        "target_height": 450,
+        "quality": 65,
+        "detect_grayscale": True,
+        "target_ssim": None,  # None = fixed quality
+        "min_quality": 40,
+        "max_quality": 90,
+        "encoder_preset": "smallest",  # "fast" / "smallest"
+        "crop_margins": False,
+        "force": False,
+        "watch": False,
+    },
+    "pdf": {
+        "path": "",
+        "gs_path": DEFAULT_GS_PATH,
+        "pdf_settings": "/ebook",
+        "force": False,
+        "watch": False,
+    },
+    "cbz": {
+        "path": "",
+        "target_width": 1200,
+        "quality": 70,
+        "output_format": "jpeg",
+        "keep_smaller": True,
+        "cbr_output": "cbr",
+        "detect_grayscale": True,
+        "target_ssim": None,  # None = fixed quality
+        "min_quality": 40,
+        "max_quality": 90,
+        "encoder_preset": "smallest",  # "fast" / "smallest"
+        "crop_margins": False,
+        "force": False,
+        "watch": False,
+    },
+    "library": {
+        "path": "",
+        "tools": ["jpg", "epub", "pdf", "cbz"],
+        "force": False,
+        "watch": False,
+    },
+}
+
+
+def load_config(config_file: Path = CONFIG_FILE) -> dict:
+    """Returns DEFAULT_CONFIG updated with the per-section values in config.json."""
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    if config_file.exists():
+        try:
+            with open(config_file, encoding="utf-8") as f:
+                loaded = json.load(f)
+            for key in config:
+                if key in loaded and isinstance(loaded[key], dict):
+                    config[key].update(loaded[key])
+        except Exception:
+            pass
+    return config
+
+
+def save_config(config: dict, config_file: Path = CONFIG_FILE) -> None:
+    try:
+        with open(config_file, "w", encoding="utf-8") as f:
+            json.dump(config, f, indent=2, ensure_ascii=False)
+    except Exception:
+        pass
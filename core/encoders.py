@@ -0,0 +1,154 @@
+"""
+JPEG encoder registry.
+
+Built in:
+  pillow_baseline     — Pillow, no optimize/progressive (fastest)
+  pillow_progressive  — Pillow, optimize + progressive (the app's original output)
+Optional, registered when the package is installed:
+  mozjpeg             — Pillow baseline + mozjpeg-lossless-optimization pass
+  simplejpeg          — libjpeg-turbo via simplejpeg (needs numpy)
+  turbojpeg           — libjpeg-turbo via PyTurboJPEG (needs numpy + libturbojpeg)
+
+Tabs pick a preset ("fast" / "smallest"); resolve_preset() maps it to the
+best available encoder using a small benchmark (see core.benchmark).
+"""
+import threading
+from io import BytesIO
+
+from PIL import Image
+
+DEFAULT_ENCODER = 'pillow_progressive'
+PRESETS = ('fast', 'smallest')
+
+_REGISTRY: dict = {}
+_available_cache: dict = {}
+_preset_cache: dict = {}
+_preset_lock = threading.Lock()
+
+
+def register(name: str, encode, available=lambda: True):
+    """
+    Registers encode(img, quality) -> bytes under name. available() is called
+    lazily and should return False when an optional package is missing.
+    """
+    _REGISTRY[name] = (encode, available)
+    _available_cache.pop(name, None)
+
+
+def available_encoders() -> list:
+    """Returns the registered encoder names whose dependencies are installed."""
+    names = []
+    for name, (_, available) in _REGISTRY.items():
+        if name not in _available_cache:
+            try:
+                _available_cache[name] = bool(available())
+            except Exception:
+                _available_cache[name] = False
+        if _available_cache[name]:
+            names.append(name)
+    return names
+
+
+def get_encoder(name: str):
+    """Returns the encode function for name, or the default encoder if unavailable."""
+    if name in _REGISTRY and name in available_encoders():
+        return _REGISTRY[name][0]
+    return _REGISTRY[DEFAULT_ENCODER][0]
+
+
+def resolve_preset(preset: str) -> str:
+    """
+    Maps 'fast' / 'smallest' to an encoder name. With only Pillow available
+    this is a fixed mapping; when optional backends are installed, a quick
+    benchmark on a synthetic page decides (cached per process).
+    """
+    if preset in _REGISTRY:
+        return preset
+    if preset not in PRESETS:
+        return DEFAULT_ENCODER
+
+    names = available_encoders()
+    if set(names) <= {'pillow_baseline', 'pillow_progressive'}:
+        return 'pillow_baseline' if preset == 'fast' else 'pillow_progressive'
+
+    with _preset_lock:
+        if preset not in _preset_cache:
+            from core.benchmark import benchmark_encoders, pick_encoder
+            results = benchmark_encoders(names=names, repeat=1)
+            for p in PRESETS:
+                _preset_cache[p] = pick_encoder(results, p)
+        return _preset_cache[preset]
+
+
+# ─── Built-in encoders ────────────────────────────────────────────────────────
+
+def _pillow_baseline(img: Image.Image, quality: int) -> bytes:
+    buf = BytesIO()
+    img.save(buf, 'JPEG', quality=quality)
+    return buf.getvalue()
+
+
+def _pillow_progressive(img: Image.Image, quality: int) -> bytes:
+    buf = BytesIO()
+    img.save(buf, 'JPEG', quality=quality, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+register('pillow_baseline', _pillow_baseline)
+register('pillow_progressive', _pillow_progressive)
+
+
+# ─── Optional encoders ────────────────────────────────────────────────────────
+
+def _has_module(name: str):
+    def _check():
+        try:
+            __import__(name)
+            return True
+        except ImportError:
+            return False
+    return _check
+
+
+def _mozjpeg(img: Image.Image, quality: int) -> bytes:
+    import mozjpeg_lossless_optimization
+    return mozjpeg_lossless_optimization.optimize(_pillow_baseline(img, quality))
+
+
+def _simplejpeg(img: Image.Image, quality: int) -> bytes:
+    import numpy as np
+    import simplejpeg
+    if img.mode == 'L':
+        arr = np.asarray(img)[:, :, None]
+        return simplejpeg.encode_jpeg(arr, quality=quality, colorspace='GRAY')
+    return simplejpeg.encode_jpeg(np.asarray(img.convert('RGB')), quality=quality)
+
+
+_turbo = None
+
+
+def _turbojpeg(img: Image.Image, quality: int) -> bytes:
+    global _turbo
+    import numpy as np
+    from turbojpeg import TurboJPEG, TJPF_GRAY, TJSAMP_GRAY
+    if _turbo is None:
+        _turbo = TurboJPEG()
+    if img.mode == 'L':
+        arr = np.asarray(img)[:, :, None]
+        return _turbo.encode(arr, quality=quality, pixel_format=TJPF_GRAY,
+                             jpeg_subsample=TJSAMP_GRAY)
+    return _turbo.encode(np.asarray(img.convert('RGB'))[:, :, ::-1].copy(), quality=quality)
+
+
+def _turbojpeg_available() -> bool:
+    try:
+        from turbojpeg import TurboJPEG
+        TurboJPEG()
+        return True
+    except Exception:
+        return False
+
+
+register('mozjpeg', _mozjpeg, _has_module('mozjpeg_lossless_optimization'))
+register('simplejpeg', _simplejpeg, _has_module('simplejpeg'))
+register('turbojpeg', _turbojpeg, _turbojpeg_available)
@@ -1,23 +1,83 @@
 import os
+import posixpath
+import re
 import zipfile
 import tempfile
 import shutil
 import threading
+import time
 from pathlib import Path
+from urllib.parse import quote, unquote
+from xml.etree import ElementTree
 from PIL import Image
 
-from core.shared import should_process_file, mark_as_processed
-
-
-def _compress_image_in_epub(img_path: Path, target_height: int, quality: int) -> int:
-    """Compresses an image file in the extracted EPUB directory. Returns bytes saved."""
-    temp_output = None
+from core.shared import (
+    should_process_file, needs_processing, mark_as_processed, estimate_archive_bytes,
+    zip_compress_type,
+)
+from core.encoders import DEFAULT_ENCODER, resolve_preset
+from core.stamp import make_stamp
+from core.scheduler import (
+    run_files, io_slot, write_behind, then, open_source, check_stop, StopRequested,
+    BudgetExceeded,
+)
+from core.watcher import Watcher, file_batches
+from core import metrics, quarantine
+from core.runlog import RunLog
+from core.imaging import (
+    to_grayscale_if_possible, auto_crop, encode_jpeg_auto, open_for_resize,
+    fit_size, has_transparency, is_line_art, encode_png_palette,
+)
+
+
+def _compress_image_in_epub(
+    img_path: Path,
+    target_height: int,
+    quality: int,
+    detect_grayscale: bool = False,
+    counters: dict = None,
+    crop_margins: bool = False,
+    target_ssim: float = None,
+    quality_range: tuple = (40, 90),
+    encoder: str = DEFAULT_ENCODER,
+    outputs: dict = None,
+) -> tuple:
+    """
+    Compresses an image file in the extracted EPUB directory.
+    Returns (bytes saved, path written); (0, None) if no result is smaller
+    (the file is left as is).
+
+    outputs maps the suffixes that may be written ('.jpg', '.png') to their
+    path; by default the image is re-encoded as JPEG in place. Transparent
+    images get no JPEG candidate, and transparent or line-art images get a
+    palette PNG one (see core.imaging.encode_png_palette); the smallest
+    candidate is written and img_path removed if it was written elsewhere.
+    Animated images are left alone. BudgetExceeded and StopRequested
+    propagate to _process_epub.
+    """
+    if outputs is None:
+        outputs = {'.jpg': img_path}
     try:
         with Image.open(img_path) as img:
+            if getattr(img, 'n_frames', 1) > 1:
+                return 0, None
+            img = open_for_resize(img, fit_size(img.size, max_height=target_height), counters)
+            alpha = has_transparency(img)
+            if alpha and '.png' not in outputs:
+                return 0, None
+
             original_size = os.path.getsize(img_path)
 
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGBA' if alpha else 'RGB')
+
+            cropped = False
+            if crop_margins and not alpha:
+                img, cropped = auto_crop(img)
+
+            converted = False
+            if detect_grayscale and not alpha:
+                img, converted = to_grayscale_if_possible(img)
 
             orig_w, orig_h = img.size
 
@@ -26,27 +86,203 @@ def _compress_image_in_epub(img_path: Path, target_height: int, quality: int) ->
                 new_w = int(target_height * ratio)
                 img = img.resize((new_w, target_height), Image.Resampling.LANCZOS)
 
-            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as f:
-                temp_output = f.name
+            candidates = []
+            used_quality = None
+            if '.jpg' in outputs and not alpha:
+                data, used_quality = encode_jpeg_auto(
+                    img, quality, target_ssim, *quality_range, encoder
+                )
+                candidates.append((data, '.jpg'))
+            if '.png' in outputs and (alpha or is_line_art(img)):
+                candidates.append((encode_png_palette(img), '.png'))
+
+        if not candidates:
+            return 0, None
+        data, suffix = min(candidates, key=lambda c: len(c[0]))
+        if len(data) >= original_size:
+            return 0, None
+
+        output_path = Path(outputs[suffix])
+        with open(output_path, 'wb') as f:
+            f.write(data)
+        if output_path != Path(img_path):
+            os.unlink(img_path)
+        if counters is not None:
+            if suffix == '.jpg':
+                counters["quality_sum"] = counters.get("quality_sum", 0) + used_quality
+                counters["encoded"] = counters.get("encoded", 0) + 1
+            if converted:
+                counters["grayscale"] = counters.get("grayscale", 0) + 1
+            if cropped:
+                counters["cropped"] = counters.get("cropped", 0) + 1
+        return original_size - len(data), output_path
+
+    except (BudgetExceeded, StopRequested):
+        raise
+    except Exception:
+        return 0, None
 
-            img.save(temp_output, 'JPEG', quality=quality, optimize=True, progressive=True)
 
-        compressed_size = os.path.getsize(temp_output)
+# ─── OPF manifest ─────────────────────────────────────────────────────────────
 
-        if compressed_size < original_size:
-            shutil.move(temp_output, img_path)
-            return original_size - compressed_size
-        else:
-            os.unlink(temp_output)
-            return 0
+# Raster media types in the manifest; all but JPEG and PNG are transcoded
+RASTER_MEDIA_TYPES = ('image/jpeg', 'image/jpg', 'image/png', 'image/gif', 'image/bmp', 'image/webp')
+# Files whose references to a transcoded image are rewritten
+REFERENCE_SUFFIXES = ('.xhtml', '.html', '.htm', '.css', '.svg', '.ncx', '.opf', '.xml', '.smil')
 
-    except Exception:
-        if temp_output and os.path.exists(temp_output):
-            try:
-                os.unlink(temp_output)
-            except Exception:
-                pass
-        return 0
+# Suffixes an image can be written with -> media type
+OUTPUT_MEDIA_TYPES = {'.jpg': 'image/jpeg', '.png': 'image/png'}
+
+_CONTAINER = 'META-INF/container.xml'
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def _archive_path(extract_dir: str, path: str):
+    """
+    Returns path (a href resolved against the archive root) as a normalised
+    archive path, or None if it resolves outside extract_dir — an absolute
+    href, '../' past the root, or a symlink. Crafted books must not make us
+    read, write or delete files elsewhere.
+    """
+    root = os.path.realpath(extract_dir)
+    full = os.path.realpath(os.path.join(root, path))
+    try:
+        if full == root or os.path.commonpath([root, full]) != root:
+            return None
+    except ValueError:  # different drive
+        return None
+    return os.path.relpath(full, root).replace(os.sep, '/')
+
+
+def _opf_paths(extract_dir: str) -> list:
+    """Package document paths (relative to extract_dir) from META-INF/container.xml."""
+    try:
+        root = ElementTree.parse(os.path.join(extract_dir, _CONTAINER)).getroot()
+    except (OSError, ElementTree.ParseError):
+        return []
+    paths = (
+        _archive_path(extract_dir, el.get('full-path')) for el in root.iter()
+        if _local_name(el.tag) == 'rootfile' and el.get('full-path')
+    )
+    return [p for p in paths if p is not None]
+
+
+def _manifest_images(extract_dir: str, opf_path: str) -> list:
+    """
+    Returns [(archive path, media type)] of the raster images in the manifest
+    of opf_path that exist in extract_dir.
+    """
+    try:
+        root = ElementTree.parse(os.path.join(extract_dir, opf_path)).getroot()
+    except (OSError, ElementTree.ParseError):
+        return []
+    opf_dir = posixpath.dirname(opf_path)
+    images = []
+    for el in root.iter():
+        media_type = (el.get('media-type') or '').lower()
+        if _local_name(el.tag) != 'item' or media_type not in RASTER_MEDIA_TYPES:
+            continue
+        href = unquote(el.get('href', '').split('#', 1)[0])
+        path = _archive_path(extract_dir, posixpath.join(opf_dir, href))
+        if path is not None and os.path.isfile(os.path.join(extract_dir, path)):
+            images.append((path, media_type))
+    return images
+
+
+def _output_name(extract_dir: str, path: str, suffix: str, taken: set):
+    """
+    Archive path for the suffix version of path: path itself if it already
+    has that type, else a free name (a.gif -> a.png, else a_gif.png).
+    """
+    stem, ext = posixpath.splitext(path)
+    if ext.lower() == suffix or (suffix == '.jpg' and ext.lower() == '.jpeg'):
+        return path
+    for candidate in (stem + suffix, f"{stem}_{ext.lstrip('.').lower()}{suffix}"):
+        if candidate not in taken and not os.path.exists(os.path.join(extract_dir, candidate)):
+            return candidate
+    return None
+
+
+def _update_manifest(extract_dir: str, opf_path: str, renames: dict):
+    """
+    Points the manifest items of renamed images at their new path and its
+    media type (OUTPUT_MEDIA_TYPES). Edits the <item> tags as text, so the rest of the
+    package document (prefixes, formatting) stays byte for byte the same.
+    """
+    full = os.path.join(extract_dir, opf_path)
+    opf_dir = posixpath.dirname(opf_path)
+    with open(full, encoding='utf-8', errors='surrogateescape') as f:
+        text = f.read()
+
+    def _item(match):
+        tag = match.group(0)
+        href = re.search(r'\bhref\s*=\s*(["\'])(.*?)\1', tag)
+        if href is None:
+            return tag
+        path = _archive_path(extract_dir, posixpath.join(opf_dir, unquote(href.group(2))))
+        new_path = renames.get(path)
+        if new_path is None:
+            return tag
+        new_href = quote(posixpath.relpath(new_path, opf_dir or '.'))
+        tag = tag[:href.start(2)] + new_href + tag[href.end(2):]
+        media_type = OUTPUT_MEDIA_TYPES[posixpath.splitext(new_path)[1].lower()]
+        return re.sub(
+            r'(\bmedia-type\s*=\s*(["\']))[^"\']*(\2)',
+            lambda m: m.group(1) + media_type + m.group(3), tag, count=1,
+        )
+
+    new_text = re.sub(r'<(?:\w+:)?item\b[^>]*>', _item, text)
+    if new_text != text:
+        with open(full, 'w', encoding='utf-8', errors='surrogateescape') as f:
+            f.write(new_text)
+
+
+def _rewrite_references(extract_dir: str, renames: dict):
+    """
+    Rewrites references to renamed images (src, href, xlink:href, url(...))
+    in every XHTML/CSS/SVG/NCX/OPF file, relative to that file's folder.
+    Only files and renames inside extract_dir are touched.
+    """
+    renames = {
+        old: new for old, new in renames.items()
+        if _archive_path(extract_dir, old) == old and _archive_path(extract_dir, new) == new
+    }
+    for root, _, files in os.walk(extract_dir):
+        for file in files:
+            if not file.lower().endswith(REFERENCE_SUFFIXES):
+                continue
+            full = os.path.join(root, file)
+            rel = _archive_path(extract_dir, os.path.relpath(full, extract_dir))
+            if rel is None:
+                continue
+            here = posixpath.dirname(rel)
+            with open(full, encoding='utf-8', errors='surrogateescape') as f:
+                text = f.read()
+            new_text = text
+            for old, new in renames.items():
+                old_ref = posixpath.relpath(old, here or '.')
+                new_ref = posixpath.relpath(new, here or '.')
+                for old_form, new_form in ((old_ref, new_ref), (quote(old_ref), quote(new_ref))):
+                    if old_form not in new_text:
+                        continue
+                    new_text = re.sub(
+                        r'(["\'(\s](?:\./)?)' + re.escape(old_form) + r'(?=["\')#?\s])',
+                        lambda m: m.group(1) + new_form, new_text,
+                    )
+            if new_text != text:
+                with open(full, 'w', encoding='utf-8', errors='surrogateescape') as f:
+                    f.write(new_text)
+
+
+def fingerprint(target_height, quality, target_ssim=None, crop_margins=False) -> dict:
+    """Settings fingerprint recorded with each processed file (see core.shared)."""
+    return {
+        "target_height": target_height, "quality": quality,
+        "target_ssim": target_ssim, "crop_margins": crop_margins,
+    }
 
 
 def _process_epub(
@@ -55,42 +291,97 @@ def _process_epub(
     quality: int,
     force: bool,
     log_callback,
+    detect_grayscale: bool = False,
+    counters: dict = None,
+    crop_margins: bool = False,
+    target_ssim: float = None,
+    quality_range: tuple = (40, 90),
+    encoder: str = DEFAULT_ENCODER,
 ) -> tuple:
     """
     Processes one EPUB: extracts, compresses images, repacks.
+    Images are taken from the OPF manifest. JPEGs are re-encoded in place;
+    PNG/GIF/BMP/WebP images without transparency are transcoded to JPEG
+    when that is smaller, with the manifest item (href, media-type) and all
+    XHTML/CSS/SVG references updated.
     Returns ('success', bytes_saved), ('skipped', 0), ('no_gain', 0), or ('failed', 0).
+    Writing back goes through core.scheduler.write_behind(), so inside
+    run_files a processed file returns a Future of that tuple instead.
+    A stop between images returns ('stopped', 0) with the original untouched.
+    The repacked EPUB carries a provenance stamp (core.stamp) as ZIP comment.
+    Already processed files are redone only when the settings fingerprint is
+    more aggressive than the recorded one (or with force).
     """
     def log(msg):
         if log_callback:
             log_callback(msg)
 
-    if not should_process_file(epub_path) and not force:
+    settings = fingerprint(target_height, quality, target_ssim, crop_margins)
+    if not needs_processing(epub_path, settings, force):
         return 'skipped', 0
 
+    temp_epub = None
     try:
         original_size = os.path.getsize(epub_path)
+        if counters is not None:
+            counters["bytes_before"] = original_size
+
+        # Outside temp_dir: the repacked EPUB outlives it until written back
+        fd, temp_epub = tempfile.mkstemp(suffix='.epub')
+        os.close(fd)
 
         with tempfile.TemporaryDirectory() as temp_dir:
             extract_dir = os.path.join(temp_dir, 'book')
             os.makedirs(extract_dir)
 
-            with zipfile.ZipFile(epub_path, 'r') as zf:
+            with open_source(epub_path) as src, zipfile.ZipFile(src, 'r') as zf:
                 zf.extractall(extract_dir)
 
             images_processed = 0
 
-            for root, _, files in os.walk(extract_dir):
-                for file in files:
-                    if file.lower().endswith(('.jpg', '.jpeg', '.png')):
-                        saved = _compress_image_in_epub(
-                            Path(root) / file, target_height, quality
-                        )
-                        if saved > 0:
-                            images_processed += 1
-
-            # Repack as EPUB (ZIP)
-            temp_epub = os.path.join(temp_dir, 'compressed.epub')
+            # Raster images from the manifest(s): archive path -> media type
+            opf_paths = _opf_paths(extract_dir)
+            images = {}
+            for opf_path in opf_paths:
+                images.update(_manifest_images(extract_dir, opf_path))
+            if not opf_paths:
+                # No readable container.xml: only JPEGs, re-encoded in place
+                for root, _, files in os.walk(extract_dir):
+                    for file in files:
+                        if file.lower().endswith(('.jpg', '.jpeg')):
+                            rel = os.path.relpath(os.path.join(root, file), extract_dir)
+                            images[rel.replace(os.sep, '/')] = 'image/jpeg'
+
+            renames = {}  # archive path -> path of its re-encoded version
+            for path in sorted(images):
+                check_stop()
+                # Without a manifest to update, images can't change type
+                suffixes = OUTPUT_MEDIA_TYPES if opf_paths else ('.jpg',)
+                taken = set(renames.values())
+                outputs = {}
+                for suffix in suffixes:
+                    name = _output_name(extract_dir, path, suffix, taken)
+                    if name is not None:
+                        outputs[suffix] = Path(extract_dir, name)
+                saved, written = _compress_image_in_epub(
+                    Path(extract_dir, path), target_height, quality,
+                    detect_grayscale, counters, crop_margins,
+                    target_ssim, quality_range, encoder, outputs,
+                )
+                if saved > 0:
+                    images_processed += 1
+                    new_path = os.path.relpath(written, extract_dir).replace(os.sep, '/')
+                    if new_path != path:
+                        renames[path] = new_path
+
+            if renames:
+                for opf_path in opf_paths:
+                    _update_manifest(extract_dir, opf_path, renames)
+                _rewrite_references(extract_dir, renames)
+
+            # Repack as EPUB (ZIP); images and fonts are stored, text deflated
             with zipfile.ZipFile(temp_epub, 'w', zipfile.ZIP_DEFLATED) as zf:
+                zf.comment = make_stamp('epub', settings)
                 # mimetype must be first and uncompressed
                 mimetype_path = os.path.join(extract_dir, 'mimetype')
                 if os.path.exists(mimetype_path):
@@ -101,39 +392,85 @@ def _process_epub(
                         file_path = os.path.join(root, file)
                         arcname = os.path.relpath(file_path, extract_dir)
                         if file != 'mimetype':
-                            zf.write(file_path, arcname)
-
-            new_size = os.path.getsize(temp_epub)
-
-            if new_size < original_size:
-                shutil.move(temp_epub, epub_path)
-                mark_as_processed(epub_path)
-                saved = original_size - new_size
-                pct = saved / original_size * 100
-                log(
-                    f"Gecomprimeerd: {epub_path.name} "
-                    f"— {images_processed} afb. — bespaard: {pct:.1f}%"
-                )
-                return 'success', saved
-            else:
-                mark_as_processed(epub_path)
+                            zf.write(file_path, arcname, zip_compress_type(arcname))
+
+        new_size = os.path.getsize(temp_epub)
+        output, temp_epub = temp_epub, None  # owned by _commit from here on
+
+        def _commit():
+            try:
+                if new_size < original_size:
+                    with io_slot():
+                        shutil.move(output, epub_path)
+                    mark_as_processed(epub_path, 'epub', settings)
+                    saved = original_size - new_size
+                    pct = saved / original_size * 100
+                    log(
+                        f"Gecomprimeerd: {epub_path.name} "
+                        f"— {images_processed} afb. — bespaard: {pct:.1f}%"
+                    )
+                    return 'success', saved
+                mark_as_processed(epub_path, 'epub', settings)
                 log(f"Geen winst: {epub_path.name}")
                 return 'no_gain', 0
+            except Exception as e:
+                log(f"Fout bij {epub_path.name}: {e}")
+                return 'failed', 0
+            finally:
+                if os.path.exists(output):
+                    os.unlink(output)
+
+        return write_behind(_commit)
+
+    except StopRequested:
+        log(f"Onderbroken: {epub_path.name}")
+        return 'stopped', 0
+
+    except BudgetExceeded as e:
+        log(f"Over budget: {epub_path.name} — {e}")
+        if counters is not None:
+            counters["over_budget"] = str(e)
+        return 'failed', 0
 
     except Exception as e:
         log(f"Fout bij {epub_path.name}: {e}")
         return 'failed', 0
 
+    finally:
+        if temp_epub and os.path.exists(temp_epub):
+            try:
+                os.unlink(temp_epub)
+            except Exception:
+                pass
+
+
+# Extensions handled by this tool (watch mode)
+EXTENSIONS = ('.epub',)
+
+
+def find_files(path) -> list:
+    """Returns all EPUB files recursively under path."""
+    return list(Path(path).rglob('*.epub'))
+
 
 def main(
     path,
     target_height=450,
     quality=65,
     force=False,
+    detect_grayscale=True,
+    crop_margins=False,
+    target_ssim=None,
+    min_quality=40,
+    max_quality=90,
+    encoder_preset='smallest',
+    watch=False,
+    watch_backend='auto',
     stop_event: threading.Event = None,
     progress_callback=None,
     log_callback=None,
     stats_callback=None,
+    lease=None,
 ):
     """
     Compresses all EPUB files recursively under path.
@@ -143,50 +480,130 @@ def main(
       log_callback(message)
       stats_callback(successful, skipped, failed, bytes_saved)
 
-    Returns dict: {total, successful, skipped, failed, bytes_saved}
+    detect_grayscale: effectively grey images are encoded single-channel;
+    the count is returned as stats["grayscale"].
+
+    crop_margins: uniform white/black page margins are trimmed before
+    resizing (at most 40% of width or height); count in stats["cropped"].
+
+    target_ssim: if set, JPEG quality is chosen per image (binary search, at
+    most 4 encodes) as the lowest in [min_quality, max_quality] that reaches
+    this SSIM; stats["avg_quality"] is the mean quality used.
+
+    encoder_preset: 'fast' or 'smallest' (or an encoder name from
+    core.encoders); resolved once per run to the best available backend.
+
+    lease: optional core.scheduler.Lease; files then run in parallel within
+    the tool's share of the app-wide CPU/I/O budget, and are admitted only
+    while their estimated memory fits the app-wide memory budget. Images
+    too large to decode comfortably take a reduced-decode path
+    (stats["low_memory"]). The next files are read ahead (see
+    core.scheduler.Prefetcher) while the current one is processed.
+
+    watch: after the initial pass, keep watching path and process new or
+    changed files once they have stopped changing (core.watcher), until
+    stop_event is set. watch_backend: 'auto', 'inotify' or 'poll'.
+
+    Returns dict: {total, successful, skipped, failed, bytes_saved, grayscale, cropped,
+                  avg_quality, low_memory}
     """
+    runlog = RunLog('epub', log_callback)
+    log_callback = runlog.message
+
     def log(msg):
         if log_callback:
             log_callback(msg)
 
-    start_dir = Path(path)
-    stats = {"total": 0, "successful": 0, "skipped": 0, "failed": 0, "bytes_saved": 0}
+    stats = {
+        "total": 0, "successful": 0, "skipped": 0, "failed": 0, "bytes_saved": 0,
+        "grayscale": 0, "cropped": 0, "avg_quality": 0, "low_memory": 0,
+    }
+    tracked = metrics.track("epub", stats)
+
+    try:
+        # Created before the walk, so files added during the first pass are seen
+        watcher = (
+            Watcher(path, EXTENSIONS, backend=watch_backend, log_callback=log_callback)
+            if watch else None
+        )
+        files = find_files(path)
+        stats["total"] = len(files)
+        log(f"Start verwerking — {stats['total']} EPUB bestanden gevonden")
+
+        encoder = resolve_preset(encoder_preset)
+        log(f"Encoder: {encoder}")
+
+        settings = fingerprint(target_height, quality, target_ssim, crop_margins)
+
+        def _one(epub_file):
+            counters = {"started": time.monotonic()}
+            result = _process_epub(
+                epub_file, target_height, quality, force, log_callback,
+                detect_grayscale, counters, crop_margins,
+                target_ssim, (min_quality, max_quality), encoder,
+            )
+            return then(result, lambda r: (*r, counters))
+
+        done = 0
+        quality_sum = encoded = 0
+        for batch in file_batches(files, watcher, stop_event, log_callback, stats):
+            for epub_file, (status, saved, counters) in run_files(
+                batch, _one, stop_event, lease, estimate=estimate_archive_bytes,
+                wanted=lambda f: force or should_process_file(f, settings),
+            ):
+                done += 1
+                if progress_callback:
+                    progress_callback(done, stats["total"], epub_file.name)
+
+                if status == 'success':
+                    stats["successful"] += 1
+                    stats["bytes_saved"] += saved
+                elif status in ('skipped', 'no_gain', 'stopped'):
+                    stats["skipped"] += 1
+                else:
+                    stats["failed"] += 1
+                stats["grayscale"] += counters.get("grayscale", 0)
+                stats["low_memory"] += counters.get("low_memory", 0)
+                quality_sum += counters.get("quality_sum", 0)
+                encoded += counters.get("encoded", 0)
+                stats["cropped"] += counters.get("cropped", 0)
+
+                runlog.file_result(
+                    epub_file, status, counters.get("bytes_before"), saved,
+                    time.monotonic() - counters["started"],
+                )
+                quarantine.record(epub_file, status, counters.get("over_budget"))
 
-    files = list(start_dir.rglob('*.epub'))
-    stats["total"] = len(files)
-    log(f"Start verwerking — {stats['total']} EPUB bestanden gevonden")
+                if lease:
+                    lease.record(saved)
+
+                if stats_callback:
+                    stats_callback(
+                        stats["successful"], stats["skipped"],
+                        stats["failed"], stats["bytes_saved"]
+                    )
 
-    for i, epub_file in enumerate(files):
         if stop_event and stop_event.is_set():
             log("Verwerking gestopt door gebruiker")
-            break
 
-        if progress_callback:
-            progress_callback(i, stats["total"], epub_file.name)
-
-        status, saved = _process_epub(epub_file, target_height, quality, force, log_callback)
-
-        if status == 'success':
-            stats["successful"] += 1
-            stats["bytes_saved"] += saved
-        elif status in ('skipped', 'no_gain'):
-            stats["skipped"] += 1
-        else:
-            stats["failed"] += 1
-
-        if stats_callback:
-            stats_callback(
-                stats["successful"], stats["skipped"],
-                stats["failed"], stats["bytes_saved"]
-            )
-
-    if progress_callback:
-        progress_callback(stats["total"], stats["total"], "")
+        if encoded:
+            stats["avg_quality"] = round(quality_sum / encoded, 1)
 
-    log(
-        f"Klaar — Succesvol: {stats['successful']}, "
-        f"Overgeslagen: {stats['skipped']}, "
-        f"Mislukt: {stats['failed']}, "
-        f"Bespaard: {stats['bytes_saved'] / (1024 * 1024):.1f} MB"
-    )
+        if progress_callback:
+            progress_callback(stats["total"], stats["total"], "")
+
+        log(
+            f"Klaar — Succesvol: {stats['successful']}, "
+            f"Overgeslagen: {stats['skipped']}, "
+            f"Mislukt: {stats['failed']}, "
+            f"Bespaard: {stats['bytes_saved'] / (1024 * 1024):.1f} MB, "
+            f"Grijswaarden: {stats['grayscale']}, "
+            f"Bijgesneden: {stats['cropped']}, "
+            f"Gem. kwaliteit: {stats['avg_quality']}"
+        )
+        if stats["low_memory"]:
+            log(f"Geheugenzuinig gedecodeerd: {stats['low_memory']} afbeelding(en)")
+    finally:
+        metrics.untrack(tracked)
+        runlog.close()
     return stats
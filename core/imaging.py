@@ -0,0 +1,334 @@
+from io import BytesIO
+
+from PIL import Image, ImageChops, ImageMath
+
+from core.encoders import DEFAULT_ENCODER, get_encoder
+from core.scheduler import open_source, check_pixels
+
+# Max per-pixel channel spread (0-255) that still counts as grey
+GRAYSCALE_THRESHOLD = 10
+# Fraction of thumbnail pixels that may exceed the threshold (JPEG noise, specks)
+GRAYSCALE_TOLERANCE = 0.005
+_THUMB_SIZE = (96, 96)
+
+
+def is_grayscale(img: Image.Image, threshold: int = GRAYSCALE_THRESHOLD) -> bool:
+    """
+    Returns True if img is effectively grey: on a downsampled thumbnail, nearly
+    all pixels have max(|R-G|, |G-B|) <= threshold. Uses Pillow channel ops so
+    the check runs in C on a few thousand pixels.
+    """
+    if img.mode in ('1', 'L', 'LA', 'I', 'I;16', 'F'):
+        return True
+
+    # Sampled straight from img: no full-size copy of a large page
+    thumb = img.resize(_THUMB_SIZE, Image.Resampling.NEAREST).convert('RGB')
+
+    r, g, b = thumb.split()
+    spread = ImageChops.lighter(ImageChops.difference(r, g), ImageChops.difference(g, b))
+    hist = spread.histogram()
+    coloured = sum(hist[threshold + 1:])
+    return coloured <= GRAYSCALE_TOLERANCE * (thumb.width * thumb.height)
+
+
+def to_grayscale_if_possible(img: Image.Image) -> tuple:
+    """
+    Converts img to single-channel 'L' when is_grayscale() says so.
+    Returns (image, converted). Images with real transparency are left alone.
+    """
+    if img.mode in ('L', '1'):
+        return img, False
+    if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+        return img, False
+    if not is_grayscale(img):
+        return img, False
+    return img.convert('L'), True
+
+
+def has_transparency(img: Image.Image) -> bool:
+    """
+    True if img has pixels that aren't fully opaque: an alpha channel that is
+    actually used, or a transparent palette entry / colour key.
+    """
+    if img.mode in ('RGBA', 'LA', 'PA'):
+        return img.getchannel('A').getextrema()[0] < 255
+    if 'transparency' in img.info:
+        return img.convert('RGBA').getchannel('A').getextrema()[0] < 255
+    return False
+
+
+# Max difference (0-255) from the border colour that still counts as margin
+CROP_TOLERANCE = 24
+# Never remove more than this fraction of the width or height
+CROP_MAX_FRACTION = 0.40
+# Margins narrower than this fraction of a side are not worth a crop
+CROP_MIN_FRACTION = 0.02
+_CROP_PROBE = 256
+
+
+def find_content_bbox(
+    img: Image.Image,
+    tolerance: int = CROP_TOLERANCE,
+    max_fraction: float = CROP_MAX_FRACTION,
+):
+    """
+    Returns the (left, top, right, bottom) box of img without its uniform
+    margins, or None if there is nothing worth trimming or the trim would
+    exceed max_fraction of the width or height.
+
+    Works on a small probe resized straight from img (never a full-size
+    copy): the border colour is taken from the corners, the probe is diffed
+    against it with ImageChops and the bounding box of everything above
+    tolerance is scaled back up.
+    """
+    scale = min(1.0, _CROP_PROBE / max(img.size))
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    if img.mode in ('RGB', 'L', 'RGBA', 'LA'):
+        probe = img.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+    else:
+        probe = img.resize(size, Image.Resampling.NEAREST)
+    if probe.mode not in ('RGB', 'L'):
+        probe = probe.convert('RGB')
+    pw, ph = probe.size
+    if pw < 8 or ph < 8:
+        return None
+
+    corners = [probe.getpixel(xy) for xy in ((0, 0), (pw - 1, 0), (0, ph - 1), (pw - 1, ph - 1))]
+    border = max(set(corners), key=corners.count)
+
+    diff = ImageChops.difference(probe, Image.new(probe.mode, probe.size, border))
+    if diff.mode != 'L':
+        r, g, b = diff.split()
+        diff = ImageChops.lighter(ImageChops.lighter(r, g), b)
+    bbox = diff.point(lambda v: 255 if v > tolerance else 0).getbbox()
+    if bbox is None:
+        return None  # blank page
+
+    sx, sy = img.width / pw, img.height / ph
+    # One probe pixel of padding so resampling blur doesn't eat content
+    left = max(0, int((bbox[0] - 1) * sx))
+    top = max(0, int((bbox[1] - 1) * sy))
+    right = min(img.width, int((bbox[2] + 1) * sx + 0.999))
+    bottom = min(img.height, int((bbox[3] + 1) * sy + 0.999))
+
+    removed_w = 1 - (right - left) / img.width
+    removed_h = 1 - (bottom - top) / img.height
+    if removed_w > max_fraction or removed_h > max_fraction:
+        return None
+    if removed_w < CROP_MIN_FRACTION and removed_h < CROP_MIN_FRACTION:
+        return None
+    return left, top, right, bottom
+
+
+def auto_crop(img: Image.Image) -> tuple:
+    """Crops uniform margins from img. Returns (image, cropped)."""
+    bbox = find_content_bbox(img)
+    if bbox is None:
+        return img, False
+    return img.crop(bbox), True
+
+
+# Palette PNG branch: at most this many colours
+PALETTE_COLOURS = 256
+# Line art: the _PALETTE_PROBE most common colours (6 bits per channel) of a
+# thumbnail cover at least this fraction of it
+LINE_ART_COVERAGE = 0.85
+_PALETTE_PROBE = 8
+
+
+def is_line_art(img: Image.Image) -> bool:
+    """
+    True for flat-colour art and line drawings — few dominant colours, which
+    JPEG renders blotchy and a palette PNG holds exactly. Sampled with
+    nearest-neighbour, so no new in-between colours are introduced.
+    """
+    thumb = img.resize(_THUMB_SIZE, Image.Resampling.NEAREST).convert('RGB')
+    thumb = thumb.point(lambda v: v & 0xFC)  # merge JPEG noise
+    colours = thumb.getcolors(_THUMB_SIZE[0] * _THUMB_SIZE[1])
+    top = sorted((count for count, _ in colours), reverse=True)[:_PALETTE_PROBE]
+    return sum(top) >= LINE_ART_COVERAGE * _THUMB_SIZE[0] * _THUMB_SIZE[1]
+
+
+def encode_png_palette(img: Image.Image, colours: int = PALETTE_COLOURS) -> bytes:
+    """
+    Returns optimized PNG data of img quantized to an adaptive palette of up
+    to colours, keeping transparency. Greyscale images stay 8-bit grey.
+    """
+    if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info:
+        quantized = img.convert('RGBA').quantize(
+            colours, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE
+        )
+    elif img.mode == 'L':
+        quantized = img
+    else:
+        quantized = img.convert('RGB').quantize(colours, dither=Image.Dither.NONE)
+    buf = BytesIO()
+    quantized.save(buf, 'PNG', optimize=True)
+    return buf.getvalue()
+
+
+# Perceptual-target quality search
+TARGET_SSIM = 0.97
+TARGET_MIN_QUALITY = 40
+TARGET_MAX_QUALITY = 90
+TARGET_MAX_ENCODES = 4
+_SSIM_BLOCK = 8
+_SSIM_C1 = (0.01 * 255) ** 2
+_SSIM_C2 = (0.03 * 255) ** 2
+
+# Pillow >= 10.3 renamed ImageMath.eval; the expressions below are constants
+_image_math = getattr(ImageMath, 'unsafe_eval', None) or ImageMath.eval
+
+
+def encode_jpeg(img: Image.Image, quality: int, encoder: str = DEFAULT_ENCODER) -> bytes:
+    """Encodes img as JPEG with the named backend from core.encoders."""
+    return get_encoder(encoder)(img, quality)
+
+
+def ssim(reference: Image.Image, candidate: Image.Image) -> float:
+    """
+    Mean SSIM of the luminance of two equally sized images over 8x8 blocks.
+
+    Block means, variances and covariance come from BOX-downscaling float
+    images, and the SSIM formula runs as one ImageMath expression over the
+    block grid, so no per-pixel Python is involved.
+    """
+    x = reference.convert('L').convert('F')
+    y = candidate.convert('L').convert('F')
+    grid = (max(1, x.width // _SSIM_BLOCK), max(1, x.height // _SSIM_BLOCK))
+
+    def block_mean(im):
+        return im.resize(grid, Image.Resampling.BOX)
+
+    mx, my = block_mean(x), block_mean(y)
+    mxx = block_mean(_image_math("a * a", a=x))
+    myy = block_mean(_image_math("a * a", a=y))
+    mxy = block_mean(_image_math("a * b", a=x, b=y))
+
+    ssim_map = _image_math(
+        "((2 * mx * my + c1) * (2 * (mxy - mx * my) + c2)) / "
+        "((mx * mx + my * my + c1) * ((mxx - mx * mx) + (myy - my * my) + c2))",
+        mx=mx, my=my, mxx=mxx, myy=myy, mxy=mxy, c1=_SSIM_C1, c2=_SSIM_C2,
+    )
+    return ssim_map.resize((1, 1), Image.Resampling.BOX).getpixel((0, 0))
+
+
+def encode_jpeg_for_target(
+    img: Image.Image,
+    target: float = TARGET_SSIM,
+    min_quality: int = TARGET_MIN_QUALITY,
+    max_quality: int = TARGET_MAX_QUALITY,
+    max_encodes: int = TARGET_MAX_ENCODES,
+    encoder: str = DEFAULT_ENCODER,
+) -> tuple:
+    """
+    Binary-searches the lowest JPEG quality in [min_quality, max_quality]
+    whose SSIM against img reaches target, using at most max_encodes encodes.
+    If no probe reaches the target, the last encode is at max_quality.
+    Returns (jpeg_bytes, quality).
+    """
+    lo, hi = min_quality, max_quality
+    best = None
+    for attempt in range(max_encodes):
+        last = attempt == max_encodes - 1
+        if last and best is None:
+            q = max_quality
+        else:
+            q = (lo + hi) // 2
+        data = encode_jpeg(img, q, encoder)
+        with Image.open(BytesIO(data)) as decoded:
+            score = ssim(img, decoded)
+        if score >= target:
+            best = (data, q)
+            hi = q - 1
+        else:
+            lo = q + 1
+        if lo > hi or (last and best is None):
+            break
+    if best is None:
+        best = (data, q)
+    return best
+
+
+def encode_jpeg_auto(
+    img: Image.Image,
+    quality: int,
+    target_ssim: float = None,
+    min_quality: int = TARGET_MIN_QUALITY,
+    max_quality: int = TARGET_MAX_QUALITY,
+    encoder: str = DEFAULT_ENCODER,
+) -> tuple:
+    """
+    Encodes img at the fixed quality, or — when target_ssim is set — at the
+    lowest quality in [min_quality, max_quality] that reaches it.
+    Returns (jpeg_bytes, quality_used).
+    """
+    if target_ssim:
+        return encode_jpeg_for_target(
+            img, target_ssim, min_quality, max_quality, encoder=encoder
+        )
+    return encode_jpeg(img, quality, encoder), quality
+
+
+# Decoded copies alive at once while converting / cropping / resizing
+DECODE_OVERHEAD = 3
+# Above this estimate an image takes the low-memory decode path
+LOW_MEMORY_BYTES = 256 * 1024 * 1024
+
+
+def estimate_decoded_bytes(img: Image.Image) -> int:
+    """Working-set estimate from the header only (img must not be loaded yet)."""
+    return img.width * img.height * len(img.getbands()) * DECODE_OVERHEAD
+
+
+def estimate_image_file(path) -> int:
+    """
+    Opens only the header of path (its read-ahead copy, if the current worker
+    has one) and returns estimate_decoded_bytes().
+    """
+    with open_source(path) as src, Image.open(src) as img:
+        return estimate_decoded_bytes(img)
+
+
+def fit_size(size: tuple, max_width: int = None, max_height: int = None) -> tuple:
+    """Returns size scaled down (keeping aspect) to fit the given bounds."""
+    w, h = size
+    scale = 1.0
+    if max_width and w > max_width:
+        scale = min(scale, max_width / w)
+    if max_height and h > max_height:
+        scale = min(scale, max_height / h)
+    return max(1, int(w * scale)), max(1, int(h * scale))
+
+
+def reduced_decode(img: Image.Image, min_size: tuple) -> Image.Image:
+    """
+    Low-memory decode for huge images: JPEGs are decoded at 1/2..1/8 scale via
+    draft(); other formats are decoded and immediately reduce()d by an integer
+    factor, before any convert/crop copies are made. The result is never
+    smaller than min_size.
+    """
+    min_w, min_h = max(1, min_size[0]), max(1, min_size[1])
+    if img.format == 'JPEG':
+        img.draft('L' if img.mode == 'L' else 'RGB', (min_w, min_h))
+    img.load()
+    factor = min(img.width // min_w, img.height // min_h)
+    if factor >= 2:
+        img = img.reduce(factor)
+    return img
+
+
+def open_for_resize(img: Image.Image, target_size: tuple, counters: dict = None) -> Image.Image:
+    """
+    Returns img unchanged, or a reduced decode of it when its estimated working
+    set exceeds LOW_MEMORY_BYTES (counted in counters["low_memory"]).
+    target_size is the final size the caller will resize to.
+    Raises core.scheduler.BudgetExceeded for images over the per-file pixel
+    budget, before anything is decoded.
+    """
+    check_pixels(img.size)
+    if estimate_decoded_bytes(img) <= LOW_MEMORY_BYTES:
+        return img
+    if counters is not None:
+        counters["low_memory"] = counters.get("low_memory", 0) + 1
+    return reduced_decode(img, target_size)
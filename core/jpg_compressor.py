@@ -2,10 +2,36 @@ import os
 import tempfile
 import shutil
 import threading
+import time
+from io import BytesIO
 from pathlib import Path
 from PIL import Image
 
-from core.shared import should_process_file, mark_as_processed
+from core.shared import should_process_file, needs_processing, mark_as_processed
+from core.encoders import DEFAULT_ENCODER, resolve_preset
+from core.scheduler import (
+    run_files, io_slot, write_behind, defer_write, then, read_source, BudgetExceeded,
+)
+from core.stamp import make_stamp, stamp_jpeg
+from core.watcher import Watcher, file_batches
+from core import metrics, quarantine
+from core.runlog import RunLog
+from core.imaging import (
+    to_grayscale_if_possible, encode_jpeg_auto, open_for_resize, estimate_image_file,
+)
+
+# Files up to this size (typical Calibre covers) skip the temp-file round trip
+SMALL_FILE_BYTES = 512 * 1024
+# Minimum seconds between progress/stats callbacks
+REPORT_INTERVAL = 0.2
+
+
+def fingerprint(target_width, target_height, quality, target_ssim=None) -> dict:
+    """Settings fingerprint recorded with each processed file (see core.shared)."""
+    return {
+        "target_width": target_width, "target_height": target_height,
+        "quality": quality, "target_ssim": target_ssim,
+    }
 
 
 def _compress_one(
@@ -15,51 +41,108 @@ def _compress_one(
     quality: int,
     force: bool,
     log_callback,
+    detect_grayscale: bool = False,
+    counters: dict = None,
+    target_ssim: float = None,
+    quality_range: tuple = (40, 90),
+    encoder: str = DEFAULT_ENCODER,
 ) -> tuple:
     """
     Compresses a single JPG file in-place.
     Returns ('success', bytes_saved), ('skipped', 0), ('no_gain', 0), or ('failed', 0).
+    Writing back goes through core.scheduler.write_behind(), so inside
+    run_files a processed file returns a Future of that tuple instead.
+    Files up to SMALL_FILE_BYTES take the in-memory path (_write_back_small).
+    With detect_grayscale, effectively grey covers are encoded single-channel
+    and counted in counters["grayscale"]. With target_ssim, quality is searched
+    within quality_range; the quality used is summed in counters["quality_sum"].
+    Both are counted only once the output is kept ('success').
+    The output carries a provenance stamp (core.stamp) in a COM segment.
+    Already processed files are redone only when the settings fingerprint is
+    more aggressive than the recorded one (or with force).
     """
     def log(msg):
         if log_callback:
             log_callback(msg)
 
-    if not should_process_file(input_path) and not force:
+    settings = fingerprint(target_width, target_height, quality, target_ssim)
+    if not needs_processing(input_path, settings, force):
         return 'skipped', 0
 
     temp_output = None
     try:
-        original_size = os.path.getsize(input_path)
+        original_data = read_source(input_path)
+        original_size = len(original_data)
+        if counters is not None:
+            counters["bytes_before"] = original_size
+
+        with Image.open(BytesIO(original_data)) as img:
+            img = open_for_resize(img, (target_width, target_height), counters)
 
-        with Image.open(input_path) as img:
             if img.mode in ('RGBA', 'P'):
                 img = img.convert('RGB')
 
+            converted = False
+            if detect_grayscale:
+                img, converted = to_grayscale_if_possible(img)
+
             orig_w, orig_h = img.size
 
             if orig_h > target_height:
                 img = img.resize((target_width, target_height), Image.Resampling.LANCZOS)
 
-            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as f:
-                temp_output = f.name
+            data, used_quality = encode_jpeg_auto(
+                img, quality, target_ssim, *quality_range, encoder
+            )
+
+        def _count_kept(result):
+            # Discarded output (no_gain, failed) says nothing about what was written
+            if result[0] == 'success' and counters is not None:
+                counters["grayscale"] = counters.get("grayscale", 0) + int(converted)
+                counters["quality_sum"] = counters.get("quality_sum", 0) + used_quality
+                counters["encoded"] = counters.get("encoded", 0) + 1
+            return result
+
+        data = stamp_jpeg(data, make_stamp('jpg', settings))
 
-            img.save(temp_output, 'JPEG', quality=quality, optimize=True, progressive=True)
+        if original_size <= SMALL_FILE_BYTES:
+            return then(write_behind(
+                lambda: _write_back_small(input_path, data, original_size, settings, log)
+            ), _count_kept)
+
+        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as f:
+            temp_output = f.name
+            f.write(data)
 
         compressed_size = os.path.getsize(temp_output)
+        output, temp_output = temp_output, None  # owned by _commit from here on
+
+        def _commit():
+            try:
+                if compressed_size < original_size:
+                    with io_slot():
+                        shutil.copy2(output, input_path)
+                    mark_as_processed(input_path, 'jpg', settings)
+                    saved = original_size - compressed_size
+                    pct = saved / original_size * 100
+                    log(f"Gecomprimeerd: {input_path.name} — bespaard: {pct:.1f}%")
+                    return 'success', saved
+                mark_as_processed(input_path, 'jpg', settings)
+                log(f"Geen winst: {input_path.name}")
+                return 'no_gain', 0
+            except Exception as e:
+                log(f"Fout bij {input_path.name}: {e}")
+                return 'failed', 0
+            finally:
+                os.unlink(output)
+
+        return then(write_behind(_commit), _count_kept)
 
-        if compressed_size < original_size:
-            shutil.copy2(temp_output, input_path)
-            os.unlink(temp_output)
-            mark_as_processed(input_path)
-            saved = original_size - compressed_size
-            pct = saved / original_size * 100
-            log(f"Gecomprimeerd: {input_path.name} — bespaard: {pct:.1f}%")
-            return 'success', saved
-        else:
-            os.unlink(temp_output)
-            mark_as_processed(input_path)
-            log(f"Geen winst: {input_path.name}")
-            return 'no_gain', 0
+    except BudgetExceeded as e:
+        log(f"Over budget: {input_path.name} — {e}")
+        if counters is not None:
+            counters["over_budget"] = str(e)
+        return 'failed', 0
 
     except Exception as e:
         if temp_output and os.path.exists(temp_output):
@@ -71,16 +154,79 @@ def _compress_one(
         return 'failed', 0
 
 
+def _write_back_small(
+    input_path: Path, data: bytes, original_size: int, settings: dict, log
+) -> tuple:
+    """
+    Write-back for small files: sizes are compared in memory and the result is
+    written next to the original and swapped in with os.replace(). The marker
+    joins the write-behind thread's batch (core.scheduler.defer_write): until
+    it's written, a replaced cover is recorded by its stamp, and a cover
+    without gain is at worst tried again.
+    """
+    temp_path = input_path.with_name(input_path.name + '.tmp')
+    try:
+        if len(data) < original_size:
+            with io_slot():
+                temp_path.write_bytes(data)
+                os.replace(temp_path, input_path)
+        defer_write(lambda: mark_as_processed(input_path, 'jpg', settings))
+    except Exception as e:
+        if temp_path.exists():
+            try:
+                temp_path.unlink()
+            except Exception:
+                pass
+        log(f"Fout bij {input_path.name}: {e}")
+        return 'failed', 0
+
+    if len(data) < original_size:
+        saved = original_size - len(data)
+        log(f"Gecomprimeerd: {input_path.name} — bespaard: {saved / original_size * 100:.1f}%")
+        return 'success', saved
+    log(f"Geen winst: {input_path.name}")
+    return 'no_gain', 0
+
+
+# Extensions handled by this tool (watch mode)
+EXTENSIONS = ('.jpg', '.jpeg')
+
+
+def find_files(path) -> list:
+    """Returns all JPG/JPEG files recursively under path."""
+    start_dir = Path(path)
+    files = []
+    for ext in ('*.jpg', '*.jpeg'):
+        files.extend(start_dir.rglob(ext))
+    # Remove duplicates that rglob might find on case-insensitive FS
+    seen = set()
+    unique_files = []
+    for f in files:
+        key = str(f).lower()
+        if key not in seen:
+            seen.add(key)
+            unique_files.append(f)
+    return unique_files
+
+
 def main(
     path,
     target_width=180,
     target_height=270,
     quality=70,
     force=False,
+    detect_grayscale=True,
+    target_ssim=None,
+    min_quality=40,
+    max_quality=90,
+    encoder_preset='smallest',
+    watch=False,
+    watch_backend='auto',
     stop_event: threading.Event = None,
     progress_callback=None,
     log_callback=None,
     stats_callback=None,
+    lease=None,
 ):
     """
     Compresses all JPG/JPEG files recursively under path.
@@ -90,50 +236,110 @@ def main(
       log_callback(message)
       stats_callback(successful, skipped, failed, bytes_saved)
 
-    Returns dict: {total, successful, skipped, failed, bytes_saved}
+    detect_grayscale: effectively grey images are encoded single-channel;
+    the count is returned as stats["grayscale"].
+
+    target_ssim: if set, JPEG quality is chosen per image (binary search, at
+    most 4 encodes) as the lowest in [min_quality, max_quality] that reaches
+    this SSIM; stats["avg_quality"] is the mean quality used.
+
+    encoder_preset: 'fast' or 'smallest' (or an encoder name from
+    core.encoders); resolved once per run to the best available backend.
+
+    lease: optional core.scheduler.Lease; files then run in parallel within
+    the tool's share of the app-wide CPU/I/O budget, and are admitted only
+    while their estimated memory fits the app-wide memory budget. Images
+    too large to decode comfortably take a reduced-decode path
+    (stats["low_memory"]). The next files are read ahead (see
+    core.scheduler.Prefetcher) while the current one is processed.
+
+    watch: after the initial pass, keep watching path and process new or
+    changed files once they have stopped changing (core.watcher), until
+    stop_event is set. watch_backend: 'auto', 'inotify' or 'poll'.
+
+    Returns dict: {total, successful, skipped, failed, bytes_saved, grayscale,
+                  avg_quality, low_memory}
     """
+    runlog = RunLog('jpg', log_callback)
+    log_callback = runlog.message
+
     def log(msg):
         if log_callback:
             log_callback(msg)
 
-    start_dir = Path(path)
-    stats = {"total": 0, "successful": 0, "skipped": 0, "failed": 0, "bytes_saved": 0}
+    stats = {
+        "total": 0, "successful": 0, "skipped": 0, "failed": 0, "bytes_saved": 0,
+        "grayscale": 0, "avg_quality": 0, "low_memory": 0,
+    }
+    tracked = metrics.track("jpg", stats)
 
-    files = []
-    for ext in ('*.jpg', '*.jpeg'):
-        files.extend(start_dir.rglob(ext))
-    # Remove duplicates that rglob might find on case-insensitive FS
-    seen = set()
-    unique_files = []
-    for f in files:
-        key = str(f).lower()
-        if key not in seen:
-            seen.add(key)
-            unique_files.append(f)
-    files = unique_files
+    try:
+        # Created before the walk, so files added during the first pass are seen
+        watcher = (
+            Watcher(path, EXTENSIONS, backend=watch_backend, log_callback=log_callback)
+            if watch else None
+        )
+        files = find_files(path)
 
-    stats["total"] = len(files)
-    log(f"Start verwerking — {stats['total']} JPG bestanden gevonden")
+        stats["total"] = len(files)
+        log(f"Start verwerking — {stats['total']} JPG bestanden gevonden")
 
-    for i, img_file in enumerate(files):
-        if stop_event and stop_event.is_set():
-            log("Verwerking gestopt door gebruiker")
-            break
+        encoder = resolve_preset(encoder_preset)
+        log(f"Encoder: {encoder}")
 
-        if progress_callback:
-            progress_callback(i, stats["total"], img_file.name)
+        settings = fingerprint(target_width, target_height, quality, target_ssim)
 
-        status, saved = _compress_one(
-            img_file, target_width, target_height, quality, force, log_callback
-        )
+        def _one(img_file):
+            counters = {"started": time.monotonic()}
+            result = _compress_one(
+                img_file, target_width, target_height, quality, force, log_callback,
+                detect_grayscale, counters, target_ssim, (min_quality, max_quality), encoder,
+            )
+            return then(result, lambda r: (*r, counters))
+
+        done = 0
+        quality_sum = encoded = 0
+        last_report = 0.0
+        for batch in file_batches(files, watcher, stop_event, log_callback, stats):
+            for img_file, (status, saved, counters) in run_files(
+                batch, _one, stop_event, lease, estimate=estimate_image_file,
+                wanted=lambda f: force or should_process_file(f, settings), spool=False,
+            ):
+                done += 1
 
-        if status == 'success':
-            stats["successful"] += 1
-            stats["bytes_saved"] += saved
-        elif status in ('skipped', 'no_gain'):
-            stats["skipped"] += 1
-        else:
-            stats["failed"] += 1
+                if status == 'success':
+                    stats["successful"] += 1
+                    stats["bytes_saved"] += saved
+                elif status in ('skipped', 'no_gain', 'stopped'):
+                    stats["skipped"] += 1
+                else:
+                    stats["failed"] += 1
+                stats["grayscale"] += counters.get("grayscale", 0)
+                stats["low_memory"] += counters.get("low_memory", 0)
+                quality_sum += counters.get("quality_sum", 0)
+                encoded += counters.get("encoded", 0)
+
+                runlog.file_result(
+                    img_file, status, counters.get("bytes_before"), saved,
+                    time.monotonic() - counters["started"],
+                )
+                quarantine.record(img_file, status, counters.get("over_budget"))
+
+                if lease:
+                    lease.record(saved)
+
+                # Thousands of covers per second would flood the UI; report in batches
+                now = time.monotonic()
+                if now - last_report < REPORT_INTERVAL:
+                    continue
+                last_report = now
+                if progress_callback:
+                    progress_callback(done, stats["total"], img_file.name)
+                if stats_callback:
+                    stats_callback(
+                        stats["successful"], stats["skipped"],
+                        stats["failed"], stats["bytes_saved"]
+                    )
 
         if stats_callback:
             stats_callback(
@@ -141,13 +347,26 @@ def main(
                 stats["failed"], stats["bytes_saved"]
             )
 
-    if progress_callback:
-        progress_callback(stats["total"], stats["total"], "")
+        if stop_event and stop_event.is_set():
+            log("Verwerking gestopt door gebruiker")
 
-    log(
-        f"Klaar — Succesvol: {stats['successful']}, "
-        f"Overgeslagen: {stats['skipped']}, "
-        f"Mislukt: {stats['failed']}, "
-        f"Bespaard: {stats['bytes_saved'] / (1024 * 1024):.1f} MB"
-    )
+        if encoded:
+            stats["avg_quality"] = round(quality_sum / encoded, 1)
+
+        if progress_callback:
+            progress_callback(stats["total"], stats["total"], "")
+
+        log(
+            f"Klaar — Succesvol: {stats['successful']}, "
+            f"Overgeslagen: {stats['skipped']}, "
+            f"Mislukt: {stats['failed']}, "
+            f"Bespaard: {stats['bytes_saved'] / (1024 * 1024):.1f} MB, "
+            f"Grijswaarden: {stats['grayscale']}, "
+            f"Gem. kwaliteit: {stats['avg_quality']}"
+        )
+        if stats["low_memory"]:
+            log(f"Geheugenzuinig gedecodeerd: {stats['low_memory']} afbeelding(en)")
+    finally:
+        metrics.untrack(tracked)
+        runlog.close()
     return stats
@@ -0,0 +1,366 @@
+"""
+All-formats mode: one pass over a whole library for every tool at once.
+
+The tree is walked once (instead of one rglob per tool) and every file is
+routed by extension to the existing per-file function of its tool, with that
+tool's own settings (see core.work_queue.process_item). Stats are reported
+combined and per type.
+
+Headless, with the settings from config.json:
+
+    python -m core.library --path D:\\Calibre
+    python -m core.library --path D:\\Calibre --tools epub cbz --watch
+"""
+import argparse
+import os
+import threading
+import time
+from pathlib import Path
+
+from core import jpg_compressor, epub_compressor, pdf_compressor, cbz_compressor
+from core.shared import should_process_file, estimate_archive_bytes
+from core.scheduler import run_files, then
+from core.watcher import Watcher, file_batches
+from core import metrics, quarantine
+from core.runlog import RunLog
+from core.imaging import estimate_image_file
+from core.work_queue import process_item
+
+TOOLS = ('jpg', 'epub', 'pdf', 'cbz')
+
+# Minimum seconds between progress/stats callbacks
+REPORT_INTERVAL = 0.2
+
+_LABELS = {'jpg': 'JPG', 'epub': 'EPUB', 'pdf': 'PDF', 'cbz': 'CBZ/CBR'}
+
+
+def tool_extensions(tools=TOOLS) -> dict:
+    """Returns {extension: tool} for tools; .cbr only if rarfile is installed."""
+    extensions = {}
+    for tool, module in (
+        ('jpg', jpg_compressor), ('epub', epub_compressor),
+        ('pdf', pdf_compressor), ('cbz', cbz_compressor),
+    ):
+        if tool in tools:
+            for ext in module.EXTENSIONS:
+                extensions[ext] = tool
+    if '.cbr' in extensions and not cbz_compressor._rarfile_available():
+        del extensions['.cbr']
+    return extensions
+
+
+def tool_for(file_path, extensions: dict):
+    """Returns the tool that handles file_path, or None."""
+    return extensions.get(os.path.splitext(str(file_path))[1].lower())
+
+
+def find_library_files(path, tools=TOOLS) -> dict:
+    """
+    Walks path once and returns {tool: [files]} for tools. Uses os.scandir,
+    so file types are known from the directory listing without a stat per file.
+    """
+    extensions = tool_extensions(tools)
+    found = {tool: [] for tool in tools}
+    stack = [str(path)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                            continue
+                    except OSError:
+                        continue
+                    tool = tool_for(entry.name, extensions)
+                    if tool is not None:
+                        found[tool].append(Path(entry.path))
+        except OSError:
+            continue
+    return found
+
+
+def _fingerprint(tool: str, s: dict) -> dict:
+    """The settings fingerprint tool's per-file function records for settings s."""
+    if tool == 'jpg':
+        return jpg_compressor.fingerprint(
+            s['target_width'], s['target_height'], s['quality'], s.get('target_ssim'),
+        )
+    if tool == 'epub':
+        return epub_compressor.fingerprint(
+            s['target_height'], s['quality'], s.get('target_ssim'), s.get('crop_margins', False),
+        )
+    if tool == 'pdf':
+        return pdf_compressor.fingerprint(s['pdf_settings'])
+    return cbz_compressor.fingerprint(
+        s['target_width'], s['quality'], s.get('output_format', 'jpeg'),
+        s.get('target_ssim'), s.get('crop_margins', False),
+    )
+
+
+def _empty_stats() -> dict:
+    return {"total": 0, "successful": 0, "skipped": 0, "failed": 0, "bytes_saved": 0}
+
+
+def main(
+    path,
+    settings: dict,
+    tools=TOOLS,
+    force=False,
+    watch=False,
+    watch_backend='auto',
+    stop_event: threading.Event = None,
+    progress_callback=None,
+    log_callback=None,
+    stats_callback=None,
+    lease=None,
+):
+    """
+    Compresses every supported file under path in one pass.
+
+    settings: {tool: settings dict} as in config.json (the tool sections);
+    "path" and "watch" in them are ignored. tools: the tools to run.
+    force: reprocess already processed files of every type (a tool's own
+    "force" setting applies to that type only).
+
+    Callbacks:
+      progress_callback(current, total, filename)
+      log_callback(message)
+      stats_callback(successful, skipped, failed, bytes_saved)
+
+    lease: optional core.scheduler.Lease, as for the single-tool mains; all
+    types share it. JPGs are read ahead into memory, the other types to local
+    temp files.
+
+    watch: after the initial pass, keep watching path for new or changed
+    files of all selected types (core.watcher), until stop_event is set.
+
+    Returns dict: {total, successful, skipped, failed, bytes_saved, grayscale,
+                  cropped, avg_quality, low_memory, per_type}
+    where per_type is {tool: {total, successful, skipped, failed, bytes_saved}}.
+    """
+    runlog = RunLog('library', log_callback)
+    log_callback = runlog.message
+
+    def log(msg):
+        if log_callback:
+            log_callback(msg)
+
+    stats = _empty_stats()
+    stats.update({"grayscale": 0, "cropped": 0, "avg_quality": 0, "low_memory": 0})
+    tracked = metrics.track("library", stats)
+
+    try:
+        settings = {tool: dict(settings.get(tool, {})) for tool in tools}
+        tools = list(tools)
+
+        if 'pdf' in tools:
+            gs_path = settings['pdf'].get('gs_path', pdf_compressor.DEFAULT_GS_PATH)
+            if not os.path.exists(gs_path):
+                log(
+                    f"Ghostscript niet gevonden op: {gs_path} "
+                    "— PDF bestanden worden overgeslagen"
+                )
+                tools.remove('pdf')
+
+        if 'cbz' in tools:
+            cbz = settings['cbz']
+            if cbz.get('output_format', 'jpeg') not in cbz_compressor.available_output_formats():
+                log(
+                    f"Uitvoerformaat {cbz['output_format']} niet ondersteund "
+                    "door Pillow — JPEG gebruikt"
+                )
+                cbz['output_format'] = 'jpeg'
+            if cbz.get('cbr_output', 'cbr') not in cbz_compressor.CBR_OUTPUTS:
+                log(f"Onbekende CBR uitvoer {cbz['cbr_output']} — CBR gebruikt")
+                cbz['cbr_output'] = 'cbr'
+            if not cbz_compressor._rarfile_available():
+                log("rarfile niet beschikbaar — CBR bestanden worden overgeslagen")
+
+        for tool in tools:
+            settings[tool]['force'] = force or settings[tool].get('force', False)
+
+        extensions = tool_extensions(tools)
+        per_type = {tool: _empty_stats() for tool in tools}
+        stats["per_type"] = per_type
+
+        # Created before the walk, so files added during the first pass are seen
+        watcher = (
+            Watcher(path, tuple(extensions), backend=watch_backend, log_callback=log_callback)
+            if watch else None
+        )
+        found = find_library_files(path, tools)
+
+        # Interleaved, so the CPU-heavy and I/O-heavy types overlap from the start
+        files = []
+        queues = [found[tool] for tool in tools]
+        for i in range(max((len(q) for q in queues), default=0)):
+            files.extend(q[i] for q in queues if i < len(q))
+
+        stats["total"] = len(files)
+        for tool in tools:
+            per_type[tool]["total"] = len(found[tool])
+        log(
+            f"Start verwerking — {stats['total']} bestanden gevonden ("
+            + ", ".join(f"{_LABELS[t]}: {len(found[t])}" for t in tools) + ")"
+        )
+
+        def _one(f):
+            counters = {"started": time.monotonic()}
+            tool = tool_for(f, extensions)
+            result = process_item(tool, f, settings[tool], log_callback, counters)
+            return then(result, lambda r: (*r, counters))
+
+        def _estimate(f):
+            tool = tool_for(f, extensions)
+            if tool == 'jpg':
+                return estimate_image_file(f)
+            if tool in ('epub', 'cbz'):
+                return estimate_archive_bytes(f)
+            return 0
+
+        fingerprints = {tool: _fingerprint(tool, settings[tool]) for tool in tools}
+
+        def _wanted(f):
+            tool = tool_for(f, extensions)
+            return settings[tool]['force'] or should_process_file(f, fingerprints[tool])
+
+        done = 0
+        quality_sum = encoded = 0
+        last_report = 0.0
+        for n, batch in enumerate(file_batches(files, watcher, stop_event, log_callback, stats)):
+            if n:
+                for f in batch:
+                    per_type[tool_for(f, extensions)]["total"] += 1
+            for f, (status, saved, counters) in run_files(
+                batch, _one, stop_event, lease, estimate=_estimate, wanted=_wanted,
+                spool=lambda f: tool_for(f, extensions) != 'jpg',
+            ):
+                done += 1
+                tool_stats = per_type[tool_for(f, extensions)]
+
+                if status == 'success':
+                    key = "successful"
+                    stats["bytes_saved"] += saved
+                    tool_stats["bytes_saved"] += saved
+                elif status in ('skipped', 'no_gain', 'stopped'):
+                    key = "skipped"
+                else:
+                    key = "failed"
+                stats[key] += 1
+                tool_stats[key] += 1
+                stats["grayscale"] += counters.get("grayscale", 0)
+                stats["cropped"] += counters.get("cropped", 0)
+                stats["low_memory"] += counters.get("low_memory", 0)
+                quality_sum += counters.get("quality_sum", 0)
+                encoded += counters.get("encoded", 0)
+
+                runlog.file_result(
+                    f, status, counters.get("bytes_before"), saved,
+                    time.monotonic() - counters["started"],
+                )
+                quarantine.record(f, status, counters.get("over_budget"))
+
+                if lease:
+                    lease.record(saved)
+
+                now = time.monotonic()
+                if now - last_report < REPORT_INTERVAL:
+                    continue
+                last_report = now
+                if progress_callback:
+                    progress_callback(done, stats["total"], f.name)
+                if stats_callback:
+                    stats_callback(
+                        stats["successful"], stats["skipped"],
+                        stats["failed"], stats["bytes_saved"]
+                    )
+
+        if stats_callback:
+            stats_callback(
+                stats["successful"], stats["skipped"],
+                stats["failed"], stats["bytes_saved"]
+            )
+
+        if stop_event and stop_event.is_set():
+            log("Verwerking gestopt door gebruiker")
+
+        if encoded:
+            stats["avg_quality"] = round(quality_sum / encoded, 1)
+
+        if progress_callback:
+            progress_callback(stats["total"], stats["total"], "")
+
+        for tool in tools:
+            t = per_type[tool]
+            log(
+                f"{_LABELS[tool]} — Succesvol: {t['successful']}, "
+                f"Overgeslagen: {t['skipped']}, "
+                f"Mislukt: {t['failed']}, "
+                f"Bespaard: {t['bytes_saved'] / (1024 * 1024):.1f} MB"
+            )
+        log(
+            f"Klaar — Succesvol: {stats['successful']}, "
+            f"Overgeslagen: {stats['skipped']}, "
+            f"Mislukt: {stats['failed']}, "
+            f"Bespaard: {stats['bytes_saved'] / (1024 * 1024):.1f} MB, "
+            f"Grijswaarden: {stats['grayscale']}, "
+            f"Bijgesneden: {stats['cropped']}, "
+            f"Gem. kwaliteit: {stats['avg_quality']}"
+        )
+        if stats["low_memory"]:
+            log(f"Geheugenzuinig gedecodeerd: {stats['low_memory']} afbeelding(en)")
+    finally:
+        metrics.untrack(tracked)
+        runlog.close()
+    return stats
+
+
+# ─── Headless runner ──────────────────────────────────────────────────────────
+
+def _cli(argv=None):
+    from core.config import load_config
+    from core.scheduler import ResourceGovernor
+    from core.metrics import start_exporter
+
+    parser = argparse.ArgumentParser(prog='python -m core.library')
+    parser.add_argument('--path', required=True, help='bibliotheekmap')
+    parser.add_argument('--tools', nargs='+', choices=TOOLS, default=list(TOOLS))
+    parser.add_argument('--force', action='store_true', help='al verwerkte bestanden opnieuw verwerken')
+    parser.add_argument('--watch', action='store_true', help='map daarna blijven bewaken')
+    parser.add_argument('--poll', action='store_true', help='altijd mtime-polling gebruiken (netwerkschijven)')
+    args = parser.parse_args(argv)
+
+    config = load_config()
+    app = config["app"]
+    governor = ResourceGovernor.from_config(app)
+    exporter = start_exporter(app, governor, log_callback=print)
+    stop_event = threading.Event()
+    lease = governor.register('library')
+
+    def _run():
+        try:
+            main(
+                args.path, {tool: config[tool] for tool in TOOLS}, args.tools, args.force,
+                watch=args.watch, watch_backend='poll' if args.poll else 'auto',
+                stop_event=stop_event, log_callback=print, lease=lease,
+            )
+        finally:
+            lease.close()
+
+    thread = threading.Thread(target=_run)
+    thread.start()
+    try:
+        while thread.is_alive():
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        print("Stoppen — lopende bestanden afronden…")
+        stop_event.set()
+        thread.join()
+    finally:
+        if exporter is not None:
+            exporter.close()
+
+
+if __name__ == '__main__':
+    _cli()
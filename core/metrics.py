@@ -0,0 +1,279 @@
+"""
+Live metrics for long runs: an optional local HTTP endpoint in Prometheus
+text format (/metrics, plus /metrics.json) and an equivalent JSON file that
+is rewritten periodically.
+
+Workers pay almost nothing: file counters are read from the stats dicts the
+compressor main() functions already maintain (track()), and per-stage
+latencies (read-ahead, processing, write-back) are one histogram bucket
+increment per file. Everything else is collected when scraped.
+
+    [app] metrics_port = 9464      # http://127.0.0.1:9464/metrics
+    [app] metrics_file = "D:/metrics.json"
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (seconds) of the per-stage latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+METRICS_INTERVAL = 15.0
+
+_STAT_KEYS = ("successful", "skipped", "failed")
+
+_lock = threading.Lock()
+_runs = {}  # id -> (tool, stats dict) of running mains
+_finished = {}  # tool -> totals of finished runs (keeps counters monotonic)
+_histograms = {}  # (stage, tool) -> [bucket counts..., +Inf count, sum]
+_queues = {}  # id -> (tool, queue name, depth function)
+_started = time.time()
+
+
+# ─── Collection ───────────────────────────────────────────────────────────────
+
+def track(tool: str, stats: dict) -> int:
+    """Exposes a running main()'s stats dict; returns a handle for untrack()."""
+    handle = id(stats)
+    with _lock:
+        _runs[handle] = (tool, stats)
+    return handle
+
+
+def untrack(handle: int):
+    """Folds a finished run's final stats into the tool's totals."""
+    with _lock:
+        run = _runs.pop(handle, None)
+        if run is None:
+            return
+        tool, stats = run
+        totals = _finished.setdefault(tool, dict.fromkeys(_STAT_KEYS + ("bytes_saved",), 0))
+        for key in totals:
+            totals[key] += stats.get(key, 0)
+
+
+def observe(stage: str, tool: str, seconds: float):
+    """Adds one latency observation for stage ('read', 'process', 'commit')."""
+    key = (stage, tool or "")
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+        hist[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        hist[-1] += seconds
+
+
+def add_queue(tool: str, name: str, depth) -> int:
+    """Registers depth() -> int as a queue-depth gauge; returns a handle."""
+    handle = id(depth)
+    with _lock:
+        _queues[handle] = (tool or "", name, depth)
+    return handle
+
+
+def remove_queue(handle: int):
+    with _lock:
+        _queues.pop(handle, None)
+
+
+def _rss_bytes():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def collect(governor=None) -> dict:
+    """Returns a snapshot of all metrics as a JSON-able dict."""
+    with _lock:
+        files = {tool: dict(totals) for tool, totals in _finished.items()}
+        for tool, stats in _runs.values():
+            totals = files.setdefault(tool, dict.fromkeys(_STAT_KEYS + ("bytes_saved",), 0))
+            for key in totals:
+                totals[key] += stats.get(key, 0)
+        histograms = {f"{stage}/{tool}": list(h) for (stage, tool), h in _histograms.items()}
+        queues = list(_queues.values())
+
+    depths = {}
+    for tool, name, depth in queues:
+        try:
+            depths[f"{name}/{tool}"] = depths.get(f"{name}/{tool}", 0) + int(depth())
+        except Exception:
+            pass
+
+    snapshot = {
+        "time": time.time(),
+        "uptime_seconds": time.time() - _started,
+        "files": files,
+        "latency_buckets": list(LATENCY_BUCKETS),
+        "latency": histograms,
+        "queue_depth": depths,
+        "rss_bytes": _rss_bytes(),
+    }
+    if governor is not None:
+        snap = governor.snapshot()
+        snapshot["workers"] = {
+            name: {
+                "in_flight": t["cpu_in_use"],
+                "share": t["cpu_share"],
+                "level": t.get("level"),
+                "files_per_sec": t["files_per_sec"],
+            }
+            for name, t in snap["tabs"].items()
+        }
+        snapshot["memory_in_use_bytes"] = snap["combined"]["memory_in_use"]
+    return snapshot
+
+
+# ─── Prometheus text format ───────────────────────────────────────────────────
+
+def render_prometheus(snapshot: dict) -> str:
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label}}} {value}" if label else f"{name} {value}")
+
+    files = snapshot["files"]
+    metric(
+        "compressor_files_total", "counter", "Files finished, by tool and status.",
+        [({"tool": t, "status": k}, v[k]) for t, v in sorted(files.items()) for k in _STAT_KEYS],
+    )
+    metric(
+        "compressor_bytes_saved_total", "counter", "Bytes saved, by tool.",
+        [({"tool": t}, v["bytes_saved"]) for t, v in sorted(files.items())],
+    )
+
+    lines.append("# HELP compressor_stage_seconds Per-file latency by stage and tool.")
+    lines.append("# TYPE compressor_stage_seconds histogram")
+    bounds = [str(b) for b in snapshot["latency_buckets"]] + ["+Inf"]
+    for key, hist in sorted(snapshot["latency"].items()):
+        stage, tool = key.split("/", 1)
+        labels = f'stage="{stage}",tool="{tool}"'
+        cumulative = 0
+        for bound, count in zip(bounds, hist[:-1]):
+            cumulative += count
+            lines.append(f'compressor_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"compressor_stage_seconds_sum{{{labels}}} {hist[-1]}")
+        lines.append(f"compressor_stage_seconds_count{{{labels}}} {cumulative}")
+
+    metric(
+        "compressor_queue_depth", "gauge", "Files waiting in a pipeline queue.",
+        [({"queue": k.split("/", 1)[0], "tool": k.split("/", 1)[1]}, v)
+         for k, v in sorted(snapshot["queue_depth"].items())],
+    )
+    workers = snapshot.get("workers", {})
+    metric(
+        "compressor_workers", "gauge", "Files in flight per tool.",
+        [({"tool": t}, w["in_flight"]) for t, w in sorted(workers.items())],
+    )
+    metric(
+        "compressor_worker_level", "gauge", "Allowed files in flight (adaptive level or share).",
+        [({"tool": t}, w["level"] if w["level"] is not None else w["share"])
+         for t, w in sorted(workers.items())],
+    )
+    if snapshot.get("rss_bytes") is not None:
+        metric("compressor_rss_bytes", "gauge", "Resident memory of the process.",
+               [({}, snapshot["rss_bytes"])])
+    metric("compressor_uptime_seconds", "gauge", "Seconds since the process started.",
+           [({}, round(snapshot["uptime_seconds"], 1))])
+    return "\n".join(lines) + "\n"
+
+
+# ─── Exporters ────────────────────────────────────────────────────────────────
+
+class MetricsExporter:
+    """
+    Serves /metrics (Prometheus) and /metrics.json on 127.0.0.1:port and/or
+    rewrites json_path every interval seconds (atomically, via a temp file).
+    Both run on their own daemon threads.
+    """
+
+    def __init__(self, port: int = 0, json_path: str = "", governor=None,
+                 interval: float = METRICS_INTERVAL):
+        self.governor = governor
+        self.interval = interval
+        self.json_path = json_path
+        self._stop = threading.Event()
+        self._server = None
+        if port:
+            self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        if json_path:
+            threading.Thread(target=self._write_loop, daemon=True).start()
+
+    def _handler(self):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                snapshot = collect(exporter.governor)
+                if self.path == "/metrics":
+                    body = render_prometheus(snapshot).encode("utf-8")
+                    ctype = "text/plain; version=0.0.4; charset=utf-8"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(snapshot).encode("utf-8")
+                    ctype = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def write_json(self):
+        temp = self.json_path + ".tmp"
+        try:
+            with open(temp, "w", encoding="utf-8") as f:
+                json.dump(collect(self.governor), f, indent=2)
+            os.replace(temp, self.json_path)
+        except OSError:
+            pass
+
+    def _write_loop(self):
+        while not self._stop.wait(self.interval):
+            self.write_json()
+
+    def close(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        if self.json_path:
+            self.write_json()
+
+
+def start_exporter(app_config: dict, governor=None, log_callback=None):
+    """
+    Starts a MetricsExporter from the app config section. Returns None if
+    disabled, or if the port can't be bound (reported to log_callback).
+    """
+    port = app_config.get("metrics_port", 0)
+    json_path = app_config.get("metrics_file", "")
+    if not port and not json_path:
+        return None
+    try:
+        return MetricsExporter(port, json_path, governor)
+    except OSError as e:
+        if log_callback:
+            log_callback(f"Metrics endpoint niet gestart (poort {port}): {e}")
+        return None
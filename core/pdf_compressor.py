@@ -1,12 +1,24 @@
 import os
-import subprocess
 import tempfile
 import threading
+import time
 from pathlib import Path
 
-from core.shared import should_process_file, mark_as_processed
+from core.shared import should_process_file, needs_processing, mark_as_processed
+from core.stamp import make_stamp, pdf_stamp_args
+from core.scheduler import (
+    run_files, io_slot, write_behind, then, open_source, run_process, StopRequested,
+    BudgetExceeded,
+)
+from core.watcher import Watcher, file_batches
+from core import metrics, quarantine
+from core.runlog import RunLog
+from core.config import DEFAULT_GS_PATH
 
-DEFAULT_GS_PATH = r'C:\Program Files (x86)\gs\gs10.04.0\bin\gswin32c.exe'
+
+def fingerprint(pdf_settings) -> dict:
+    """Settings fingerprint recorded with each processed file (see core.shared)."""
+    return {"pdf_settings": pdf_settings}
 
 
 def _compress_pdf(
@@ -15,40 +27,52 @@ def _compress_pdf(
     pdf_settings: str,
     force: bool,
     log_callback,
+    counters: dict = None,
 ) -> tuple:
     """
     Compresses a single PDF via Ghostscript.
     Returns ('success', bytes_saved), ('skipped', 0), ('no_gain', 0), or ('failed', 0).
+    Writing back goes through core.scheduler.write_behind(), so inside
+    run_files a processed file returns a Future of that tuple instead.
+    A stop terminates Ghostscript and returns ('stopped', 0).
+    The output carries a provenance stamp (core.stamp) in its Info dictionary.
+    Already processed files are redone only for a more aggressive
+    pdf_settings preset than the recorded one (or with force).
     """
     def log(msg):
         if log_callback:
             log_callback(msg)
 
-    if not should_process_file(pdf_path) and not force:
+    settings = fingerprint(pdf_settings)
+    if not needs_processing(pdf_path, settings, force):
         return 'skipped', 0
 
     temp_output = None
     try:
         original_size = os.path.getsize(pdf_path)
+        if counters is not None:
+            counters["bytes_before"] = original_size
 
         with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as f:
             temp_output = f.name
 
-        cmd = [
-            gs_path,
-            '-sDEVICE=pdfwrite',
-            '-dCompatibilityLevel=1.4',
-            f'-dPDFSETTINGS={pdf_settings}',
-            '-dEmbedAllFonts=true',
-            '-dSubsetFonts=true',
-            '-dNOPAUSE',
-            '-dQUIET',
-            '-dBATCH',
-            f'-sOutputFile={temp_output}',
-            str(pdf_path),
-        ]
-
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        with open_source(pdf_path) as src:
+            cmd = [
+                gs_path,
+                '-sDEVICE=pdfwrite',
+                '-dCompatibilityLevel=1.4',
+                f'-dPDFSETTINGS={pdf_settings}',
+                '-dEmbedAllFonts=true',
+                '-dSubsetFonts=true',
+                '-dNOPAUSE',
+                '-dQUIET',
+                '-dBATCH',
+                f'-sOutputFile={temp_output}',
+                str(src),
+                *pdf_stamp_args(make_stamp('pdf', settings)),
+            ]
+
+            result = run_process(cmd)
 
         if result.returncode != 0:
             if os.path.exists(temp_output):
@@ -57,28 +81,59 @@ def _compress_pdf(
             return 'failed', 0
 
         compressed_size = os.path.getsize(temp_output)
+        output, temp_output = temp_output, None  # owned by _commit from here on
 
-        if compressed_size < original_size:
-            os.replace(temp_output, pdf_path)
-            mark_as_processed(pdf_path)
-            saved = original_size - compressed_size
-            pct = saved / original_size * 100
-            log(f"Gecomprimeerd: {pdf_path.name} — bespaard: {pct:.1f}%")
-            return 'success', saved
-        else:
-            os.unlink(temp_output)
-            mark_as_processed(pdf_path)
-            log(f"Geen winst: {pdf_path.name}")
-            return 'no_gain', 0
+        def _commit():
+            try:
+                if compressed_size < original_size:
+                    with io_slot():
+                        os.replace(output, pdf_path)
+                    mark_as_processed(pdf_path, 'pdf', settings)
+                    saved = original_size - compressed_size
+                    pct = saved / original_size * 100
+                    log(f"Gecomprimeerd: {pdf_path.name} — bespaard: {pct:.1f}%")
+                    return 'success', saved
+                mark_as_processed(pdf_path, 'pdf', settings)
+                log(f"Geen winst: {pdf_path.name}")
+                return 'no_gain', 0
+            except Exception as e:
+                log(f"Fout bij {pdf_path.name}: {e}")
+                return 'failed', 0
+            finally:
+                if os.path.exists(output):
+                    os.unlink(output)
+
+        return write_behind(_commit)
+
+    except StopRequested:
+        log(f"Onderbroken: {pdf_path.name}")
+        return 'stopped', 0
+
+    except BudgetExceeded as e:
+        log(f"Over budget: {pdf_path.name} — {e}")
+        if counters is not None:
+            counters["over_budget"] = str(e)
+        return 'failed', 0
 
     except Exception as e:
+        log(f"Fout bij {pdf_path.name}: {e}")
+        return 'failed', 0
+
+    finally:
         if temp_output and os.path.exists(temp_output):
             try:
                 os.unlink(temp_output)
             except Exception:
                 pass
-        log(f"Fout bij {pdf_path.name}: {e}")
-        return 'failed', 0
+
+
+# Extensions handled by this tool (watch mode)
+EXTENSIONS = ('.pdf',)
+
+
+def find_files(path) -> list:
+    """Returns all PDF files recursively under path."""
+    return list(Path(path).rglob('*.pdf'))
 
 
 def main(
@@ -86,10 +141,13 @@ def main(
     gs_path=DEFAULT_GS_PATH,
     pdf_settings='/ebook',
     force=False,
+    watch=False,
+    watch_backend='auto',
     stop_event: threading.Event = None,
     progress_callback=None,
     log_callback=None,
     stats_callback=None,
+    lease=None,
 ):
     """
     Compresses all PDF files recursively under path using Ghostscript.
@@ -99,8 +157,20 @@ def main(
       log_callback(message)
       stats_callback(successful, skipped, failed, bytes_saved)
 
+    lease: optional core.scheduler.Lease; files then run in parallel within
+    the tool's share of the app-wide CPU/I/O budget. The next PDFs are read
+    ahead to local temp files (see core.scheduler.Prefetcher) while
+    Ghostscript works on the current one.
+
+    watch: after the initial pass, keep watching path and process new or
+    changed files once they have stopped changing (core.watcher), until
+    stop_event is set. watch_backend: 'auto', 'inotify' or 'poll'.
+
     Returns dict: {total, successful, skipped, failed, bytes_saved}
     """
+    runlog = RunLog('pdf', log_callback)
+    log_callback = runlog.message
+
     def log(msg):
         if log_callback:
             log_callback(msg)
@@ -109,46 +179,75 @@ def main(
 
     if not os.path.exists(gs_path):
         log(f"Ghostscript niet gevonden op: {gs_path}")
+        runlog.close()
         return empty_stats
 
-    start_dir = Path(path)
     stats = {"total": 0, "successful": 0, "skipped": 0, "failed": 0, "bytes_saved": 0}
+    tracked = metrics.track("pdf", stats)
 
-    files = list(start_dir.rglob('*.pdf'))
-    stats["total"] = len(files)
-    log(f"Start verwerking — {stats['total']} PDF bestanden gevonden")
+    try:
+        # Created before the walk, so files added during the first pass are seen
+        watcher = (
+            Watcher(path, EXTENSIONS, backend=watch_backend, log_callback=log_callback)
+            if watch else None
+        )
+        files = find_files(path)
+        stats["total"] = len(files)
+        log(f"Start verwerking — {stats['total']} PDF bestanden gevonden")
+
+        settings = fingerprint(pdf_settings)
+
+        def _one(pdf_file):
+            counters = {"started": time.monotonic()}
+            result = _compress_pdf(pdf_file, gs_path, pdf_settings, force, log_callback, counters)
+            return then(result, lambda r: (*r, counters))
+
+        done = 0
+        for batch in file_batches(files, watcher, stop_event, log_callback, stats):
+            for pdf_file, (status, saved, counters) in run_files(
+                batch, _one, stop_event, lease,
+                wanted=lambda f: force or should_process_file(f, settings),
+            ):
+                done += 1
+                if progress_callback:
+                    progress_callback(done, stats["total"], pdf_file.name)
+
+                if status == 'success':
+                    stats["successful"] += 1
+                    stats["bytes_saved"] += saved
+                elif status in ('skipped', 'no_gain', 'stopped'):
+                    stats["skipped"] += 1
+                else:
+                    stats["failed"] += 1
+
+                runlog.file_result(
+                    pdf_file, status, counters.get("bytes_before"), saved,
+                    time.monotonic() - counters["started"],
+                )
+                quarantine.record(pdf_file, status, counters.get("over_budget"))
+
+                if lease:
+                    lease.record(saved)
+
+                if stats_callback:
+                    stats_callback(
+                        stats["successful"], stats["skipped"],
+                        stats["failed"], stats["bytes_saved"]
+                    )
 
-    for i, pdf_file in enumerate(files):
         if stop_event and stop_event.is_set():
             log("Verwerking gestopt door gebruiker")
-            break
 
         if progress_callback:
-            progress_callback(i, stats["total"], pdf_file.name)
-
-        status, saved = _compress_pdf(pdf_file, gs_path, pdf_settings, force, log_callback)
-
-        if status == 'success':
-            stats["successful"] += 1
-            stats["bytes_saved"] += saved
-        elif status in ('skipped', 'no_gain'):
-            stats["skipped"] += 1
-        else:
-            stats["failed"] += 1
-
-        if stats_callback:
-            stats_callback(
-                stats["successful"], stats["skipped"],
-                stats["failed"], stats["bytes_saved"]
-            )
-
-    if progress_callback:
-        progress_callback(stats["total"], stats["total"], "")
-
-    log(
-        f"Klaar — Succesvol: {stats['successful']}, "
-        f"Overgeslagen: {stats['skipped']}, "
-        f"Mislukt: {stats['failed']}, "
-        f"Bespaard: {stats['bytes_saved'] / (1024 * 1024):.1f} MB"
-    )
+            progress_callback(stats["total"], stats["total"], "")
+
+        log(
+            f"Klaar — Succesvol: {stats['successful']}, "
+            f"Overgeslagen: {stats['skipped']}, "
+            f"Mislukt: {stats['failed']}, "
+            f"Bespaard: {stats['bytes_saved'] / (1024 * 1024):.1f} MB"
+        )
+    finally:
+        metrics.untrack(tracked)
+        runlog.close()
     return stats
@@ -0,0 +1,161 @@
+"""
+Quarantine: files that exceeded their per-file budget (time or pixels, see
+core.scheduler) or failed on QUARANTINE_AFTER runs in a row. Later runs skip
+them until they change (size or mtime) or are released in the UI.
+
+Kept across runs in compress_mijn_boeken/quarantine.json:
+
+    {"D:/Boeken/x.cbz": {"size": 48123456, "mtime": 1760000000.0,
+     "failures": 1, "quarantined": true, "date": "2026-10-19 14:02",
+     "reason": "tijdslimiet van 600 s overschreden"}}
+
+Files that failed fewer times are listed too (quarantined: false), so the
+count survives restarts.
+"""
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+
+QUARANTINE_DIR = Path(__file__).parent.parent / "compress_mijn_boeken"
+QUARANTINE_FILE = "quarantine.json"
+# Failed runs in a row after which a file is quarantined
+QUARANTINE_AFTER = 2
+
+_lock = threading.Lock()
+_entries = {}
+_loaded_mtime = None  # mtime of the file when last read (another process may write it)
+
+
+def _path() -> Path:
+    return QUARANTINE_DIR / QUARANTINE_FILE
+
+
+def _refresh():
+    """(Re)reads the list if the file changed since it was last read. Caller holds _lock."""
+    global _entries, _loaded_mtime
+    try:
+        mtime = _path().stat().st_mtime
+    except OSError:
+        return
+    if mtime == _loaded_mtime:
+        return
+    try:
+        with open(_path(), encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return
+    _entries = data if isinstance(data, dict) else {}
+    _loaded_mtime = mtime
+
+
+def _save():
+    """Writes the list atomically. Caller holds _lock."""
+    global _loaded_mtime
+    path = _path()
+    temp = path.with_name(path.name + ".tmp")
+    try:
+        QUARANTINE_DIR.mkdir(exist_ok=True)
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump(_entries, f, indent=1, ensure_ascii=False)
+        os.replace(temp, path)
+        _loaded_mtime = path.stat().st_mtime
+    except OSError:
+        pass
+
+
+def _identity(file_path):
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime
+
+
+def _unchanged(entry: dict, file_path) -> bool:
+    return _identity(file_path) == (entry.get("size"), entry.get("mtime"))
+
+
+def exclude(files: list) -> tuple:
+    """
+    Splits files into (to_process, quarantined). Entries of files that have
+    changed since are dropped, so those files get another chance.
+    """
+    with _lock:
+        _refresh()
+        if not _entries:
+            return files, []
+        kept, held = [], []
+        dropped = False
+        for f in files:
+            entry = _entries.get(str(f))
+            if entry is None:
+                kept.append(f)
+            elif not _unchanged(entry, f):
+                del _entries[str(f)]
+                dropped = True
+                kept.append(f)
+            elif entry.get("quarantined"):
+                held.append(f)
+            else:
+                kept.append(f)
+        if dropped:
+            _save()
+        return kept, held
+
+
+def record(file_path, status: str, over_budget: str = None):
+    """
+    Records the outcome of one file: a budget overrun quarantines it at once,
+    QUARANTINE_AFTER failed runs in a row do too; success or no gain clears
+    its entry. Other statuses (skipped, stopped) leave it alone.
+    """
+    key = str(file_path)
+    if status in ("success", "no_gain"):
+        if key not in _entries:
+            return
+        with _lock:
+            if _entries.pop(key, None) is not None:
+                _save()
+        return
+    if status != "failed":
+        return
+
+    identity = _identity(file_path)
+    if identity is None:
+        return
+    with _lock:
+        _refresh()
+        entry = _entries.get(key)
+        if entry is None or (entry.get("size"), entry.get("mtime")) != identity:
+            entry = {"failures": 0}
+        entry["size"], entry["mtime"] = identity
+        entry["failures"] += 1
+        entry["date"] = datetime.now().strftime("%Y-%m-%d %H:%M")
+        if over_budget:
+            entry["reason"] = over_budget
+        elif "reason" not in entry:
+            entry["reason"] = "mislukt"
+        entry["quarantined"] = bool(over_budget) or entry["failures"] >= QUARANTINE_AFTER
+        _entries[key] = entry
+        _save()
+
+
+def entries() -> list:
+    """Returns [(path, entry)] of the quarantined files, newest first."""
+    with _lock:
+        _refresh()
+        held = [(path, dict(e)) for path, e in _entries.items() if e.get("quarantined")]
+    return sorted(held, key=lambda item: item[1].get("date", ""), reverse=True)
+
+
+def release(paths=None):
+    """Removes paths (all quarantined files if None) from the list; they are retried."""
+    with _lock:
+        _refresh()
+        if paths is None:
+            paths = [p for p, e in _entries.items() if e.get("quarantined")]
+        for path in paths:
+            _entries.pop(str(path), None)
+        _save()
@@ -0,0 +1,174 @@
+"""
+Run logging: every compressor run logs through one process-wide queue.
+
+Workers only put records on a bounded queue (never blocking; records that
+don't fit are counted and dropped). A single listener thread writes them as
+JSON lines to size-rotated files in compress_mijn_boeken/ and passes the
+messages on to the run's log_callback, so the UI is fed from the same queue.
+
+Per processed file a structured record is written:
+
+    {"time": ..., "tool": "cbz", "run": 3, "event": "file", "file": "...",
+     "status": "success", "bytes_before": 48123456, "bytes_after": 30123456,
+     "duration": 4.21}
+"""
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+from datetime import datetime
+from pathlib import Path
+
+LOG_DIR = Path(__file__).parent.parent / "compress_mijn_boeken"
+LOG_FILE = "compressor.jsonl"
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+# Records waiting for the listener; beyond this they are dropped, not waited for
+QUEUE_SIZE = 50000
+
+_lock = threading.Lock()
+_listener = None
+_queue = None
+_callbacks = {}  # run id -> log_callback
+_run_ids = itertools.count(1)
+
+
+class JsonLineFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "tool": getattr(record, "tool", None),
+            "run": getattr(record, "run", None),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        else:
+            entry["message"] = record.getMessage()
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records when the queue is full."""
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Records are already final; skip QueueHandler's message/exc merging
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _CallbackHandler(logging.Handler):
+    """Passes plain messages on to the log_callback of their run."""
+
+    def emit(self, record):
+        if getattr(record, "fields", None):
+            return
+        callback = _callbacks.get(getattr(record, "run", None))
+        done = getattr(record, "done", None)
+        try:
+            if callback is not None and done is None:
+                callback(record.getMessage())
+        except Exception:
+            pass
+        finally:
+            if done is not None:
+                done.set()
+
+
+def _start():
+    global _listener, _queue
+    with _lock:
+        if _listener is not None:
+            return
+        _queue = queue.Queue(QUEUE_SIZE)
+        handlers = [_CallbackHandler()]
+        try:
+            LOG_DIR.mkdir(exist_ok=True)
+            file_handler = logging.handlers.RotatingFileHandler(
+                LOG_DIR / LOG_FILE, maxBytes=LOG_MAX_BYTES,
+                backupCount=LOG_BACKUP_COUNT, encoding="utf-8",
+            )
+            file_handler.setFormatter(JsonLineFormatter())
+            file_handler.addFilter(lambda r: getattr(r, "done", None) is None)
+            handlers.append(file_handler)
+        except OSError:
+            pass  # read-only install: UI logging still works
+        _listener = logging.handlers.QueueListener(
+            _queue, *handlers, respect_handler_level=False
+        )
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+class RunLog:
+    """
+    Logging for one compressor run. message() is a drop-in log_callback;
+    file_result() writes the structured per-file record. Both return
+    immediately. close() waits (briefly) until the run's messages reached
+    log_callback, and reports dropped records.
+    """
+
+    def __init__(self, tool: str, log_callback=None):
+        _start()
+        self.tool = tool
+        self.run = next(_run_ids)
+        self._handler = _DroppingQueueHandler(_queue)
+        _callbacks[self.run] = log_callback
+
+    def _put(self, msg: str, fields: dict = None, level: int = logging.INFO):
+        record = logging.LogRecord("compressor", level, "", 0, msg, None, None)
+        record.tool = self.tool
+        record.run = self.run
+        record.fields = fields
+        record.done = None
+        self._handler.enqueue(record)
+
+    def message(self, msg: str):
+        self._put(msg)
+
+    def file_result(
+        self, file_path, status: str, bytes_before: int = None,
+        saved: int = 0, duration: float = None,
+    ):
+        self._put("", {
+            "event": "file",
+            "file": str(file_path),
+            "status": status,
+            "bytes_before": bytes_before,
+            "bytes_after": None if bytes_before is None else bytes_before - saved,
+            "duration": None if duration is None else round(duration, 3),
+        })
+
+    def close(self, timeout: float = 5.0):
+        if self._handler.dropped:
+            self._put(f"Log wachtrij vol — {self._handler.dropped} regel(s) niet gelogd",
+                      level=logging.WARNING)
+        done = threading.Event()
+        try:
+            _queue.put(self._marker(done), timeout=timeout)
+            done.wait(timeout)
+        except queue.Full:
+            pass
+        _callbacks.pop(self.run, None)
+
+    def _marker(self, done):
+        record = logging.LogRecord("compressor", logging.DEBUG, "", 0, "", None, None)
+        record.run = self.run
+        record.fields = None
+        record.done = done
+        return record
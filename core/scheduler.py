@@ -0,0 +1,913 @@
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager, nullcontext
+from io import BytesIO
+from pathlib import Path
+
+from core import metrics
+
+# Window (seconds) over which throughput is averaged
+_THROUGHPUT_WINDOW = 10.0
+# Files read ahead of the workers when no governor says otherwise
+PREFETCH_DEPTH = 2
+# Finished files queued for write-back when no governor says otherwise
+WRITE_BEHIND_DEPTH = 2
+# Deferred writes (e.g. markers) the write-behind thread gathers per batch
+DEFERRED_BATCH = 64
+# Per-file budgets when no governor says otherwise (0 = unlimited)
+FILE_TIMEOUT = 600.0  # wall-clock seconds of processing per file
+MAX_MEGAPIXELS = 150  # pixels per decoded image, in millions
+
+_local = threading.local()
+# Prefetcher.take() result for files wanted() turned down
+UNWANTED = object()
+
+
+class _TabUsage:
+    """Book-keeping for one registered tool."""
+
+    def __init__(self):
+        self.cpu_in_use = 0
+        self.io_in_use = 0
+        self.files_done = 0
+        self.bytes_saved = 0
+        self.events = deque()  # (timestamp, bytes_saved)
+        self.cpu_limit = None  # set by the tool's ConcurrencyController
+
+
+class MemoryBudget:
+    """
+    Admission control on estimated working-set bytes.
+
+    reserve(n) blocks until n more bytes fit under the budget. An item larger
+    than the whole budget is admitted once nothing else is reserved, so it
+    runs alone instead of waiting forever.
+    """
+
+    def __init__(self, budget_bytes: int):
+        self.budget = max(1, budget_bytes)
+        self.in_use = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def reserve(self, nbytes: int):
+        nbytes = min(max(0, nbytes), self.budget)
+        with self._cond:
+            while self.in_use and self.in_use + nbytes > self.budget:
+                self._cond.wait(0.5)
+            self.in_use += nbytes
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_use -= nbytes
+                self._cond.notify_all()
+
+
+def _has_psutil() -> bool:
+    try:
+        import psutil  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class SystemSampler:
+    """
+    CPU and I/O-wait fractions (0..1) of the whole machine since the previous
+    sample(): from psutil when installed, else /proc/stat (Linux), else this
+    process's CPU time (I/O wait then unknown, None).
+    """
+
+    def __init__(self):
+        self._psutil = _has_psutil()
+        self._last = self._times()
+
+    def _times(self):
+        if self._psutil:
+            import psutil
+            t = psutil.cpu_times()
+            return sum(t), t.idle, getattr(t, "iowait", None)
+        try:
+            with open("/proc/stat") as f:
+                fields = [float(v) for v in f.readline().split()[1:]]
+            return sum(fields), fields[3], fields[4]
+        except (OSError, IndexError, ValueError):
+            cpus = os.cpu_count() or 1
+            wall = time.monotonic() * cpus
+            return wall, wall - time.process_time(), None
+
+    def sample(self) -> tuple:
+        """Returns (cpu_busy, io_wait) since the previous call."""
+        now = self._times()
+        total, idle, iowait = (a - b if a is not None and b is not None else None
+                               for a, b in zip(now, self._last))
+        self._last = now
+        if not total or total <= 0:
+            return 0.0, None
+        busy = 1.0 - (idle + (iowait or 0)) / total
+        return max(0.0, min(1.0, busy)), None if iowait is None else iowait / total
+
+
+class ConcurrencyController:
+    """
+    Hill-climbing controller for the number of files a tool has in flight.
+
+    Every INTERVAL seconds (once at least MIN_FILES files finished) it compares
+    the tool's files/s with the previous interval: an improvement keeps the
+    direction of the last step, a drop reverses it, and when throughput is
+    flat it steps down while the CPU is saturated or I/O wait is high, and up
+    otherwise. The level stays within [minimum, maximum] and never exceeds
+    the tool's fair CPU share.
+    """
+
+    INTERVAL = 5.0
+    MIN_FILES = 4
+    TOLERANCE = 0.05
+    CPU_BUSY = 0.95
+    IO_WAIT_HIGH = 0.25
+
+    def __init__(self, minimum: int = 1, maximum: int = 0, sampler: SystemSampler = None):
+        self.minimum = max(1, minimum)
+        self.maximum = maximum  # 0 = no limit besides the CPU share
+        self.level = None
+        self._sampler = sampler or SystemSampler()
+        self._direction = -1
+        self._last_rate = None
+        self._mark = (time.monotonic(), 0)
+
+    def _bounds(self, ceiling: int) -> tuple:
+        high = min(self.maximum, ceiling) if self.maximum else ceiling
+        return min(self.minimum, high), max(1, high)
+
+    def tune(self, files_done: int, ceiling: int) -> int:
+        """Returns the current level, adjusting it when an interval has passed."""
+        low, high = self._bounds(ceiling)
+        if self.level is None:
+            self.level = high  # start where a fixed pool would be
+        now = time.monotonic()
+        since, done_before = self._mark
+        done = files_done - done_before
+        if now - since >= self.INTERVAL and done >= self.MIN_FILES:
+            rate = done / (now - since)
+            cpu_busy, io_wait = self._sampler.sample()
+            if self._last_rate is None:
+                pass  # first interval: probe in the initial direction
+            elif rate > self._last_rate * (1 + self.TOLERANCE):
+                pass
+            elif rate < self._last_rate * (1 - self.TOLERANCE):
+                self._direction = -self._direction
+            elif cpu_busy >= self.CPU_BUSY or (io_wait or 0) >= self.IO_WAIT_HIGH:
+                self._direction = -1
+            else:
+                self._direction = 1
+            self._last_rate = rate
+            self._mark = (now, files_done)
+            self.level += self._direction
+        self.level = max(low, min(high, self.level))
+        if self.level == high and self._direction > 0:
+            self._direction = -1
+        elif self.level == low and self._direction < 0:
+            self._direction = 1
+        return self.level
+
+
+class ResourceGovernor:
+    """
+    App-wide CPU, I/O and memory budget shared fairly across running tools.
+
+    Every running tool registers and gets a Lease. The CPU budget is split
+    evenly across active tools; when a tool finishes, its share goes to the
+    tools that are still running. Memory is admitted first come, first served
+    against one shared MemoryBudget.
+
+    With adaptive=True each tool's number of files in flight (and CPU slots)
+    is tuned by a ConcurrencyController between min_workers and max_workers
+    (0 = up to its share), instead of always using the full share.
+
+    file_timeout (seconds) and max_megapixels are the per-file budgets
+    enforced by run_files (0 = unlimited).
+    """
+
+    def __init__(
+        self,
+        cpu_workers: int = 0,
+        io_workers: int = 4,
+        memory_mb: int = 2048,
+        prefetch_depth: int = PREFETCH_DEPTH,
+        write_behind_depth: int = WRITE_BEHIND_DEPTH,
+        adaptive: bool = False,
+        min_workers: int = 1,
+        max_workers: int = 0,
+        file_timeout: float = FILE_TIMEOUT,
+        max_megapixels: int = MAX_MEGAPIXELS,
+    ):
+        self.adaptive = adaptive
+        self.file_timeout = max(0, file_timeout)
+        self.max_megapixels = max(0, max_megapixels)
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.cpu_budget = max(1, cpu_workers or os.cpu_count() or 2)
+        self.io_budget = max(1, io_workers)
+        self.prefetch_depth = max(0, prefetch_depth)
+        self.write_behind_depth = max(0, write_behind_depth)
+        self.memory = MemoryBudget(memory_mb * 1024 * 1024)
+        self._cond = threading.Condition()
+        self._tabs: dict[str, _TabUsage] = {}
+
+    @classmethod
+    def from_config(cls, app: dict) -> "ResourceGovernor":
+        """Builds the governor from the "app" section of the config (core.config)."""
+        return cls(
+            cpu_workers=app.get("cpu_workers", 0),
+            io_workers=app.get("io_workers", 4),
+            memory_mb=app.get("memory_mb", 2048),
+            prefetch_depth=app.get("prefetch_depth", PREFETCH_DEPTH),
+            write_behind_depth=app.get("write_behind_depth", WRITE_BEHIND_DEPTH),
+            adaptive=app.get("adaptive_workers", False),
+            min_workers=app.get("min_workers", 1),
+            max_workers=app.get("max_workers", 0),
+            file_timeout=app.get("file_timeout", FILE_TIMEOUT),
+            max_megapixels=app.get("max_megapixels", MAX_MEGAPIXELS),
+        )
+
+    # ── Registration ──────────────────────────────────────────────────────────
+
+    def register(self, name: str) -> "Lease":
+        with self._cond:
+            self._tabs[name] = _TabUsage()
+            self._cond.notify_all()
+        return Lease(self, name)
+
+    def unregister(self, name: str):
+        with self._cond:
+            self._tabs.pop(name, None)
+            self._cond.notify_all()
+
+    # ── Shares ────────────────────────────────────────────────────────────────
+
+    def _share(self, name: str, budget: int) -> int:
+        names = sorted(self._tabs)
+        if name not in names:
+            return 1
+        base, extra = divmod(budget, len(names))
+        return max(1, base + (1 if names.index(name) < extra else 0))
+
+    def cpu_share(self, name: str) -> int:
+        with self._cond:
+            return self._share(name, self.cpu_budget)
+
+    def io_share(self, name: str) -> int:
+        with self._cond:
+            return self._share(name, self.io_budget)
+
+    # ── Slots ─────────────────────────────────────────────────────────────────
+
+    def _acquire(self, name: str, kind: str):
+        budget = self.cpu_budget if kind == "cpu" else self.io_budget
+        attr = f"{kind}_in_use"
+        with self._cond:
+            while True:
+                usage = self._tabs.get(name)
+                if usage is None:
+                    return
+                total = sum(getattr(u, attr) for u in self._tabs.values())
+                limit = self._share(name, budget)
+                if kind == "cpu" and usage.cpu_limit is not None:
+                    limit = min(limit, usage.cpu_limit)
+                if getattr(usage, attr) < limit and total < budget:
+                    setattr(usage, attr, getattr(usage, attr) + 1)
+                    return
+                self._cond.wait(0.5)
+
+    def _release(self, name: str, kind: str):
+        attr = f"{kind}_in_use"
+        with self._cond:
+            usage = self._tabs.get(name)
+            if usage is not None:
+                setattr(usage, attr, max(0, getattr(usage, attr) - 1))
+            self._cond.notify_all()
+
+    def set_cpu_limit(self, name: str, limit: int):
+        with self._cond:
+            usage = self._tabs.get(name)
+            if usage is not None and usage.cpu_limit != limit:
+                usage.cpu_limit = limit
+                self._cond.notify_all()
+
+    def files_done(self, name: str) -> int:
+        with self._cond:
+            usage = self._tabs.get(name)
+            return usage.files_done if usage is not None else 0
+
+    # ── Throughput ────────────────────────────────────────────────────────────
+
+    def record(self, name: str, bytes_saved: int = 0):
+        now = time.monotonic()
+        with self._cond:
+            usage = self._tabs.get(name)
+            if usage is None:
+                return
+            usage.files_done += 1
+            usage.bytes_saved += bytes_saved
+            usage.events.append((now, bytes_saved))
+            while usage.events and usage.events[0][0] < now - _THROUGHPUT_WINDOW:
+                usage.events.popleft()
+
+    def snapshot(self) -> dict:
+        """
+        Returns {"tabs": {name: {...}}, "combined": {...}} with per-tool and
+        combined files/s, bytes saved/s and slot usage.
+        """
+        now = time.monotonic()
+        tabs = {}
+        with self._cond:
+            for name, usage in self._tabs.items():
+                while usage.events and usage.events[0][0] < now - _THROUGHPUT_WINDOW:
+                    usage.events.popleft()
+                tabs[name] = {
+                    "files_per_sec": len(usage.events) / _THROUGHPUT_WINDOW,
+                    "bytes_per_sec": sum(b for _, b in usage.events) / _THROUGHPUT_WINDOW,
+                    "cpu_in_use": usage.cpu_in_use,
+                    "cpu_share": self._share(name, self.cpu_budget),
+                    "level": usage.cpu_limit,
+                    "io_in_use": usage.io_in_use,
+                    "files_done": usage.files_done,
+                }
+        combined = {
+            "files_per_sec": sum(t["files_per_sec"] for t in tabs.values()),
+            "bytes_per_sec": sum(t["bytes_per_sec"] for t in tabs.values()),
+            "cpu_in_use": sum(t["cpu_in_use"] for t in tabs.values()),
+            "cpu_budget": self.cpu_budget,
+            "io_in_use": sum(t["io_in_use"] for t in tabs.values()),
+            "io_budget": self.io_budget,
+            "memory_in_use": self.memory.in_use,
+            "memory_budget": self.memory.budget,
+        }
+        return {"tabs": tabs, "combined": combined}
+
+
+class Lease:
+    """A running tool's handle on the ResourceGovernor."""
+
+    def __init__(self, governor: ResourceGovernor, name: str):
+        self.governor = governor
+        self.name = name
+        self.controller = (
+            ConcurrencyController(governor.min_workers, governor.max_workers)
+            if governor.adaptive else None
+        )
+
+    def cpu_share(self) -> int:
+        return self.governor.cpu_share(self.name)
+
+    def concurrency(self) -> int:
+        """
+        Number of files the tool may have in flight: its CPU share, or the
+        level its ConcurrencyController settles on within that share.
+        """
+        share = self.cpu_share()
+        if self.controller is None:
+            return share
+        level = self.controller.tune(self.governor.files_done(self.name), share)
+        self.governor.set_cpu_limit(self.name, level)
+        return level
+
+    @contextmanager
+    def cpu(self):
+        self.governor._acquire(self.name, "cpu")
+        try:
+            yield
+        finally:
+            self.governor._release(self.name, "cpu")
+
+    @contextmanager
+    def io(self):
+        self.governor._acquire(self.name, "io")
+        try:
+            yield
+        finally:
+            self.governor._release(self.name, "io")
+
+    def memory(self, nbytes: int):
+        return self.governor.memory.reserve(nbytes)
+
+    def record(self, bytes_saved: int = 0):
+        self.governor.record(self.name, bytes_saved)
+
+    def close(self):
+        self.governor.unregister(self.name)
+
+
+def io_slot():
+    """
+    Context manager for a disk/network phase of the current file.
+    Takes an I/O slot from the lease of the calling worker thread, if any.
+    """
+    lease = getattr(_local, "lease", None)
+    return lease.io() if lease is not None else nullcontext()
+
+
+class StopRequested(Exception):
+    """Raised inside a worker when its run's stop_event has been set."""
+
+
+def stop_requested() -> bool:
+    """True if the stop_event of the run the calling worker belongs to is set."""
+    stop_event = getattr(_local, "stop_event", None)
+    return stop_event is not None and stop_event.is_set()
+
+
+class BudgetExceeded(Exception):
+    """Raised inside a worker when its file exceeds the per-file time or pixel budget."""
+
+
+def _over_time() -> str:
+    """The reason the calling worker's file is over its time budget, or ''."""
+    deadline = getattr(_local, "deadline", None)
+    if deadline is None or time.monotonic() < deadline:
+        return ""
+    return f"tijdslimiet van {_local.file_timeout:g} s overschreden"
+
+
+def check_stop():
+    """
+    Raises StopRequested if the calling worker's run has been stopped, or
+    BudgetExceeded if its file has used up its time budget.
+    """
+    if stop_requested():
+        raise StopRequested()
+    reason = _over_time()
+    if reason:
+        raise BudgetExceeded(reason)
+
+
+def check_pixels(size: tuple):
+    """
+    Raises BudgetExceeded if an image of size (width, height) exceeds the
+    calling worker's pixel budget. Call it before decoding.
+    """
+    limit = getattr(_local, "max_megapixels", 0)
+    if limit and size[0] * size[1] > limit * 1_000_000:
+        raise BudgetExceeded(
+            f"{size[0]}×{size[1]} pixels, limiet {limit} megapixels"
+        )
+
+
+def run_process(cmd: list, **kwargs) -> subprocess.CompletedProcess:
+    """
+    subprocess.run(cmd, capture_output=True, text=True, **kwargs) that
+    terminates the process and raises StopRequested as soon as the calling
+    worker's run is stopped, or BudgetExceeded once its file has used up its
+    time budget.
+    """
+    with subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, **kwargs
+    ) as proc:
+        while True:
+            try:
+                stdout, stderr = proc.communicate(timeout=0.2)
+                break
+            except subprocess.TimeoutExpired:
+                reason = _over_time()
+                if stop_requested() or reason:
+                    proc.terminate()
+                    try:
+                        proc.wait(timeout=2)
+                    except subprocess.TimeoutExpired:
+                        proc.kill()
+                    if reason:
+                        raise BudgetExceeded(reason)
+                    raise StopRequested()
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+
+class Prefetcher:
+    """
+    Read-ahead stage: a background thread copies the next files to local
+    storage while earlier ones are being processed, at most depth files
+    ahead. With spool=True each file goes to a local temp file, otherwise
+    into memory; spool may also be a function of the file (mixed runs).
+    Reads take an I/O slot from lease, if given.
+
+    wanted(file) -> bool, if given, skips files the worker won't open
+    (e.g. already marked as processed); take() then returns UNWANTED.
+    """
+
+    def __init__(self, files: list, depth: int, lease: Lease = None, wanted=None, spool=True):
+        self._files = list(files)
+        self._depth = max(1, depth)
+        self._lease = lease
+        self._wanted = wanted
+        self._spool = spool
+        self._ready = {}  # file -> local path (str), bytes, or None
+        self._buffered = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._tool = lease.name if lease is not None else ""
+        self._gauge = metrics.add_queue(self._tool, "prefetch", lambda: self._buffered)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _fetch(self, f):
+        try:
+            if self._wanted is not None and not self._wanted(f):
+                return UNWANTED
+            with self._lease.io() if self._lease is not None else nullcontext():
+                spool = self._spool(f) if callable(self._spool) else self._spool
+                if not spool:
+                    return Path(f).read_bytes()
+                fd, local = tempfile.mkstemp(prefix="prefetch_", suffix=Path(f).suffix)
+                os.close(fd)
+                try:
+                    shutil.copyfile(f, local)
+                except Exception:
+                    os.unlink(local)
+                    raise
+                return local
+        except Exception:
+            return None  # the worker reads the original and reports the error
+
+    def _run(self):
+        for f in self._files:
+            with self._cond:
+                while not self._closed and self._buffered >= self._depth:
+                    self._cond.wait(0.5)
+                if self._closed:
+                    return
+            start = time.monotonic()
+            item = self._fetch(f)
+            if item is not None and item is not UNWANTED:
+                metrics.observe("read", self._tool, time.monotonic() - start)
+            with self._cond:
+                if self._closed:
+                    _discard(item)
+                    return
+                self._ready[f] = item
+                if item is not None and item is not UNWANTED:
+                    self._buffered += 1
+                self._cond.notify_all()
+
+    def take(self, f):
+        """
+        Blocks until f has been read ahead; returns its local copy, UNWANTED,
+        or None (not read, e.g. the read failed).
+        """
+        with self._cond:
+            while f not in self._ready and not self._closed:
+                self._cond.wait(0.5)
+            item = self._ready.pop(f, None)
+            if item is not None and item is not UNWANTED:
+                self._buffered -= 1
+                self._cond.notify_all()
+            return item
+
+    def close(self):
+        """Stops reading ahead, waits for a copy in progress and removes unused copies."""
+        with self._cond:
+            self._closed = True
+            for item in self._ready.values():
+                _discard(item)
+            self._ready.clear()
+            self._cond.notify_all()
+        self._thread.join()
+        metrics.remove_queue(self._gauge)
+
+
+class WriteBehind:
+    """
+    Write-behind stage: commit functions (replace the original, write the
+    marker) run in submission order on one I/O thread while the workers move
+    on to the next file. submit() blocks while depth commits are queued, so
+    finished outputs can't pile up; close() runs everything still queued
+    before returning.
+
+    Small follow-up writes a commit hands to defer_write() are gathered and
+    run together under one I/O slot: once DEFERRED_BATCH have gathered,
+    whenever the queue runs empty, and on close().
+    """
+
+    def __init__(self, depth: int, lease: Lease = None):
+        self._queue = queue.Queue(maxsize=max(1, depth))
+        self._lease = lease
+        self._deferred = []
+        self._tool = lease.name if lease is not None else ""
+        self._gauge = metrics.add_queue(self._tool, "write_behind", self._queue.qsize)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        _local.lease = self._lease  # commits take I/O slots via io_slot()
+        _local.deferred = self._deferred  # see defer_write()
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._flush()
+                return
+            commit, fut = job
+            start = time.monotonic()
+            try:
+                fut.set_result(commit())
+            except BaseException as e:
+                fut.set_exception(e)
+            metrics.observe("commit", self._tool, time.monotonic() - start)
+            if len(self._deferred) >= DEFERRED_BATCH or self._queue.empty():
+                self._flush()
+
+    def _flush(self):
+        if not self._deferred:
+            return
+        batch, self._deferred[:] = list(self._deferred), []
+        with io_slot():
+            for write in batch:
+                try:
+                    write()
+                except Exception:
+                    pass  # like mark_as_processed(): a lost marker only costs a re-check
+
+    def submit(self, commit) -> Future:
+        fut = Future()
+        self._queue.put((commit, fut))
+        return fut
+
+    def close(self):
+        """Flushes all queued commits and stops the I/O thread."""
+        self._queue.put(None)
+        self._thread.join()
+        metrics.remove_queue(self._gauge)
+
+
+def write_behind(commit):
+    """
+    Hands commit() — the write-back phase of the current file — to the
+    write-behind stage of the calling worker and returns a Future of its
+    result. Outside run_files it simply runs commit() and returns the result.
+    """
+    writer = getattr(_local, "writer", None)
+    if writer is None:
+        return commit()
+    return writer.submit(commit)
+
+
+def defer_write(write):
+    """
+    Hands write() — a small write that may lag behind its file's commit, such
+    as a marker — to the batch of the write-behind thread it's called on (see
+    WriteBehind). Anywhere else it runs write() at once.
+    """
+    deferred = getattr(_local, "deferred", None)
+    if deferred is None:
+        write()
+    else:
+        deferred.append(write)
+
+
+def then(result, fn):
+    """
+    Returns fn(result), or — when result is a Future from write_behind() — a
+    Future of fn applied to its eventual result.
+    """
+    if not isinstance(result, Future):
+        return fn(result)
+    chained = Future()
+
+    def _done(fut):
+        try:
+            chained.set_result(fn(fut.result()))
+        except BaseException as e:
+            chained.set_exception(e)
+
+    result.add_done_callback(_done)
+    return chained
+
+
+def _discard(item):
+    if isinstance(item, str):
+        try:
+            os.unlink(item)
+        except OSError:
+            pass
+
+
+def _prefetched(path):
+    source = getattr(_local, "source", None)
+    if source is not None and source[0] == path and source[1] is not UNWANTED:
+        return source[1]
+    return None
+
+
+def wanted_decision(path):
+    """
+    Returns run_files' wanted(path) for the calling worker's current file —
+    True or False — or None if it wasn't made (no wanted, or it failed), so
+    the worker needn't check again.
+    """
+    decision = getattr(_local, "wanted", None)
+    if decision is not None and decision[0] == path:
+        return decision[1]
+    return None
+
+
+def read_source(path) -> bytes:
+    """
+    Returns the contents of path, from its read-ahead copy when the current
+    worker has one, otherwise read from path under an I/O slot.
+    """
+    item = _prefetched(path)
+    if isinstance(item, bytes):
+        return item
+    if isinstance(item, str):
+        return Path(item).read_bytes()
+    with io_slot():
+        return Path(path).read_bytes()
+
+
+@contextmanager
+def open_source(path):
+    """
+    Yields something to read path from: its read-ahead copy (a local path, or
+    a file object for in-memory copies) when the current worker has one,
+    otherwise path itself while holding an I/O slot.
+    """
+    item = _prefetched(path)
+    if isinstance(item, str):
+        yield item
+    elif isinstance(item, bytes):
+        yield BytesIO(item)
+    else:
+        with io_slot():
+            yield path
+
+
+def run_files(
+    files: list,
+    worker,
+    stop_event: threading.Event = None,
+    lease: Lease = None,
+    estimate=None,
+    wanted=None,
+    spool=True,
+):
+    """
+    Runs worker(file) for every file and yields (file, result) as they finish.
+
+    Without a lease files are processed one at a time, in order. With a lease
+    up to lease.concurrency() files are in flight (the CPU share, or the level
+    picked by the adaptive controller); it is re-read while running, so it
+    grows when other tools finish. Stops submitting new files
+    once stop_event is set; files already in flight are completed.
+
+    estimate(file) -> bytes, if given, is reserved from the app-wide memory
+    budget before a file may take a CPU slot.
+
+    A Prefetcher reads the next files ahead (lease.governor.prefetch_depth,
+    else PREFETCH_DEPTH; 0 disables it); workers get at the local copy via
+    read_source() / open_source(). wanted and spool are passed to it.
+    wanted(file) is called once per file (by the Prefetcher, else before the
+    worker); the worker gets the answer from wanted_decision().
+
+    Workers can call check_stop() / run_process() to react to stop_event
+    within a file. The same calls enforce the per-file time budget
+    (lease.governor.file_timeout, else FILE_TIMEOUT; counted from when the
+    file gets its CPU slot) by raising BudgetExceeded, and check_pixels()
+    the pixel budget (max_megapixels, else MAX_MEGAPIXELS).
+
+    A worker may return a Future from write_behind(); its file is yielded
+    once the commit has run on the WriteBehind stage
+    (lease.governor.write_behind_depth, else WRITE_BEHIND_DEPTH). All queued
+    commits are flushed before run_files returns, also after a stop.
+    """
+    depth = lease.governor.prefetch_depth if lease is not None else PREFETCH_DEPTH
+    commit_depth = lease.governor.write_behind_depth if lease is not None else WRITE_BEHIND_DEPTH
+    prefetcher = Prefetcher(files, depth, lease, wanted, spool) if depth else None
+    writer = WriteBehind(commit_depth, lease) if commit_depth else None
+    committing = {}  # commit Future -> file
+    governor = lease.governor if lease is not None else None
+    file_timeout = governor.file_timeout if governor is not None else FILE_TIMEOUT
+    max_megapixels = governor.max_megapixels if governor is not None else MAX_MEGAPIXELS
+
+    def _call(f):
+        # Taken before any memory/CPU reservation, so a worker waiting on its
+        # read-ahead copy never holds a slot another file needs
+        item = prefetcher.take(f) if prefetcher is not None else None
+        _local.source = (f, item)
+        decision = _decide(f, item)
+        _local.wanted = (f, decision)
+        _local.writer = writer
+        _local.stop_event = stop_event
+        _local.file_timeout = file_timeout
+        _local.max_megapixels = max_megapixels
+        try:
+            # A file the worker will skip isn't opened for an estimate either
+            nbytes = _estimate(f) if decision is not False else 0
+            with lease.memory(nbytes) if lease is not None else nullcontext():
+                with lease.cpu() if lease is not None else nullcontext():
+                    start = time.monotonic()
+                    _local.deadline = start + file_timeout if file_timeout else None
+                    try:
+                        return worker(f)
+                    finally:
+                        metrics.observe(
+                            "process", lease.name if lease is not None else "",
+                            time.monotonic() - start,
+                        )
+        finally:
+            _local.source = None
+            _local.wanted = None
+            _local.writer = None
+            _local.stop_event = None
+            _local.deadline = None
+            _local.max_megapixels = 0
+            _discard(item)
+
+    def _decide(f, item):
+        if wanted is None:
+            return None
+        if item is UNWANTED:
+            return False
+        if item is not None:
+            return True
+        if prefetcher is not None:
+            return None  # the read (or wanted itself) failed: the worker decides
+        try:
+            return bool(wanted(f))
+        except Exception:
+            return None
+
+    def _estimate(f):
+        if estimate is None:
+            return 0
+        try:
+            return estimate(f)
+        except Exception:
+            return 0
+
+    def _committed(only_done=True):
+        for fut in list(committing):
+            if only_done and not fut.done():
+                continue
+            f = committing.pop(fut)
+            yield f, fut.result()
+
+    try:
+        if lease is None:
+            for f in files:
+                if stop_event and stop_event.is_set():
+                    break
+                result = _call(f)
+                if isinstance(result, Future):
+                    committing[result] = f
+                else:
+                    yield f, result
+                yield from _committed()
+            yield from _committed(only_done=False)
+            return
+
+        def _task(f):
+            _local.lease = lease
+            try:
+                return _call(f)
+            finally:
+                _local.lease = None
+
+        pending = iter(files)
+        exhausted = False
+        in_flight = {}
+
+        with ThreadPoolExecutor(max_workers=lease.governor.cpu_budget) as pool:
+            while True:
+                stopped = stop_event is not None and stop_event.is_set()
+                while not exhausted and not stopped and len(in_flight) < lease.concurrency():
+                    f = next(pending, None)
+                    if f is None:
+                        exhausted = True
+                        break
+                    in_flight[pool.submit(_task, f)] = f
+
+                if not in_flight and not committing:
+                    return
+
+                wait(
+                    list(in_flight) + list(committing),
+                    timeout=0.5, return_when=FIRST_COMPLETED,
+                )
+                for fut in [fut for fut in in_flight if fut.done()]:
+                    f = in_flight.pop(fut)
+                    result = fut.result()
+                    if isinstance(result, Future):
+                        committing[result] = f
+                    else:
+                        yield f, result
+                yield from _committed()
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
+        if writer is not None:
+            writer.close()
@@ -1,23 +1,184 @@
 from pathlib import Path
 from datetime import datetime
 import logging
+import zipfile
 
+from core.scheduler import open_source, wanted_decision
+from core.stamp import read_stamp, make_stamp, parse_stamp, STAMPED_EXTENSIONS
 
-def should_process_file(file_path: Path) -> bool:
-    """Returns True if the file should be processed (no .compressed marker exists)."""
-    return not Path(str(file_path) + '.compressed').exists()
+# pdf_settings presets, most aggressive first
+PDF_PRESET_ORDER = ('/screen', '/ebook', '/printer', '/prepress')
 
+# Settings where a lower value compresses further
+_DIMENSIONS = ('target_width', 'target_height')
 
-def mark_as_processed(file_path: Path) -> None:
-    """Creates a .compressed marker file with current datetime."""
+# Already-compressed media; deflating them again costs CPU for ~no gain
+STORED_EXTENSIONS = frozenset({
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif', '.jxl',
+    '.woff', '.woff2', '.mp3', '.m4a', '.mp4', '.ogg', '.zip',
+})
+
+
+def processed_record(file_path: Path):
+    """
+    Returns the processed-state record of file_path: the payload of its
+    .compressed marker, else of its embedded stamp (core.stamp), as
+    {tool, date, settings}. Markers written before settings were recorded
+    give {}. None if the file was never processed.
+    """
+    marker = Path(str(file_path) + '.compressed')
+    try:
+        data = marker.read_bytes()
+    except OSError:
+        return read_stamp(file_path)
+    return parse_stamp(data) or {}
+
+
+def more_aggressive(recorded: dict, current: dict) -> bool:
+    """
+    Returns True if the current settings fingerprint compresses further than
+    the recorded one, so that reprocessing can't re-encode at the same or a
+    higher quality: the quality (quality, target_ssim or pdf_settings) must
+    be strictly lower, and no target dimension may be larger. A smaller
+    target dimension alone is not enough, since it would re-encode the
+    pixels at the same quality. Fixed quality vs. SSIM target, a different
+    output_format or a missing value count as not comparable. crop_margins
+    is ignored.
+    """
+    if not recorded or not current:
+        return False
+    if current.get("output_format") != recorded.get("output_format"):
+        return False
+
+    if "pdf_settings" in current:
+        try:
+            return (
+                PDF_PRESET_ORDER.index(current["pdf_settings"])
+                < PDF_PRESET_ORDER.index(recorded.get("pdf_settings"))
+            )
+        except ValueError:
+            return False
+
+    if (current.get("target_ssim") is None) != (recorded.get("target_ssim") is None):
+        return False
+    quality_key = "quality" if current.get("target_ssim") is None else "target_ssim"
+    keys = [k for k in _DIMENSIONS if k in current] + [quality_key]
+
+    for key in keys:
+        old, new = recorded.get(key), current.get(key)
+        if not isinstance(old, (int, float)) or not isinstance(new, (int, float)):
+            return False
+        if new > old:
+            return False
+    return current[quality_key] < recorded[quality_key]
+
+
+def should_process_file(file_path: Path, settings: dict = None) -> bool:
+    """
+    Returns True if the file should be processed: it has no processed record
+    (no .compressed marker, and no provenance stamp embedded in it — only
+    read when the marker is missing, e.g. after Calibre moved the book), or
+    — with settings, the current settings fingerprint — its record was made
+    with less aggressive settings (see more_aggressive()).
+
+    A file modified after its marker (e.g. Calibre rewrote its metadata) is
+    judged by its embedded stamp instead, so touching a file we wrote never
+    causes a re-encode at the same settings. A stampable file without a
+    stamp was replaced by one we never wrote and is processed; for CBRs,
+    which are never stamped, the marker still counts.
+    """
+    marker = Path(str(file_path) + '.compressed')
+    if settings is None:
+        if marker.exists():
+            return False
+        return read_stamp(file_path) is None
     try:
-        Path(str(file_path) + '.compressed').write_text(
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        )
+        record = parse_stamp(marker.read_bytes()) or {}
+    except OSError:
+        # No marker: the stamp is the record (read once, not again below)
+        stamp = read_stamp(file_path)
+        return stamp is None or more_aggressive(stamp.get("settings"), settings)
+    if _modified_after_marker(file_path, marker):
+        stamp = read_stamp(file_path)
+        if stamp is not None:
+            record = stamp
+        elif str(file_path).lower().endswith(STAMPED_EXTENSIONS):
+            return True
+    return more_aggressive(record.get("settings"), settings)
+
+
+def needs_processing(file_path: Path, settings: dict, force: bool = False) -> bool:
+    """
+    should_process_file() as a worker asks it: the decision run_files'
+    wanted() already made for file_path is reused (see
+    core.scheduler.wanted_decision), so the marker and stamp are read once.
+    Always True with force.
+    """
+    decision = wanted_decision(file_path)
+    if decision is not None:
+        return decision
+    return force or should_process_file(file_path, settings)
+
+
+def _modified_after_marker(file_path: Path, marker: Path) -> bool:
+    try:
+        return Path(file_path).stat().st_mtime > marker.stat().st_mtime
+    except OSError:
+        return False
+
+
+def changed_since_processed(file_path: Path) -> bool:
+    """
+    Returns True if the file has no marker or was modified after its marker
+    was written (e.g. replaced by Calibre). Our own write-back always happens
+    before the marker, so it doesn't count as a change. Without a marker, a
+    file carrying our stamp (moved or copied in) is unchanged as well.
+    """
+    marker = Path(str(file_path) + '.compressed')
+    if not marker.exists():
+        return read_stamp(file_path) is None
+    return _modified_after_marker(file_path, marker)
+
+
+def mark_as_processed(file_path: Path, tool: str = None, settings: dict = None) -> None:
+    """
+    Creates a .compressed marker file: the provenance stamp for tool and its
+    settings fingerprint if given (see core.stamp), else the current datetime.
+    """
+    try:
+        marker = Path(str(file_path) + '.compressed')
+        if settings is not None:
+            marker.write_bytes(make_stamp(tool, settings))
+        else:
+            marker.write_text(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
     except Exception:
         pass
 
 
+def zip_compress_type(name) -> int:
+    """ZIP compression for an archive entry: stored for STORED_EXTENSIONS, else deflated."""
+    suffix = Path(str(name)).suffix.lower()
+    return zipfile.ZIP_STORED if suffix in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def estimate_archive_bytes(archive_path: Path) -> int:
+    """
+    Returns the uncompressed size of a ZIP (EPUB/CBZ) or RAR (CBR) archive
+    from its central directory (of its read-ahead copy, if the current worker
+    has one), without extracting anything. 0 if unknown.
+    """
+    try:
+        with open_source(archive_path) as src:
+            if str(archive_path).lower().endswith('.cbr'):
+                import rarfile
+                with rarfile.RarFile(src) as rf:
+                    return sum(info.file_size for info in rf.infolist())
+            with zipfile.ZipFile(src) as zf:
+                return sum(info.file_size for info in zf.infolist())
+    except Exception:
+        return 0
+
+
 def setup_logging(tool_name: str) -> logging.Logger:
     """Configures a logger with console + timestamped log file in compress_mijn_boeken/."""
     logger = logging.getLogger(tool_name)
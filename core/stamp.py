@@ -0,0 +1,149 @@
+"""
+Provenance stamps: a small "processed by / settings / date" record embedded
+in the file itself, so the processed state survives Calibre moving a book
+or the library being synced to another host (which lose the .compressed
+sidecar).
+
+Where the stamp lives, and what read_stamp() reads to find it:
+  EPUB/CBZ  ZIP archive comment     last STAMP_MAX + 22 bytes (end of central directory)
+  JPG       COM segment after SOI   first _HEADER_BYTES bytes
+  PDF       /CalibreCompressor key  last _PDF_TAIL_BYTES bytes (Ghostscript writes
+            in the Info dictionary  the Info dictionary near the end)
+
+CBR archives written by rar.exe are not stamped and rely on the sidecar.
+"""
+import json
+import os
+import re
+import struct
+from datetime import datetime
+
+STAMP_PREFIX = b'calibre-compressor/1 '
+# Longer stamps are never written, so tail/header reads can stay this small
+STAMP_MAX = 1024
+
+# Files read_stamp() can find a stamp in (CBRs are never stamped)
+STAMPED_EXTENSIONS = ('.epub', '.cbz', '.jpg', '.jpeg', '.pdf')
+
+_HEADER_BYTES = 4096
+_PDF_TAIL_BYTES = 16 * 1024
+_PDF_KEY = 'CalibreCompressor'
+_PDF_PATTERN = re.compile(rb'/' + _PDF_KEY.encode() + rb'\s*\(([^)]*)\)')
+_EOCD = b'PK\x05\x06'
+_EOCD_SIZE = 22
+
+
+def make_stamp(tool: str, settings: dict) -> bytes:
+    """
+    Returns the stamp for a file written by tool with settings: ASCII, no
+    parentheses or backslashes (so it can go into a PDF string unescaped).
+    """
+    payload = {
+        "tool": tool,
+        "date": datetime.now().strftime("%Y-%m-%d"),
+        "settings": settings,
+    }
+    text = json.dumps(payload, separators=(',', ':'), sort_keys=True, ensure_ascii=True)
+    text = text.replace('(', '[').replace(')', ']').replace('\\', '/')
+    stamp = STAMP_PREFIX + text.encode('ascii')
+    if len(stamp) > STAMP_MAX:
+        raise ValueError("stamp too long")
+    return stamp
+
+
+def parse_stamp(data: bytes):
+    """Returns the stamp payload dict ({tool, date, settings}), or None."""
+    if not data or not data.startswith(STAMP_PREFIX):
+        return None
+    try:
+        payload = json.loads(data[len(STAMP_PREFIX):].decode('ascii'))
+    except ValueError:
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+# ─── Writing ──────────────────────────────────────────────────────────────────
+
+def stamp_jpeg(data: bytes, stamp: bytes) -> bytes:
+    """
+    Returns JPEG data with a COM segment holding stamp, placed after SOI and
+    a JFIF APP0 segment (if any). Existing stamps are not removed; the reader
+    takes the first one, which is this one.
+    """
+    if data[:2] != b'\xff\xd8':
+        return data
+    pos = 2
+    if data[pos:pos + 2] == b'\xff\xe0':
+        pos += 2 + struct.unpack('>H', data[pos + 2:pos + 4])[0]
+    segment = b'\xff\xfe' + struct.pack('>H', len(stamp) + 2) + stamp
+    return data[:pos] + segment + data[pos:]
+
+
+def pdf_stamp_args(stamp: bytes) -> list:
+    """Ghostscript arguments (after the input file) that add stamp to the Info dictionary."""
+    return ['-c', f"[ /{_PDF_KEY} ({stamp.decode('ascii')}) /DOCINFO pdfmark"]
+
+
+# ─── Reading ──────────────────────────────────────────────────────────────────
+
+def _read_head(path, size: int) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read(size)
+
+
+def _read_tail(path, size: int) -> bytes:
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - size))
+        return f.read()
+
+
+def _zip_comment(tail: bytes):
+    """Finds the end-of-central-directory record whose comment runs to the end."""
+    pos = tail.rfind(_EOCD)
+    while pos >= 0:
+        if pos + _EOCD_SIZE <= len(tail):
+            length = struct.unpack('<H', tail[pos + 20:pos + 22])[0]
+            if pos + _EOCD_SIZE + length == len(tail):
+                return tail[pos + _EOCD_SIZE:]
+        pos = tail.rfind(_EOCD, 0, pos)
+    return None
+
+
+def _jpeg_comment(head: bytes):
+    """Returns the first stamp-bearing COM segment before the image data."""
+    if head[:2] != b'\xff\xd8':
+        return None
+    pos = 2
+    while pos + 4 <= len(head) and head[pos] == 0xFF:
+        marker = head[pos + 1]
+        if marker == 0xDA:  # start of scan
+            return None
+        length = struct.unpack('>H', head[pos + 2:pos + 4])[0]
+        if marker == 0xFE:
+            body = head[pos + 4:pos + 2 + length]
+            if body.startswith(STAMP_PREFIX):
+                return body
+        pos += 2 + length
+    return None
+
+
+def read_stamp(file_path):
+    """
+    Returns the stamp payload embedded in file_path, or None. Reads only the
+    header (JPG) or tail (EPUB/CBZ/PDF) of the file; other types have none.
+    """
+    ext = os.path.splitext(str(file_path))[1].lower()
+    try:
+        if ext in ('.epub', '.cbz'):
+            data = _zip_comment(_read_tail(file_path, STAMP_MAX + _EOCD_SIZE))
+        elif ext in ('.jpg', '.jpeg'):
+            data = _jpeg_comment(_read_head(file_path, _HEADER_BYTES))
+        elif ext == '.pdf':
+            match = _PDF_PATTERN.search(_read_tail(file_path, _PDF_TAIL_BYTES))
+            data = match.group(1) if match else None
+        else:
+            return None
+    except OSError:
+        return None
+    return parse_stamp(data)
@@ -0,0 +1,334 @@
+"""
+Watch mode: keeps a library compressed as Calibre adds or changes books.
+
+A Watcher reports new or modified files with the given extensions once they
+have stopped changing. It uses inotify (via the optional inotify_simple
+package) on Linux and falls back to mtime polling elsewhere, or on network
+mounts where inotify doesn't see other hosts' writes (backend='poll').
+When inotify runs out of watches (fs.inotify.max_user_watches) for part of
+the tree, the Watcher reports it and switches to polling.
+
+The compressor main() functions take watch=True to keep running after the
+initial pass. Headless, for all tools at once with the settings from
+config.json:
+
+    python -m core.watcher
+    python -m core.watcher --tools epub cbz --poll
+"""
+import argparse
+import os
+import threading
+import time
+from pathlib import Path
+
+from core import quarantine
+from core.shared import changed_since_processed
+
+# A file must keep the same size and mtime this long before it is processed
+SETTLE_SECONDS = 10.0
+# Seconds between directory walks for the polling backend
+POLL_INTERVAL = 30.0
+
+# Our own side files; never reported
+_IGNORED_SUFFIXES = ('.compressed', '.tmp', '.backup')
+
+
+def _inotify_available() -> bool:
+    try:
+        import inotify_simple  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _stat_key(path: str):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+class _PollingSource:
+    """Walks the tree every interval and reports files whose size/mtime changed."""
+
+    unwatched = 0
+
+    def __init__(self, root: Path, extensions: tuple, interval: float = POLL_INTERVAL):
+        self.root = root
+        self.extensions = extensions
+        self.interval = interval
+        self._snapshot = self._walk()
+        self._next_walk = time.monotonic() + interval
+
+    def _walk(self) -> dict:
+        found = {}
+        stack = [str(self.root)]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            elif entry.name.lower().endswith(self.extensions):
+                                # DirEntry.stat() is free on Windows (no extra round trip)
+                                st = entry.stat()
+                                found[entry.path] = (st.st_size, st.st_mtime_ns)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return found
+
+    def changed(self, timeout: float) -> list:
+        wait = self._next_walk - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(0.0, wait))
+        self._next_walk = time.monotonic() + self.interval
+        old, self._snapshot = self._snapshot, self._walk()
+        return [p for p, key in self._snapshot.items() if old.get(p) != key]
+
+    def close(self):
+        pass
+
+
+class _InotifySource:
+    """
+    Recursive inotify watch; new directories are added as they appear.
+    Directories add_watch() refused (e.g. ENOSPC: out of watches) are counted
+    in unwatched, the last error kept in error; the constructor raises
+    OSError if any directory of the initial tree can't be watched.
+    """
+
+    def __init__(self, root: Path, extensions: tuple):
+        from inotify_simple import INotify, flags
+        self.extensions = extensions
+        self._flags = flags
+        self._mask = (
+            flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.ATTRIB
+        )
+        self._inotify = INotify()
+        self._dirs = {}  # watch descriptor -> directory
+        self._found = []
+        self.unwatched = 0
+        self.error = None
+        self._add_tree(str(root), report=False)
+        if self.unwatched:
+            self.close()
+            raise OSError(f"{self.unwatched} map(pen) niet bewaakt: {self.error}")
+
+    def _add_tree(self, top: str, report: bool):
+        for dirpath, _, filenames in os.walk(top):
+            try:
+                wd = self._inotify.add_watch(dirpath, self._mask)
+            except OSError as e:
+                self.unwatched += 1
+                self.error = e
+            else:
+                self._dirs[wd] = dirpath
+            if report:
+                # Files written before the watch existed
+                self._found.extend(
+                    os.path.join(dirpath, fn) for fn in filenames
+                    if fn.lower().endswith(self.extensions)
+                )
+
+    def changed(self, timeout: float) -> list:
+        for event in self._inotify.read(timeout=int(timeout * 1000)):
+            directory = self._dirs.get(event.wd)
+            if directory is None or not event.name:
+                continue
+            path = os.path.join(directory, event.name)
+            if event.mask & self._flags.ISDIR:
+                if event.mask & (self._flags.CREATE | self._flags.MOVED_TO):
+                    self._add_tree(path, report=True)
+            elif event.name.lower().endswith(self.extensions):
+                self._found.append(path)
+        found, self._found = self._found, []
+        return found
+
+    def close(self):
+        self._inotify.close()
+
+
+class Watcher:
+    """
+    Reports new or modified files under root with one of extensions, once
+    they have kept the same size and mtime for settle_seconds.
+
+    Created before the initial full pass, so files added during that pass
+    are reported afterwards. backend: 'auto' (inotify if available), 'inotify'
+    or 'poll'. If inotify can't watch every directory, the reason goes to
+    log_callback and the Watcher polls instead (backend becomes 'poll').
+    """
+
+    def __init__(
+        self,
+        root,
+        extensions: tuple,
+        settle_seconds: float = SETTLE_SECONDS,
+        poll_interval: float = POLL_INTERVAL,
+        backend: str = 'auto',
+        log_callback=None,
+    ):
+        self.root = Path(root)
+        self.extensions = tuple(e.lower() for e in extensions)
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self._log_callback = log_callback
+        self.backend = 'poll'
+        self._source = None
+        if backend == 'inotify' or (backend == 'auto' and _inotify_available()):
+            try:
+                self._source = _InotifySource(self.root, self.extensions)
+                self.backend = 'inotify'
+            except OSError as e:
+                self._report_fallback(e)
+        if self._source is None:
+            self._source = _PollingSource(self.root, self.extensions, poll_interval)
+        self._pending = {}  # path -> (stat key, time of last change)
+
+    def _report_fallback(self, error):
+        if self._log_callback:
+            self._log_callback(f"inotify onvolledig ({error}); overgeschakeld op polling")
+
+    def _fall_back_to_polling(self):
+        """Replaces an inotify source that lost part of the tree by polling."""
+        self._report_fallback(
+            f"{self._source.unwatched} map(pen) niet bewaakt: {self._source.error}"
+        )
+        self._source.close()
+        self._source = _PollingSource(self.root, self.extensions, self.poll_interval)
+        self.backend = 'poll'
+
+    def batches(self, stop_event: threading.Event = None):
+        """Yields lists of settled files until stop_event is set."""
+        try:
+            while not (stop_event and stop_event.is_set()):
+                now = time.monotonic()
+                for path in self._source.changed(timeout=1.0):
+                    if not path.endswith(_IGNORED_SUFFIXES):
+                        self._pending[path] = (None, now)
+                if self._source.unwatched:
+                    self._fall_back_to_polling()
+
+                now = time.monotonic()
+                ready = []
+                for path, (key, since) in list(self._pending.items()):
+                    current = _stat_key(path)
+                    if current is None:
+                        del self._pending[path]  # removed or renamed away
+                    elif current != key:
+                        self._pending[path] = (current, now)
+                    elif now - since >= self.settle_seconds:
+                        del self._pending[path]
+                        ready.append(Path(path))
+                if ready:
+                    yield sorted(ready)
+        finally:
+            self._source.close()
+
+
+def file_batches(files: list, watcher: Watcher, stop_event=None, log_callback=None, stats=None):
+    """
+    Yields files (the initial pass), then — if watcher is given — every batch
+    of settled new/changed files until stop_event is set. Files that haven't
+    changed since their .compressed marker (our own write-backs) are dropped;
+    whether the rest is re-encoded is still up to should_process_file(),
+    which judges touched files by their embedded stamp. Each watched batch
+    is added to stats["total"].
+
+    Quarantined files (core.quarantine) are left out of every batch and
+    counted in stats["skipped"].
+    """
+    def _without_quarantined(batch):
+        batch, held = quarantine.exclude(batch)
+        if held:
+            if stats is not None:
+                stats["skipped"] += len(held)
+            if log_callback:
+                log_callback(f"In quarantaine, overgeslagen: {len(held)} bestand(en)")
+        return batch
+
+    yield _without_quarantined(files)
+    if watcher is None:
+        return
+    if log_callback:
+        log_callback(f"Map bewaken op nieuwe of gewijzigde bestanden ({watcher.backend})…")
+    for batch in watcher.batches(stop_event):
+        batch = [f for f in batch if changed_since_processed(f)]
+        if not batch:
+            continue
+        if stats is not None:
+            stats["total"] += len(batch)
+        if log_callback:
+            log_callback(f"Nieuw of gewijzigd: {len(batch)} bestand(en)")
+        yield _without_quarantined(batch)
+
+
+# ─── Headless runner ──────────────────────────────────────────────────────────
+
+def _cli(argv=None):
+    from core import jpg_compressor, epub_compressor, pdf_compressor, cbz_compressor
+    from core.config import load_config
+    from core.scheduler import ResourceGovernor
+    from core.metrics import start_exporter
+
+    mains = {
+        'jpg': jpg_compressor.main,
+        'epub': epub_compressor.main,
+        'pdf': pdf_compressor.main,
+        'cbz': cbz_compressor.main,
+    }
+
+    parser = argparse.ArgumentParser(prog='python -m core.watcher')
+    parser.add_argument('--tools', nargs='+', choices=list(mains), default=list(mains))
+    parser.add_argument('--path', help='bibliotheekmap voor alle tools (standaard: paden uit config.json)')
+    parser.add_argument('--poll', action='store_true', help='altijd mtime-polling gebruiken (netwerkschijven)')
+    args = parser.parse_args(argv)
+
+    config = load_config()
+    app = config["app"]
+    governor = ResourceGovernor.from_config(app)
+    exporter = start_exporter(app, governor, log_callback=print)
+    stop_event = threading.Event()
+
+    def _run(tool):
+        settings = dict(config[tool])
+        settings.pop("watch", None)
+        if args.path:
+            settings["path"] = args.path
+        if not settings.get("path"):
+            print(f"[{tool}] geen map ingesteld, overgeslagen")
+            return
+        lease = governor.register(tool)
+        try:
+            mains[tool](
+                **settings, watch=True, watch_backend='poll' if args.poll else 'auto',
+                stop_event=stop_event, log_callback=lambda m: print(f"[{tool}] {m}"),
+                lease=lease,
+            )
+        finally:
+            lease.close()
+
+    threads = [threading.Thread(target=_run, args=(tool,)) for tool in args.tools]
+    for t in threads:
+        t.start()
+    try:
+        while any(t.is_alive() for t in threads):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        print("Stoppen — lopende bestanden afronden…")
+        stop_event.set()
+        for t in threads:
+            t.join()
+    finally:
+        if exporter is not None:
+            exporter.close()
+
+
+if __name__ == '__main__':
+    _cli()
@@ -0,0 +1,520 @@
+"""
+Coordinator/worker mode: a shared work list that several hosts drain together.
+
+The queue lives in a SQLite file (on a shared mount) or behind a small HTTP
+coordinator. Workers claim one file at a time with an expiring lease, process
+it with the existing _process_* functions and report the result back. Leases
+of crashed workers expire and the file is handed out again.
+
+    python -m core.work_queue enqueue --queue /mnt/nas/queue.db --tool cbz --path /mnt/nas/Comics
+    python -m core.work_queue serve   --queue /mnt/nas/queue.db --port 8765
+    python -m core.work_queue work    --queue http://coordinator:8765
+    python -m core.work_queue work    --queue /mnt/nas/queue.db
+    python -m core.work_queue status  --queue /mnt/nas/queue.db
+"""
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from core import quarantine
+from core.encoders import resolve_preset
+from core.runlog import RunLog
+from core.scheduler import run_files
+
+DEFAULT_LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+
+TOOLS = ('jpg', 'epub', 'pdf', 'cbz')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    path        TEXT PRIMARY KEY,
+    tool        TEXT NOT NULL,
+    state       TEXT NOT NULL DEFAULT 'pending',
+    worker      TEXT,
+    lease_until REAL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    status      TEXT,
+    bytes_saved INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS items_state ON items (state, lease_until);
+CREATE TABLE IF NOT EXISTS settings (
+    tool     TEXT PRIMARY KEY,
+    settings TEXT NOT NULL
+);
+"""
+
+
+# ─── Processing ───────────────────────────────────────────────────────────────
+
+def _find_files(tool: str, path) -> list:
+    from core import jpg_compressor, epub_compressor, pdf_compressor, cbz_compressor
+    finders = {
+        'jpg': jpg_compressor.find_files,
+        'epub': epub_compressor.find_files,
+        'pdf': pdf_compressor.find_files,
+        'cbz': cbz_compressor.find_files,
+    }
+    return finders[tool](path)
+
+
+def process_item(
+    tool: str, path: Path, settings: dict, log_callback=None, counters: dict = None
+) -> tuple:
+    """
+    Runs the existing per-file function for tool with the given settings.
+    Returns the (status, bytes_saved) tuple of that function (a Future of it
+    inside core.scheduler.run_files). counters, if given, receives the
+    function's per-file counters (grayscale, cropped, quality_sum, ...).
+    """
+    s = settings
+    force = s.get('force', False)
+    quality_range = (s.get('min_quality', 40), s.get('max_quality', 90))
+    encoder = resolve_preset(s.get('encoder_preset', 'smallest'))
+    if tool == 'jpg':
+        from core.jpg_compressor import _compress_one
+        return _compress_one(
+            path, s['target_width'], s['target_height'], s['quality'], force, log_callback,
+            detect_grayscale=s.get('detect_grayscale', True),
+            counters=counters,
+            target_ssim=s.get('target_ssim'),
+            quality_range=quality_range,
+            encoder=encoder,
+        )
+    if tool == 'epub':
+        from core.epub_compressor import _process_epub
+        return _process_epub(
+            path, s['target_height'], s['quality'], force, log_callback,
+            detect_grayscale=s.get('detect_grayscale', True),
+            counters=counters,
+            crop_margins=s.get('crop_margins', False),
+            target_ssim=s.get('target_ssim'),
+            quality_range=quality_range,
+            encoder=encoder,
+        )
+    if tool == 'pdf':
+        from core.pdf_compressor import _compress_pdf
+        return _compress_pdf(
+            path, s['gs_path'], s['pdf_settings'], force, log_callback, counters,
+        )
+    if tool == 'cbz':
+        from core.cbz_compressor import _process_archive
+        return _process_archive(
+            path, s['target_width'], s['quality'], force, log_callback,
+            output_format=s.get('output_format', 'jpeg'),
+            keep_smaller=s.get('keep_smaller', True),
+            detect_grayscale=s.get('detect_grayscale', True),
+            counters=counters,
+            crop_margins=s.get('crop_margins', False),
+            target_ssim=s.get('target_ssim'),
+            quality_range=quality_range,
+            encoder=encoder,
+            cbr_output=s.get('cbr_output', 'cbr'),
+        )
+    raise ValueError(f"Onbekende tool: {tool}")
+
+
+# ─── SQLite queue ─────────────────────────────────────────────────────────────
+
+class SqliteWorkQueue:
+    """
+    Work list in a SQLite file. Safe for several processes (and hosts, as far
+    as the shared filesystem's locking allows); every claim runs in an
+    IMMEDIATE transaction so two workers never get the same file.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self._lock = threading.Lock()
+        conn = self._connect()
+        try:
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _transaction(self, fn):
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    result = fn(conn)
+                    conn.execute('COMMIT')
+                    return result
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+            finally:
+                conn.close()
+
+    def enqueue(self, tool: str, paths, settings: dict) -> int:
+        """Adds paths for tool (existing entries are left alone). Returns rows added."""
+        def _do(conn):
+            conn.execute(
+                'INSERT OR REPLACE INTO settings (tool, settings) VALUES (?, ?)',
+                (tool, json.dumps(settings)),
+            )
+            before = conn.total_changes
+            conn.executemany(
+                'INSERT OR IGNORE INTO items (path, tool) VALUES (?, ?)',
+                ((str(p), tool) for p in paths),
+            )
+            return conn.total_changes - before
+        return self._transaction(_do)
+
+    def claim(self, worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        """
+        Leases the next pending file (or one whose lease expired) to worker.
+        Returns {"path", "tool", "settings"} or None when nothing is left.
+        """
+        def _do(conn):
+            now = time.time()
+            # Items whose worker crashed too often are given up on
+            conn.execute(
+                "UPDATE items SET state = 'failed', status = 'lease_expired' "
+                "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, MAX_ATTEMPTS),
+            )
+            row = conn.execute(
+                "SELECT path, tool FROM items "
+                "WHERE state = 'pending' OR (state = 'leased' AND lease_until < ?) "
+                "LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE items SET state = 'leased', worker = ?, lease_until = ?, "
+                "attempts = attempts + 1 WHERE path = ?",
+                (worker, now + lease_seconds, row['path']),
+            )
+            settings = conn.execute(
+                'SELECT settings FROM settings WHERE tool = ?', (row['tool'],)
+            ).fetchone()
+            return {
+                "path": row['path'],
+                "tool": row['tool'],
+                "settings": json.loads(settings['settings']) if settings else {},
+            }
+        return self._transaction(_do)
+
+    def renew(self, path: str, worker: str,
+              lease_seconds: float = DEFAULT_LEASE_SECONDS) -> bool:
+        """Extends worker's lease on path. Returns False if the lease was lost."""
+        def _do(conn):
+            cur = conn.execute(
+                "UPDATE items SET lease_until = ? "
+                "WHERE path = ? AND worker = ? AND state = 'leased'",
+                (time.time() + lease_seconds, path, worker),
+            )
+            return cur.rowcount == 1
+        return self._transaction(_do)
+
+    def complete(self, path: str, worker: str, status: str, bytes_saved: int) -> bool:
+        """Records the result of a leased file. Ignored if worker lost the lease."""
+        state = 'failed' if status == 'failed' else 'done'
+
+        def _do(conn):
+            cur = conn.execute(
+                "UPDATE items SET state = ?, status = ?, bytes_saved = ?, lease_until = NULL "
+                "WHERE path = ? AND worker = ? AND state = 'leased'",
+                (state, status, bytes_saved, path, worker),
+            )
+            return cur.rowcount == 1
+        return self._transaction(_do)
+
+    def summary(self) -> dict:
+        """Returns counts per state plus total bytes saved."""
+        conn = self._connect()
+        try:
+            counts = {
+                row['state']: row['n']
+                for row in conn.execute('SELECT state, COUNT(*) AS n FROM items GROUP BY state')
+            }
+            saved = conn.execute('SELECT COALESCE(SUM(bytes_saved), 0) FROM items').fetchone()[0]
+        finally:
+            conn.close()
+        return {
+            "pending": counts.get('pending', 0),
+            "leased": counts.get('leased', 0),
+            "done": counts.get('done', 0),
+            "failed": counts.get('failed', 0),
+            "bytes_saved": saved,
+        }
+
+
+# ─── HTTP coordinator ─────────────────────────────────────────────────────────
+
+def make_server(
+    queue: SqliteWorkQueue, host: str = '0.0.0.0', port: int = 8765, log_callback=None,
+):
+    """
+    Returns a ThreadingHTTPServer exposing queue over JSON POST/GET.
+    Results reported by workers are passed on to log_callback.
+    """
+    def log(msg):
+        if log_callback:
+            log_callback(msg)
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/summary':
+                self._reply(queue.summary())
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            req = json.loads(self.rfile.read(length) or b'{}')
+            if self.path == '/claim':
+                self._reply(queue.claim(
+                    req['worker'], req.get('lease_seconds', DEFAULT_LEASE_SECONDS)
+                ))
+            elif self.path == '/renew':
+                self._reply(queue.renew(
+                    req['path'], req['worker'], req.get('lease_seconds', DEFAULT_LEASE_SECONDS)
+                ))
+            elif self.path == '/complete':
+                accepted = queue.complete(
+                    req['path'], req['worker'], req['status'], req['bytes_saved']
+                )
+                if accepted:
+                    log(f"{req['worker']}: {req['status']} — {req['path']}")
+                else:
+                    log(f"Resultaat genegeerd (lease verlopen): {req['worker']} — {req['path']}")
+                self._reply(accepted)
+            else:
+                self.send_error(404)
+
+        def log_message(self, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+class HttpWorkQueue:
+    """Client for make_server(); same claim/renew/complete/summary interface."""
+
+    def __init__(self, url: str, timeout: float = 60):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _call(self, endpoint: str, payload: dict = None):
+        data = None if payload is None else json.dumps(payload).encode('utf-8')
+        req = urllib.request.Request(
+            self.url + endpoint, data=data, headers={'Content-Type': 'application/json'}
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            return json.loads(resp.read())
+
+    def claim(self, worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        return self._call('/claim', {"worker": worker, "lease_seconds": lease_seconds})
+
+    def renew(self, path: str, worker: str,
+              lease_seconds: float = DEFAULT_LEASE_SECONDS) -> bool:
+        return self._call(
+            '/renew', {"path": path, "worker": worker, "lease_seconds": lease_seconds}
+        )
+
+    def complete(self, path: str, worker: str, status: str, bytes_saved: int) -> bool:
+        return self._call('/complete', {
+            "path": path, "worker": worker, "status": status, "bytes_saved": bytes_saved,
+        })
+
+    def summary(self) -> dict:
+        return self._call('/summary')
+
+
+def open_queue(location: str):
+    """Returns an HttpWorkQueue for http(s) URLs, otherwise a SqliteWorkQueue."""
+    if location.startswith(('http://', 'https://')):
+        return HttpWorkQueue(location)
+    return SqliteWorkQueue(location)
+
+
+# ─── Worker ───────────────────────────────────────────────────────────────────
+
+def run_worker(
+    queue,
+    worker_id: str = None,
+    lease_seconds: float = DEFAULT_LEASE_SECONDS,
+    stop_event: threading.Event = None,
+    log_callback=None,
+    idle_exit: bool = True,
+    poll_interval: float = 5.0,
+) -> dict:
+    """
+    Claims and processes files until the queue is empty (idle_exit) or
+    stop_event is set. The lease is renewed in the background while a file is
+    being processed, so long Ghostscript runs don't lose it.
+
+    Messages and per-file records go through core.runlog, as for the
+    compressor mains. Each file runs through core.scheduler.run_files, under
+    the same per-file time and pixel budgets as a local run; the outcome is
+    recorded in core.quarantine, and quarantined files are reported back as
+    skipped.
+
+    Returns dict: {total, successful, skipped, failed, bytes_saved}
+    """
+    runlog = RunLog('worker', log_callback)
+    log_callback = runlog.message
+
+    def log(msg):
+        if log_callback:
+            log_callback(msg)
+
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    stats = {"total": 0, "successful": 0, "skipped": 0, "failed": 0, "bytes_saved": 0}
+
+    try:
+        log(f"Worker {worker_id} gestart")
+
+        while not (stop_event and stop_event.is_set()):
+            item = queue.claim(worker_id, lease_seconds)
+            if item is None:
+                if idle_exit:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            path = item["path"]
+            done = threading.Event()
+
+            def _heartbeat():
+                while not done.wait(lease_seconds / 3):
+                    if not queue.renew(path, worker_id, lease_seconds):
+                        log(f"Lease verloren: {path}")
+                        return
+
+            if quarantine.exclude([Path(path)])[1]:
+                log(f"In quarantaine, overgeslagen: {path}")
+                queue.complete(path, worker_id, 'skipped', 0)
+                stats["total"] += 1
+                stats["skipped"] += 1
+                continue
+
+            def _one(f):
+                return process_item(item["tool"], f, item["settings"], log_callback, counters)
+
+            counters = {"started": time.monotonic()}
+            hb = threading.Thread(target=_heartbeat, daemon=True)
+            hb.start()
+            try:
+                # run_files sets up the per-file budgets (and read-ahead/write-behind)
+                results = [result for _, result in run_files([Path(path)], _one, stop_event)]
+                status, saved = results[0] if results else ('stopped', 0)
+            except Exception as e:
+                log(f"Fout bij {path}: {e}")
+                status, saved = 'failed', 0
+            finally:
+                done.set()
+                hb.join()
+
+            runlog.file_result(
+                path, status, counters.get("bytes_before"), saved,
+                time.monotonic() - counters["started"],
+            )
+            quarantine.record(Path(path), status, counters.get("over_budget"))
+            queue.complete(path, worker_id, status, saved)
+
+            stats["total"] += 1
+            if status == 'success':
+                stats["successful"] += 1
+                stats["bytes_saved"] += saved
+            elif status in ('skipped', 'no_gain'):
+                stats["skipped"] += 1
+            else:
+                stats["failed"] += 1
+
+        log(
+            f"Worker {worker_id} klaar — Succesvol: {stats['successful']}, "
+            f"Overgeslagen: {stats['skipped']}, "
+            f"Mislukt: {stats['failed']}, "
+            f"Bespaard: {stats['bytes_saved'] / (1024 * 1024):.1f} MB"
+        )
+    finally:
+        runlog.close()
+    return stats
+
+
+# ─── CLI ──────────────────────────────────────────────────────────────────────
+
+def _cli(argv=None):
+    from core.config import load_config
+
+    parser = argparse.ArgumentParser(prog='python -m core.work_queue')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_enq = sub.add_parser('enqueue', help='bestanden van een map in de wachtrij zetten')
+    p_enq.add_argument('--queue', required=True, help='pad naar SQLite bestand')
+    p_enq.add_argument('--tool', required=True, choices=TOOLS)
+    p_enq.add_argument('--path', help='bibliotheekmap (standaard: pad uit config.json)')
+
+    p_srv = sub.add_parser('serve', help='HTTP coordinator starten')
+    p_srv.add_argument('--queue', required=True, help='pad naar SQLite bestand')
+    p_srv.add_argument('--host', default='0.0.0.0')
+    p_srv.add_argument('--port', type=int, default=8765)
+
+    p_wrk = sub.add_parser('work', help='bestanden uit de wachtrij verwerken')
+    p_wrk.add_argument('--queue', required=True, help='SQLite pad of http://host:poort')
+    p_wrk.add_argument('--lease', type=float, default=DEFAULT_LEASE_SECONDS)
+    p_wrk.add_argument('--wait', action='store_true', help='blijf wachten op nieuw werk')
+
+    p_st = sub.add_parser('status', help='voortgang tonen')
+    p_st.add_argument('--queue', required=True, help='SQLite pad of http://host:poort')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'enqueue':
+        runlog = RunLog('enqueue', print)
+        try:
+            settings = dict(load_config()[args.tool])
+            path = args.path or settings.pop('path', '')
+            settings.pop('path', None)
+            files = _find_files(args.tool, path)
+            added = SqliteWorkQueue(args.queue).enqueue(args.tool, files, settings)
+            runlog.message(f"{added} van {len(files)} bestanden toegevoegd")
+        finally:
+            runlog.close()
+    elif args.command == 'serve':
+        runlog = RunLog('coordinator', print)
+        server = make_server(SqliteWorkQueue(args.queue), args.host, args.port, runlog.message)
+        runlog.message(f"Coordinator luistert op {args.host}:{args.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            runlog.close()
+    elif args.command == 'work':
+        run_worker(
+            open_queue(args.queue), lease_seconds=args.lease,
+            log_callback=print, idle_exit=not args.wait,
+        )
+    elif args.command == 'status':
+        print(json.dumps(open_queue(args.queue).summary(), indent=2))
+
+
+if __name__ == '__main__':
+    _cli()
@@ -0,0 +1,29 @@
+import sys
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core import quarantine, runlog  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    """Keeps the quarantine list and run logs out of the real compress_mijn_boeken/."""
+    state = tmp_path / "state"
+    monkeypatch.setattr(quarantine, "QUARANTINE_DIR", state)
+    monkeypatch.setattr(quarantine, "_entries", {})
+    monkeypatch.setattr(quarantine, "_loaded_mtime", None)
+    monkeypatch.setattr(runlog, "LOG_DIR", state)
+    return state
+
+
+def image_bytes(size=(400, 600), fmt="JPEG", mode="RGB", **kwargs) -> bytes:
+    """A noisy test image, so re-encoding at a lower quality always saves bytes."""
+    img = Image.effect_noise(size, 60).convert(mode)
+    buf = BytesIO()
+    img.save(buf, fmt, **kwargs)
+    return buf.getvalue()
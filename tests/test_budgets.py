@@ -0,0 +1,80 @@
+"""Over-budget files fail, stay unmarked and are quarantined — for every format."""
+import sys
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from conftest import image_bytes
+from core import scheduler, quarantine
+from core import cbz_compressor, epub_compressor, jpg_compressor, pdf_compressor
+from test_epub_compressor import make_epub
+
+# Larger than the 1-megapixel budget the tests set
+BIG = (1500, 1000)
+
+
+@pytest.fixture
+def pixel_budget(monkeypatch):
+    monkeypatch.setattr(scheduler, "MAX_MEGAPIXELS", 1)
+
+
+def assert_quarantined(path: Path, stats: dict):
+    assert stats["failed"] == 1
+    assert stats["successful"] == 0
+    assert not Path(str(path) + ".compressed").exists()
+    held = dict(quarantine.entries())
+    assert held[str(path)]["quarantined"]
+    assert quarantine.exclude([path]) == ([], [path])
+
+
+def test_cbz_page_over_pixel_budget(tmp_path, pixel_budget):
+    comic = tmp_path / "c.cbz"
+    with zipfile.ZipFile(comic, "w") as zf:
+        zf.writestr("001.jpg", image_bytes(BIG, quality=95))
+    original = comic.read_bytes()
+
+    stats = cbz_compressor.main(tmp_path, target_width=800)
+
+    assert_quarantined(comic, stats)
+    assert comic.read_bytes() == original
+
+
+def test_epub_image_over_pixel_budget(tmp_path, pixel_budget):
+    book = tmp_path / "b.epub"
+    make_epub(book, {"big.jpg": "image/jpeg"},
+              files={"OEBPS/big.jpg": image_bytes(BIG, quality=95)})
+    original = book.read_bytes()
+
+    stats = epub_compressor.main(tmp_path, target_height=450)
+
+    assert_quarantined(book, stats)
+    assert book.read_bytes() == original
+
+
+def test_jpg_over_pixel_budget(tmp_path, pixel_budget):
+    cover = tmp_path / "cover.jpg"
+    cover.write_bytes(image_bytes(BIG, quality=95))
+    original = cover.read_bytes()
+
+    stats = jpg_compressor.main(tmp_path)
+
+    assert_quarantined(cover, stats)
+    assert cover.read_bytes() == original
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="fake Ghostscript is a shell script")
+def test_pdf_over_time_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduler, "FILE_TIMEOUT", 0.5)
+    gs = tmp_path / "gs.sh"
+    gs.write_text("#!/bin/sh\nsleep 30\n")
+    gs.chmod(0o755)
+    books = tmp_path / "books"
+    books.mkdir()
+    pdf = books / "a.pdf"
+    pdf.write_bytes(b"%PDF-1.4\n%%EOF\n")
+
+    stats = pdf_compressor.main(books, gs_path=str(gs))
+
+    assert_quarantined(pdf, stats)
+    assert pdf.read_bytes() == b"%PDF-1.4\n%%EOF\n"
@@ -0,0 +1,47 @@
+import sys
+import types
+import zipfile
+
+import pytest
+
+from conftest import image_bytes
+from core import cbz_compressor
+
+
+@pytest.fixture
+def fake_rarfile(monkeypatch):
+    # A ZIP stands in for the RAR: the conversion only uses infolist()/read()
+    monkeypatch.setitem(sys.modules, "rarfile", types.SimpleNamespace(RarFile=zipfile.ZipFile))
+
+
+def test_cbr_is_converted_without_gain(tmp_path, fake_rarfile):
+    page = image_bytes((200, 300), quality=20)
+    comic = tmp_path / "c.cbr"
+    with zipfile.ZipFile(comic, "w") as zf:
+        zf.writestr("001.jpg", page)
+        zf.writestr("ComicInfo.xml", "<ComicInfo/>")
+    # Left over from an earlier run that kept the original
+    (tmp_path / "c.cbr.compressed").write_text("2024-01-01 00:00:00")
+
+    status, saved = cbz_compressor._convert_cbr(comic, 1200, 70, None)
+
+    assert status == "success"
+    assert not comic.exists()
+    assert not (tmp_path / "c.cbr.compressed").exists()
+    with zipfile.ZipFile(tmp_path / "c.cbz") as zf:
+        assert zf.read("001.jpg") == page
+        assert zf.read("ComicInfo.xml") == b"<ComicInfo/>"
+    assert (tmp_path / "c.cbz.compressed").exists()
+
+
+def test_cbr_kept_alongside_saves_nothing(tmp_path, fake_rarfile):
+    comic = tmp_path / "c.cbr"
+    with zipfile.ZipFile(comic, "w") as zf:
+        zf.writestr("001.jpg", image_bytes((400, 600), quality=95))
+
+    status, saved = cbz_compressor._convert_cbr(comic, 200, 50, None, keep_original=True)
+
+    assert (status, saved) == ("success", 0)
+    assert comic.exists() and (tmp_path / "c.cbz").exists()
+    assert (tmp_path / "c.cbr.compressed").exists()
+    assert (tmp_path / "c.cbz.compressed").exists()
@@ -0,0 +1,69 @@
+import zipfile
+
+from conftest import image_bytes
+from core import epub_compressor
+
+CONTAINER = (
+    '<?xml version="1.0"?><container version="1.0" '
+    'xmlns="urn:oasis:names:tc:opendocument:xmlns:container"><rootfiles>'
+    '<rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>'
+    '</rootfiles></container>'
+)
+
+
+def make_epub(path, items: dict, xhtml: str = '<html/>', files: dict = None):
+    """
+    Writes an EPUB whose manifest lists items {href: media type}, holding
+    files {archive path: data} (by default a PNG at OEBPS/cover.png).
+    """
+    if files is None:
+        files = {'OEBPS/cover.png': image_bytes(fmt='PNG')}
+    manifest = ''.join(
+        f'<item id="i{n}" href="{href}" media-type="{media_type}"/>'
+        for n, (href, media_type) in enumerate(items.items())
+    )
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr('mimetype', 'application/epub+zip')
+        zf.writestr('META-INF/container.xml', CONTAINER)
+        zf.writestr(
+            'OEBPS/content.opf',
+            '<package xmlns="http://www.idpf.org/2007/opf"><manifest>'
+            f'{manifest}<item id="t" href="t.xhtml" media-type="application/xhtml+xml"/>'
+            '</manifest></package>',
+        )
+        zf.writestr('OEBPS/t.xhtml', xhtml)
+        for name, data in files.items():
+            zf.writestr(name, data)
+
+
+def test_hrefs_outside_the_book_are_ignored(tmp_path):
+    victim_dir = tmp_path / 'victim'
+    victim_dir.mkdir()
+    secret = victim_dir / 'secret.png'
+    secret.write_bytes(image_bytes(fmt='PNG'))
+    original = secret.read_bytes()
+
+    book = tmp_path / 'books' / 'b.epub'
+    book.parent.mkdir()
+    make_epub(book, {
+        str(secret): 'image/png',
+        '../../../../../../../../..' + str(secret): 'image/png',
+        'cover.png': 'image/png',
+    }, xhtml=f'<img src="{secret}"/><img src="cover.png"/>')
+
+    status, _ = epub_compressor._process_epub(book, 800, 60, True, None)
+
+    assert status == 'success'
+    assert secret.read_bytes() == original
+    assert sorted(p.name for p in victim_dir.iterdir()) == ['secret.png']
+    with zipfile.ZipFile(book) as zf:
+        assert 'OEBPS/cover.jpg' in zf.namelist()
+        assert str(secret) in zf.read('OEBPS/t.xhtml').decode()
+
+
+def test_archive_path_containment(tmp_path):
+    (tmp_path / 'OEBPS').mkdir()
+    assert epub_compressor._archive_path(tmp_path, 'OEBPS/../OEBPS/a.png') == 'OEBPS/a.png'
+    assert epub_compressor._archive_path(tmp_path, '/etc/passwd') is None
+    assert epub_compressor._archive_path(tmp_path, 'OEBPS/../../x.png') is None
+    assert epub_compressor._archive_path(tmp_path, '.') is None
@@ -0,0 +1,43 @@
+import pytest
+from PIL import Image, ImageDraw
+
+from core.imaging import is_grayscale, find_content_bbox, auto_crop
+
+
+@pytest.fixture
+def no_copies(monkeypatch):
+    """Fails the test if a full-size copy of the page is made."""
+    original = Image.Image.copy
+
+    def copy(self):
+        assert max(self.size) <= 256, "full-size copy"
+        return original(self)
+    monkeypatch.setattr(Image.Image, "copy", copy)
+
+
+def page(mode="RGB", colour=(0, 0, 0)):
+    """A 2000x3000 white page with a content block inset 300 px on every side."""
+    img = Image.new("RGB", (2000, 3000), "white")
+    ImageDraw.Draw(img).rectangle((300, 300, 1699, 2699), fill=colour)
+    return img if mode == "RGB" else img.convert(mode)
+
+
+def test_is_grayscale(no_copies):
+    assert is_grayscale(page())
+    assert not is_grayscale(page(colour=(200, 30, 30)))
+    assert not is_grayscale(page("P", colour=(30, 30, 200)))
+    assert is_grayscale(page("L"))
+
+
+def test_find_content_bbox(no_copies):
+    for mode in ("RGB", "L", "RGBA", "P", "CMYK"):
+        left, top, right, bottom = find_content_bbox(page(mode))
+        assert 280 <= left <= 300 and 280 <= top <= 300
+        assert 1700 <= right <= 1720 and 2700 <= bottom <= 2720
+
+
+def test_auto_crop_leaves_full_bleed_pages():
+    img = Image.new("RGB", (800, 1200), (40, 90, 160))
+    ImageDraw.Draw(img).ellipse((0, 0, 799, 1199), fill="black")
+    cropped, done = auto_crop(img)
+    assert not done and cropped is img
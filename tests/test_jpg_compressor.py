@@ -0,0 +1,57 @@
+from pathlib import Path
+
+from conftest import image_bytes
+from core import jpg_compressor, shared
+
+
+def test_kept_cover_is_counted(tmp_path):
+    (tmp_path / "cover.jpg").write_bytes(image_bytes(quality=95))
+
+    stats = jpg_compressor.main(tmp_path, quality=60)
+
+    assert stats["successful"] == 1
+    assert stats["grayscale"] == 1
+    assert stats["avg_quality"] == 60
+
+
+def test_discarded_output_is_not_counted(tmp_path):
+    # Already smaller than anything quality 70 (plus a stamp) can produce
+    (tmp_path / "cover.jpg").write_bytes(image_bytes((180, 270), quality=5))
+
+    stats = jpg_compressor.main(tmp_path)
+
+    assert stats["successful"] == 0 and stats["skipped"] == 1
+    assert stats["grayscale"] == 0
+    assert stats["avg_quality"] == 0
+
+
+def test_skip_check_is_made_once(tmp_path, monkeypatch):
+    for name in ("a.jpg", "b.jpg"):
+        (tmp_path / name).write_bytes(image_bytes(quality=95))
+    settings = jpg_compressor.fingerprint(180, 270, 70)
+    jpg_compressor.mark_as_processed(tmp_path / "b.jpg", "jpg", settings)
+    checked = []
+    check = shared.should_process_file
+
+    def counting_check(path, settings=None):
+        checked.append(path)
+        return check(path, settings)
+
+    monkeypatch.setattr(shared, "should_process_file", counting_check)
+    monkeypatch.setattr(jpg_compressor, "should_process_file", counting_check)
+    stats = jpg_compressor.main(tmp_path)
+
+    assert stats["successful"] == 1 and stats["skipped"] == 1
+    assert sorted(p.name for p in checked) == ["a.jpg", "b.jpg"]
+
+
+def test_small_cover_markers_are_written_by_the_end(tmp_path):
+    covers = [tmp_path / f"{n}.jpg" for n in range(5)]
+    for cover in covers:
+        cover.write_bytes(image_bytes(quality=95))
+
+    stats = jpg_compressor.main(tmp_path)
+
+    assert stats["successful"] == 5
+    assert all(Path(f"{cover}.compressed").exists() for cover in covers)
+    assert not list(tmp_path.glob("*.tmp"))
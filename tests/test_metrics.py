@@ -0,0 +1,35 @@
+import socket
+import zipfile
+
+import pytest
+
+from conftest import image_bytes
+from core import cbz_compressor, metrics, runlog
+
+
+def test_failed_run_is_untracked_and_closed(tmp_path, monkeypatch):
+    with zipfile.ZipFile(tmp_path / "c.cbz", "w") as zf:
+        zf.writestr("001.jpg", image_bytes())
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("disk gone")
+
+    monkeypatch.setattr(cbz_compressor, "_process_archive", broken)
+    with pytest.raises(RuntimeError):
+        cbz_compressor.main(tmp_path, log_callback=lambda msg: None)
+
+    assert metrics._runs == {}
+    assert runlog._callbacks == {}
+
+
+def test_exporter_bind_failure_is_logged(capsys):
+    with socket.socket() as busy:
+        busy.bind(("127.0.0.1", 0))
+        busy.listen()
+        port = busy.getsockname()[1]
+        messages = []
+        exporter = metrics.start_exporter({"metrics_port": port}, log_callback=messages.append)
+
+    assert exporter is None
+    assert len(messages) == 1 and str(port) in messages[0]
+    assert capsys.readouterr().out == ""
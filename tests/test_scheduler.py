@@ -0,0 +1,301 @@
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import pytest
+
+from core import scheduler
+from core.config import DEFAULT_CONFIG
+from core.scheduler import (
+    ResourceGovernor, MemoryBudget, Prefetcher, WriteBehind, UNWANTED,
+    BudgetExceeded, StopRequested, run_files, read_source, write_behind, then,
+    check_stop, check_pixels, defer_write, wanted_decision,
+)
+
+
+def test_governor_from_config():
+    app = {**DEFAULT_CONFIG["app"], "cpu_workers": 3, "adaptive_workers": False,
+           "file_timeout": 12, "max_megapixels": 40, "prefetch_depth": 0}
+    governor = ResourceGovernor.from_config(app)
+    assert governor.cpu_budget == 3
+    assert governor.adaptive is False
+    assert governor.file_timeout == 12
+    assert governor.max_megapixels == 40
+    assert governor.prefetch_depth == 0
+
+
+def test_governor_from_partial_config():
+    governor = ResourceGovernor.from_config({})
+    assert governor.io_budget == 4
+    assert governor.file_timeout > 0
+
+
+@pytest.mark.parametrize("prefetch_depth", [2, 0])
+def test_wanted_is_asked_once_and_passed_to_the_worker(tmp_path, monkeypatch, prefetch_depth):
+    monkeypatch.setattr(scheduler, "PREFETCH_DEPTH", prefetch_depth)
+    files = [tmp_path / name for name in ("a", "b", "c")]
+    for f in files:
+        f.write_bytes(b"x")
+    asked = []
+
+    def wanted(f):
+        asked.append(f)
+        return f.name != "b"
+
+    results = dict(run_files(files, wanted_decision, wanted=wanted, spool=False))
+
+    assert asked == files
+    assert results == {files[0]: True, files[1]: False, files[2]: True}
+
+
+def test_deferred_writes_are_flushed_together(monkeypatch):
+    log = []
+
+    @contextmanager
+    def io_slot():
+        log.append("slot")
+        yield
+
+    monkeypatch.setattr(scheduler, "io_slot", io_slot)
+    release = threading.Event()
+
+    def commit(n):
+        if n == 0:
+            release.wait(5)
+        log.append(f"commit {n}")
+        defer_write(lambda: log.append(f"marker {n}"))
+
+    writer = WriteBehind(depth=4)
+    futures = [writer.submit(lambda n=n: commit(n)) for n in range(4)]
+    release.set()
+    for fut in futures:
+        fut.result(5)
+    writer.close()
+
+    # Commits 1-3 were queued behind commit 0: one flush once the queue ran empty
+    assert log == [f"commit {n}" for n in range(4)] + ["slot"] + [f"marker {n}" for n in range(4)]
+
+
+def test_deferred_write_outside_a_writer_runs_at_once():
+    log = []
+    defer_write(lambda: log.append("marker"))
+    assert log == ["marker"]
+
+
+def make_files(tmp_path, names="abcde"):
+    files = []
+    for name in names:
+        f = tmp_path / name
+        f.write_bytes(name.encode() * 10)
+        files.append(f)
+    return files
+
+
+# ─── run_files ────────────────────────────────────────────────────────────────
+
+def test_run_files_in_order_from_read_ahead_copies(tmp_path):
+    files = make_files(tmp_path)
+    results = list(run_files(files, read_source, spool=False))
+    assert results == [(f, f.read_bytes()) for f in files]
+
+
+def test_run_files_with_lease_runs_files_in_parallel(tmp_path):
+    lease = ResourceGovernor(cpu_workers=3, prefetch_depth=0).register("cbz")
+    together = threading.Barrier(3, timeout=5)
+
+    def worker(f):
+        together.wait()  # only passes if three files are in flight at once
+        return f.name
+
+    try:
+        results = dict(run_files(make_files(tmp_path, "abc"), worker, lease=lease))
+    finally:
+        lease.close()
+    assert sorted(results.values()) == ["a", "b", "c"]
+
+
+def test_stop_event_stops_new_files(tmp_path):
+    files = make_files(tmp_path)
+    stop_event = threading.Event()
+
+    def worker(f):
+        if f.name == "b":
+            stop_event.set()
+        return f.name
+
+    assert [r for _, r in run_files(files, worker, stop_event)] == ["a", "b"]
+
+
+def test_check_stop_inside_a_file(tmp_path):
+    stop_event = threading.Event()
+
+    def worker(f):
+        check_stop()  # not stopped yet
+        stop_event.set()
+        try:
+            check_stop()
+        except StopRequested:
+            return "stopped"
+        return "finished"
+
+    assert [r for _, r in run_files(make_files(tmp_path, "a"), worker, stop_event)] == ["stopped"]
+    check_stop()  # outside run_files there is nothing to stop
+
+
+def test_time_and_pixel_budgets(tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduler, "FILE_TIMEOUT", 0.05)
+    monkeypatch.setattr(scheduler, "MAX_MEGAPIXELS", 1)
+
+    def worker(f):
+        if f.name == "a":
+            time.sleep(0.1)
+            check_stop()
+        else:
+            check_pixels((1001, 1000))
+
+    for f in make_files(tmp_path, "ab"):
+        with pytest.raises(BudgetExceeded):
+            list(run_files([f], worker))
+    check_pixels((1001, 1000))  # no budget outside run_files
+
+
+# ─── Prefetcher ───────────────────────────────────────────────────────────────
+
+def test_prefetcher_copies(tmp_path):
+    a, b, c = make_files(tmp_path, "abc")
+    missing = tmp_path / "missing"
+    prefetcher = Prefetcher(
+        [a, b, c, missing], depth=4, wanted=lambda f: f != c, spool=lambda f: f == b,
+    )
+    try:
+        assert prefetcher.take(a) == a.read_bytes()
+        spooled = prefetcher.take(b)
+        assert isinstance(spooled, str) and Path(spooled).read_bytes() == b.read_bytes()
+        assert prefetcher.take(c) is UNWANTED
+        assert prefetcher.take(missing) is None
+    finally:
+        prefetcher.close()
+    os.unlink(spooled)
+
+
+def test_prefetcher_stays_depth_ahead(tmp_path, monkeypatch):
+    spool_dir = tmp_path / "spool"
+    spool_dir.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(spool_dir))
+    files = make_files(tmp_path, "abcd")
+    asked = []
+
+    def wanted(f):
+        asked.append(f.name)
+        return True
+
+    prefetcher = Prefetcher(files, depth=2, wanted=wanted, spool=True)
+    try:
+        time.sleep(0.2)
+        assert asked == ["a", "b"]
+        local = prefetcher.take(files[0])
+        time.sleep(0.2)
+        assert asked == ["a", "b", "c"]
+    finally:
+        prefetcher.close()
+    # close() removed the copies nobody took
+    assert os.listdir(spool_dir) == [os.path.basename(local)]
+
+
+# ─── WriteBehind ──────────────────────────────────────────────────────────────
+
+def test_write_behind_commits_in_order():
+    order = []
+
+    def commit(n):
+        time.sleep(0.01 * (5 - n))  # earlier commits are slower
+        order.append(n)
+        return n
+
+    writer = WriteBehind(depth=2)
+    futures = [writer.submit(lambda n=n: commit(n)) for n in range(5)]
+    writer.close()  # flushes everything still queued
+    assert order == [0, 1, 2, 3, 4]
+    assert [fut.result() for fut in futures] == [0, 1, 2, 3, 4]
+
+
+def test_write_behind_errors_reach_run_files(tmp_path):
+    def commit():
+        raise OSError("disk full")
+
+    def worker(f):
+        return write_behind(commit)
+
+    with pytest.raises(OSError, match="disk full"):
+        list(run_files(make_files(tmp_path, "a"), worker))
+
+
+def test_commits_run_after_their_worker_and_before_the_file_is_yielded(tmp_path):
+    files = make_files(tmp_path, "abc")
+    events = []
+
+    def worker(f):
+        events.append(f"work {f.name}")
+        return then(write_behind(lambda: events.append(f"commit {f.name}") or f.name),
+                    lambda name: name.upper())
+
+    results = [r for _, r in run_files(files, worker)]
+
+    assert results == ["A", "B", "C"]
+    for name in "abc":
+        assert events.index(f"work {name}") < events.index(f"commit {name}")
+
+
+# ─── Leases ───────────────────────────────────────────────────────────────────
+
+def test_cpu_budget_is_shared_fairly():
+    governor = ResourceGovernor(cpu_workers=4)
+    a = governor.register("a")
+    assert a.cpu_share() == 4
+    b = governor.register("b")
+    c = governor.register("c")
+    assert [a.cpu_share(), b.cpu_share(), c.cpu_share()] == [2, 1, 1]
+    b.close()
+    c.close()
+    assert a.cpu_share() == 4
+
+
+def test_released_share_goes_to_waiting_tool():
+    governor = ResourceGovernor(cpu_workers=2)
+    a = governor.register("a")
+    b = governor.register("b")
+    second_slot = threading.Event()
+
+    def take_two():
+        with a.cpu(), a.cpu():
+            second_slot.set()
+
+    with a.cpu():
+        thread = threading.Thread(target=take_two, daemon=True)
+        thread.start()
+        # a's share is 1 of 2 while b runs: the second slot waits
+        assert not second_slot.wait(0.3)
+    b.close()
+    assert second_slot.wait(5)
+    thread.join(5)
+    assert governor.snapshot()["combined"]["cpu_in_use"] == 0
+    a.close()
+
+
+def test_memory_budget_admits_oversized_item_alone():
+    budget = MemoryBudget(100)
+    with budget.reserve(1000):
+        assert budget.in_use == 100
+    with budget.reserve(60):
+        admitted = threading.Event()
+
+        def second():
+            with budget.reserve(60):
+                admitted.set()
+
+        threading.Thread(target=second, daemon=True).start()
+        assert not admitted.wait(0.3)
+    assert admitted.wait(5)
@@ -0,0 +1,139 @@
+import os
+import time
+import zipfile
+from contextlib import contextmanager
+
+from conftest import image_bytes
+from core import jpg_compressor, scheduler, shared
+from core.shared import (
+    should_process_file, mark_as_processed, more_aggressive, estimate_archive_bytes,
+)
+from core.stamp import make_stamp, stamp_jpeg
+
+SETTINGS = {"target_width": 180, "target_height": 270, "quality": 70, "target_ssim": None}
+
+
+def touch_later(path):
+    later = time.time() + 60
+    os.utime(path, (later, later))
+
+
+def test_unprocessed_file_is_processed(tmp_path):
+    cover = tmp_path / "cover.jpg"
+    cover.write_bytes(image_bytes())
+    assert should_process_file(cover, SETTINGS)
+
+
+def test_marker_with_same_settings_skips(tmp_path):
+    cover = tmp_path / "cover.jpg"
+    cover.write_bytes(image_bytes())
+    mark_as_processed(cover, "jpg", SETTINGS)
+    assert not should_process_file(cover, SETTINGS)
+    assert should_process_file(cover, {**SETTINGS, "quality": 60})
+
+
+def test_touched_stamped_file_is_not_reencoded(tmp_path):
+    cover = tmp_path / "cover.jpg"
+    cover.write_bytes(stamp_jpeg(image_bytes(), make_stamp("jpg", SETTINGS)))
+    mark_as_processed(cover, "jpg", SETTINGS)
+    touch_later(cover)
+    assert not should_process_file(cover, SETTINGS)
+    assert should_process_file(cover, {**SETTINGS, "quality": 60})
+
+
+def test_replaced_file_without_stamp_is_processed(tmp_path):
+    cover = tmp_path / "cover.jpg"
+    cover.write_bytes(image_bytes())
+    mark_as_processed(cover, "jpg", SETTINGS)
+    touch_later(cover)
+    assert should_process_file(cover, SETTINGS)
+
+
+def test_touched_cbr_keeps_its_marker(tmp_path):
+    comic = tmp_path / "c.cbr"
+    comic.write_bytes(b"Rar!")
+    settings = {"target_width": 1200, "quality": 70, "output_format": "jpeg", "target_ssim": None}
+    mark_as_processed(comic, "cbz", settings)
+    touch_later(comic)
+    assert not should_process_file(comic, settings)
+
+
+def test_watched_touch_does_not_reencode(tmp_path, monkeypatch):
+    cover = tmp_path / "cover.jpg"
+    cover.write_bytes(image_bytes(quality=95))
+
+    class TouchingWatcher:
+        """Reports cover.jpg once, after touching it (as Calibre would)."""
+        backend = "test"
+
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def batches(self, stop_event=None):
+            touch_later(cover)
+            yield [cover]
+
+    encodes = []
+    encode = jpg_compressor.encode_jpeg_auto
+
+    def counting_encode(*args, **kwargs):
+        encodes.append(args)
+        return encode(*args, **kwargs)
+
+    monkeypatch.setattr(jpg_compressor, "Watcher", TouchingWatcher)
+    monkeypatch.setattr(jpg_compressor, "encode_jpeg_auto", counting_encode)
+    stats = jpg_compressor.main(tmp_path, watch=True)
+
+    assert stats["total"] == 2
+    assert stats["successful"] == 1
+    assert len(encodes) == 1
+
+
+def test_more_aggressive_requires_lower_quality():
+    assert more_aggressive(SETTINGS, {**SETTINGS, "quality": 60})
+    assert more_aggressive(SETTINGS, {**SETTINGS, "quality": 60, "target_width": 150})
+    assert not more_aggressive(SETTINGS, SETTINGS)
+    assert not more_aggressive(SETTINGS, {**SETTINGS, "target_width": 150, "target_height": 200})
+    assert not more_aggressive(SETTINGS, {**SETTINGS, "quality": 60, "target_width": 200})
+    assert not more_aggressive(SETTINGS, {**SETTINGS, "quality": 80})
+
+
+def test_more_aggressive_ssim_and_pdf():
+    ssim = {**SETTINGS, "target_ssim": 0.97}
+    assert more_aggressive(ssim, {**ssim, "target_ssim": 0.95})
+    assert not more_aggressive(ssim, {**ssim, "target_ssim": 0.99})
+    assert not more_aggressive(SETTINGS, {**ssim, "quality": 60})
+    assert more_aggressive({"pdf_settings": "/ebook"}, {"pdf_settings": "/screen"})
+    assert not more_aggressive({"pdf_settings": "/ebook"}, {"pdf_settings": "/ebook"})
+    assert not more_aggressive({}, SETTINGS)
+
+
+def test_archive_estimate_takes_an_io_slot(tmp_path, monkeypatch):
+    comic = tmp_path / "c.cbz"
+    with zipfile.ZipFile(comic, "w") as zf:
+        zf.writestr("001.jpg", b"x" * 1000)
+    slots = []
+
+    @contextmanager
+    def io_slot():
+        slots.append(True)
+        yield
+
+    monkeypatch.setattr(scheduler, "io_slot", io_slot)
+    assert estimate_archive_bytes(comic) == 1000
+    assert slots
+
+
+def test_stamp_is_read_once(tmp_path, monkeypatch):
+    cover = tmp_path / "cover.jpg"
+    cover.write_bytes(stamp_jpeg(image_bytes(), make_stamp("jpg", SETTINGS)))
+    reads = []
+    read = shared.read_stamp
+
+    def counting_read(path):
+        reads.append(path)
+        return read(path)
+
+    monkeypatch.setattr(shared, "read_stamp", counting_read)
+    assert not should_process_file(cover, SETTINGS)
+    assert len(reads) == 1
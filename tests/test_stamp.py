@@ -0,0 +1,62 @@
+import zipfile
+
+import pytest
+from PIL import Image
+
+from conftest import image_bytes
+from core.stamp import (
+    make_stamp, parse_stamp, read_stamp, stamp_jpeg, pdf_stamp_args, STAMP_MAX,
+)
+
+SETTINGS = {"target_width": 1200, "quality": 70, "target_ssim": None}
+
+
+def test_make_and_parse():
+    payload = parse_stamp(make_stamp("cbz", SETTINGS))
+    assert payload["tool"] == "cbz"
+    assert payload["settings"] == SETTINGS
+    assert parse_stamp(b"something else") is None
+
+
+def test_stamp_is_pdf_safe():
+    stamp = make_stamp("pdf", {"pdf_settings": "/ebook (x)\\"})
+    assert not set(b"()\\") & set(stamp)
+    with pytest.raises(ValueError):
+        make_stamp("pdf", {"x": "y" * STAMP_MAX})
+
+
+def test_jpeg_round_trip(tmp_path):
+    cover = tmp_path / "cover.jpg"
+    cover.write_bytes(stamp_jpeg(image_bytes(), make_stamp("jpg", SETTINGS)))
+    assert read_stamp(cover)["settings"] == SETTINGS
+    with Image.open(cover) as img:
+        img.load()
+
+
+def test_zip_comment_round_trip(tmp_path):
+    comic = tmp_path / "c.cbz"
+    with zipfile.ZipFile(comic, "w") as zf:
+        zf.comment = make_stamp("cbz", SETTINGS)
+        zf.writestr("001.jpg", image_bytes())
+    assert read_stamp(comic)["tool"] == "cbz"
+    with zipfile.ZipFile(comic) as zf:
+        assert zf.testzip() is None
+
+
+def test_pdf_info_round_trip(tmp_path):
+    # What Ghostscript writes for the pdfmark from pdf_stamp_args()
+    pdfmark = pdf_stamp_args(make_stamp("pdf", {"pdf_settings": "/ebook"}))[1]
+    info = pdfmark[pdfmark.index("/"):pdfmark.index(" /DOCINFO")]
+    pdf = tmp_path / "a.pdf"
+    pdf.write_bytes(b"%PDF-1.4\n1 0 obj\n<< " + info.encode() + b" >>\nendobj\n%%EOF\n")
+    assert read_stamp(pdf)["settings"] == {"pdf_settings": "/ebook"}
+
+
+def test_unstamped_files(tmp_path):
+    cover = tmp_path / "cover.jpg"
+    cover.write_bytes(image_bytes())
+    comic = tmp_path / "c.cbr"
+    comic.write_bytes(b"Rar!")
+    assert read_stamp(cover) is None
+    assert read_stamp(comic) is None
+    assert read_stamp(tmp_path / "missing.epub") is None
@@ -0,0 +1,8 @@
+import pytest
+
+from core.benchmark import measure_startup
+
+
+def test_launch_defers_compressor_imports():
+    pytest.importorskip("customtkinter")
+    assert measure_startup(repeat=1)["deferred"] == []
@@ -0,0 +1,117 @@
+import errno
+import os
+import sys
+import types
+from collections import namedtuple
+from pathlib import Path
+
+import pytest
+
+from core import watcher
+from core.watcher import Watcher, _PollingSource
+
+Event = namedtuple("Event", "wd mask cookie name")
+FLAGS = types.SimpleNamespace(CLOSE_WRITE=8, MOVED_TO=128, CREATE=256, ATTRIB=4, ISDIR=0x40000000)
+
+
+def bump(path, seconds):
+    """Moves path's mtime forward, as a later write would."""
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + int(seconds * 1e9)))
+
+
+def test_polling_reports_new_and_changed_files(tmp_path):
+    old = tmp_path / "old.epub"
+    old.write_bytes(b"1")
+    source = _PollingSource(tmp_path, (".epub",), interval=0)
+
+    assert source.changed(timeout=1.0) == []
+
+    (tmp_path / "sub").mkdir()
+    new = tmp_path / "sub" / "new.epub"
+    new.write_bytes(b"1")
+    (tmp_path / "notes.txt").write_text("ignored")
+    assert source.changed(timeout=1.0) == [str(new)]
+
+    bump(old, 5)
+    assert source.changed(timeout=1.0) == [str(old)]
+
+
+def test_polling_waits_for_its_interval(tmp_path):
+    source = _PollingSource(tmp_path, (".epub",), interval=3600)
+    (tmp_path / "a.epub").write_bytes(b"1")
+    assert source.changed(timeout=0.01) == []
+
+
+def test_file_is_reported_once_it_stops_changing(tmp_path, monkeypatch):
+    book = tmp_path / "a.epub"
+    clock = [0.0]
+
+    def sleep(seconds):
+        # Every walk takes one second; Calibre is still writing at t=5
+        clock[0] += 1
+        if clock[0] == 5:
+            book.write_bytes(b"more")
+
+    monkeypatch.setattr(watcher.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(watcher.time, "sleep", sleep)
+    w = Watcher(tmp_path, (".EPUB",), settle_seconds=10, poll_interval=0, backend="poll")
+    book.write_bytes(b"1")
+
+    assert next(w.batches()) == [book]
+    assert clock[0] >= 5 + 10
+
+
+@pytest.fixture
+def inotify(monkeypatch):
+    """A fake inotify_simple whose add_watch() is out of watches for dirs named 'full'."""
+    queued = []
+
+    class INotify:
+        def __init__(self):
+            self.wds = {}
+
+        def add_watch(self, path, mask):
+            if Path(path).name == "full":
+                raise OSError(errno.ENOSPC, "No space left on device")
+            self.wds[path] = len(self.wds) + 1
+            return self.wds[path]
+
+        def read(self, timeout=None):
+            events, queued[:] = list(queued), []
+            return events
+
+        def close(self):
+            pass
+
+    module = types.SimpleNamespace(INotify=INotify, flags=FLAGS)
+    monkeypatch.setitem(sys.modules, "inotify_simple", module)
+    return queued
+
+
+def test_unwatchable_tree_falls_back_to_polling(tmp_path, inotify):
+    (tmp_path / "full").mkdir()
+    logs = []
+
+    w = Watcher(tmp_path, (".epub",), backend="inotify", log_callback=logs.append)
+
+    assert w.backend == "poll"
+    assert isinstance(w._source, _PollingSource)
+    assert "polling" in logs[0] and "No space left" in logs[0]
+
+
+def test_unwatchable_new_directory_switches_to_polling(tmp_path, inotify):
+    logs = []
+    w = Watcher(tmp_path, (".epub",), settle_seconds=0, poll_interval=0,
+                backend="inotify", log_callback=logs.append)
+    assert w.backend == "inotify"
+
+    (tmp_path / "full").mkdir()
+    book = tmp_path / "full" / "a.epub"
+    book.write_bytes(b"1")
+    inotify.append(Event(1, FLAGS.CREATE | FLAGS.ISDIR, 0, "full"))
+
+    # The book in the directory inotify couldn't watch is still reported
+    assert next(w.batches()) == [book]
+    assert w.backend == "poll"
+    assert "1 map(pen) niet bewaakt" in logs[0]
@@ -0,0 +1,108 @@
+import threading
+
+import pytest
+
+from conftest import image_bytes
+from core import work_queue, scheduler, quarantine
+from core.runlog import RunLog
+from core.work_queue import (
+    SqliteWorkQueue, HttpWorkQueue, make_server, run_worker, MAX_ATTEMPTS,
+)
+
+# A lease that has already run out when it is granted
+EXPIRED = -1
+
+
+@pytest.fixture
+def queue(tmp_path):
+    q = SqliteWorkQueue(tmp_path / "queue.db")
+    q.enqueue("cbz", ["/books/a.cbz"], {"quality": 70})
+    return q
+
+
+def test_claim_is_exclusive(queue):
+    item = queue.claim("host-a")
+    assert item == {"path": "/books/a.cbz", "tool": "cbz", "settings": {"quality": 70}}
+    assert queue.claim("host-b") is None
+    assert queue.summary()["leased"] == 1
+
+
+def test_expired_lease_is_handed_out_again(queue):
+    queue.claim("host-a", lease_seconds=EXPIRED)
+    item = queue.claim("host-b")
+    assert item["path"] == "/books/a.cbz"
+
+    # The crashed worker lost its lease; its late result is ignored
+    assert not queue.renew("/books/a.cbz", "host-a")
+    assert not queue.complete("/books/a.cbz", "host-a", "success", 10)
+    assert queue.complete("/books/a.cbz", "host-b", "success", 20)
+    assert queue.summary() == {
+        "pending": 0, "leased": 0, "done": 1, "failed": 0, "bytes_saved": 20,
+    }
+
+
+def test_renewed_lease_is_kept(queue):
+    queue.claim("host-a", lease_seconds=EXPIRED)
+    assert queue.renew("/books/a.cbz", "host-a")
+    assert queue.claim("host-b") is None
+
+
+def test_item_fails_after_max_attempts(queue):
+    for attempt in range(MAX_ATTEMPTS):
+        assert queue.claim(f"host-{attempt}", lease_seconds=EXPIRED) is not None
+    assert queue.claim("host-last") is None
+    assert queue.summary()["failed"] == 1
+
+
+def test_http_coordinator(queue):
+    logs = []
+    server = make_server(queue, host="127.0.0.1", port=0, log_callback=logs.append)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = work_queue.open_queue(f"http://127.0.0.1:{server.server_address[1]}")
+        assert isinstance(client, HttpWorkQueue)
+        item = client.claim("host-a")
+        assert item["path"] == "/books/a.cbz"
+        assert client.claim("host-b") is None
+        assert client.complete(item["path"], "host-a", "no_gain", 0)
+        assert client.summary()["done"] == 1
+        assert logs == ["host-a: no_gain — /books/a.cbz"]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_worker_enforces_budgets_and_quarantines(tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduler, "MAX_MEGAPIXELS", 1)
+    cover = tmp_path / "cover.jpg"
+    cover.write_bytes(image_bytes((1500, 1000), quality=95))
+    settings = {"target_width": 180, "target_height": 270, "quality": 70}
+    queue = SqliteWorkQueue(tmp_path / "queue.db")
+    queue.enqueue("jpg", [cover], settings)
+
+    stats = run_worker(queue)
+
+    assert stats["failed"] == 1
+    assert queue.summary()["failed"] == 1
+    assert quarantine.exclude([cover]) == ([], [cover])
+
+    # A later queue skips it until the file changes
+    again = SqliteWorkQueue(tmp_path / "again.db")
+    again.enqueue("jpg", [cover], settings)
+    assert run_worker(again)["skipped"] == 1
+    assert again.summary()["done"] == 1
+
+
+def test_worker_logs_through_runlog(queue, monkeypatch):
+    records = []
+    monkeypatch.setattr(
+        RunLog, "file_result",
+        lambda self, path, status, *args: records.append((self.tool, path, status)),
+    )
+    messages = []
+
+    run_worker(queue, worker_id="host-a", log_callback=messages.append)
+
+    assert records == [("worker", "/books/a.cbz", "failed")]
+    assert messages[0] == "Worker host-a gestart"
+    assert messages[-1].startswith("Worker host-a klaar")
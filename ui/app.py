@@ -1,49 +1,22 @@
-import copy
-import json
-from pathlib import Path
-
 import customtkinter as ctk
 
 from ui.tabs.jpg_tab import JpgTab
 from ui.tabs.epub_tab import EpubTab
 from ui.tabs.pdf_tab import PdfTab
 from ui.tabs.cbz_tab import CbzTab
-from core.pdf_compressor import DEFAULT_GS_PATH
-
-
-_CONFIG_FILE = Path(__file__).parent.parent / "config.json"
-
-DEFAULT_CONFIG = {
-    "jpg": {
-        "path": "",
-        "target_width": 180,
-        "target_height": 270,
-        "quality": 70,
-        "force": False,
-    },
-    "epub": {
-        "path": "",
-        "target_height": 450,
-        "quality": 65,
-        "force": False,
-    },
-    "pdf": {
-        "path": "",
-        "gs_path": DEFAULT_GS_PATH,
-        "pdf_settings": "/ebook",
-        "force": False,
-    },
-    "cbz": {
-        "path": "",
-        "target_width": 1200,
-        "quality": 70,
-        "force": False,
-    },
-}
+from ui.tabs.library_tab import LibraryTab
+from core.config import load_config, save_config
+from core.scheduler import ResourceGovernor
+from core.metrics import start_exporter
+from ui.components import BaseTab, ThroughputPanel, QuarantinePanel
+
+
+# Tab title -> tool, for the compressor tabs
+_TOOL_TABS = {"JPG": "jpg", "EPUB": "epub", "PDF": "pdf", "CBZ/CBR": "cbz"}
 
 
 class CompressorApp(ctk.CTk):
-    """Main application window with 4 compressor tabs."""
+    """Main application window with 4 compressor tabs, an all-formats tab and the quarantine list."""
 
     def __init__(self):
         super().__init__()
@@ -52,53 +25,93 @@ class CompressorApp(ctk.CTk):
 
         self.config_data = self._load_config()
 
-        # Tab view
-        tabview = ctk.CTkTabview(self)
-        tabview.pack(fill="both", expand=True, padx=10, pady=10)
-
-        for name in ("JPG", "EPUB", "PDF", "CBZ/CBR"):
-            tabview.add(name)
-
-        self.jpg_tab = JpgTab(tabview.tab("JPG"), self.config_data)
-        self.jpg_tab.pack(fill="both", expand=True)
-
-        self.epub_tab = EpubTab(tabview.tab("EPUB"), self.config_data)
-        self.epub_tab.pack(fill="both", expand=True)
-
-        self.pdf_tab = PdfTab(tabview.tab("PDF"), self.config_data)
-        self.pdf_tab.pack(fill="both", expand=True)
-
-        self.cbz_tab = CbzTab(tabview.tab("CBZ/CBR"), self.config_data)
-        self.cbz_tab.pack(fill="both", expand=True)
+        # App-wide CPU/I/O/memory budget shared by all running tabs
+        self.governor = ResourceGovernor.from_config(self.config_data["app"])
+        # Optional local metrics endpoint / JSON file (off unless configured).
+        # Messages from before any tab exists go to the log of the first one built.
+        self._notices = []
+        self.metrics = start_exporter(
+            self.config_data["app"], self.governor, log_callback=self._notices.append
+        )
+
+        # Combined throughput view
+        self.throughput_panel = ThroughputPanel(self)
+        self.throughput_panel.pack(side="bottom", fill="x", padx=10, pady=(0, 10))
+
+        # Tab view; each tab is built the first time it is shown, so only the
+        # visible one is constructed at launch
+        self._tab_builders = {
+            "JPG": lambda parent: JpgTab(parent, self.config_data, governor=self.governor),
+            "EPUB": lambda parent: EpubTab(parent, self.config_data, governor=self.governor),
+            "PDF": lambda parent: PdfTab(parent, self.config_data, governor=self.governor),
+            "CBZ/CBR": lambda parent: CbzTab(parent, self.config_data, governor=self.governor),
+            "Alle formaten": lambda parent: LibraryTab(
+                parent, self.config_data, tool_tabs=self._tool_tabs, governor=self.governor
+            ),
+            "Quarantaine": lambda parent: QuarantinePanel(parent),
+        }
+        self._built = {}  # tab title -> widget
+        self._tool_tabs = {}  # tool -> built compressor tab (settings for LibraryTab)
+
+        self._tabview = ctk.CTkTabview(self, command=self._on_tab_selected)
+        self._tabview.pack(fill="both", expand=True, padx=10, pady=10)
+
+        for name in self._tab_builders:
+            self._tabview.add(name)
+        self._on_tab_selected()
 
         self.protocol("WM_DELETE_WINDOW", self._on_close)
+        self._poll_throughput()
 
     # ── Config ────────────────────────────────────────────────────────────────
 
     def _load_config(self) -> dict:
-        config = copy.deepcopy(DEFAULT_CONFIG)
-        if _CONFIG_FILE.exists():
-            try:
-                with open(_CONFIG_FILE, encoding="utf-8") as f:
-                    loaded = json.load(f)
-                for key in config:
-                    if key in loaded and isinstance(loaded[key], dict):
-                        config[key].update(loaded[key])
-            except Exception:
-                pass
-        return config
+        return load_config()
 
     def _save_config(self):
-        try:
-            with open(_CONFIG_FILE, "w", encoding="utf-8") as f:
-                json.dump(self.config_data, f, indent=2, ensure_ascii=False)
-        except Exception:
-            pass
+        save_config(self.config_data)
+
+    # ── Tabs ──────────────────────────────────────────────────────────────────
+
+    def _on_tab_selected(self):
+        name = self._tabview.get()
+        widget = self._built.get(name)
+        if widget is None:
+            widget = self._built[name] = self._tab_builders[name](self._tabview.tab(name))
+            widget.pack(fill="both", expand=True)
+            if name in _TOOL_TABS:
+                self._tool_tabs[_TOOL_TABS[name]] = widget
+            if isinstance(widget, BaseTab):
+                for message in self._notices:
+                    widget.log_viewer.append(message)
+                self._notices.clear()
+        elif isinstance(widget, QuarantinePanel):
+            widget.refresh()
+
+    # ── Throughput ────────────────────────────────────────────────────────────
+
+    def _poll_throughput(self):
+        self.throughput_panel.update(self.governor.snapshot())
+        self.after(1000, self._poll_throughput)
 
     # ── Close ─────────────────────────────────────────────────────────────────
 
+    def _tabs(self) -> tuple:
+        """The compressor tabs built so far (tabs never shown can't be running)."""
+        return tuple(w for w in self._built.values() if isinstance(w, BaseTab))
+
     def _on_close(self):
-        for tab in (self.jpg_tab, self.epub_tab, self.pdf_tab, self.cbz_tab):
+        for tab in self._tabs():
             tab.force_stop()
         self._save_config()
+        self._close_when_flushed()
+
+    def _close_when_flushed(self):
+        """Waits (without blocking the UI) until queued write-backs are done."""
+        if any(tab.is_running() for tab in self._tabs()):
+            self.title("Calibre Compressor — afsluiten, wegschrijven afronden…")
+            self.after(200, self._close_when_flushed)
+            return
+        if self.metrics is not None:
+            self.metrics.close()
         self.destroy()
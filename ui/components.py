@@ -4,6 +4,7 @@ from tkinter import filedialog
 
 import customtkinter as ctk
 
+from core import quarantine
 from core.shared import format_bytes
 
 
@@ -171,6 +172,91 @@ class StatsPanel(ctk.CTkFrame):
             lbl.configure(text="—")
 
 
+# ─── ThroughputPanel ──────────────────────────────────────────────────────────
+
+class ThroughputPanel(ctk.CTkFrame):
+    """One-line combined throughput view over all running tools."""
+
+    def __init__(self, parent, **kwargs):
+        super().__init__(parent, **kwargs)
+        self._label = ctk.CTkLabel(self, text="Geen actieve taken", anchor="w", font=("", 11))
+        self._label.pack(fill="x", padx=10, pady=3)
+
+    def update(self, snapshot: dict):
+        """Takes a ResourceGovernor.snapshot() dict."""
+        tabs = snapshot["tabs"]
+        if not tabs:
+            self._label.configure(text="Geen actieve taken")
+            return
+        c = snapshot["combined"]
+        parts = [
+            f"{name.upper()} {t['files_per_sec']:.1f}/s ({t['cpu_in_use']}/{t['cpu_share']}"
+            + (f", auto {t['level']}" if t.get("level") is not None else "") + ")"
+            for name, t in sorted(tabs.items())
+        ]
+        self._label.configure(
+            text=(
+                f"Totaal: {c['files_per_sec']:.1f} bestanden/s — "
+                f"{format_bytes(int(c['bytes_per_sec']))}/s bespaard — "
+                f"CPU {c['cpu_in_use']}/{c['cpu_budget']} — "
+                f"I/O {c['io_in_use']}/{c['io_budget']} — "
+                f"Geheugen {format_bytes(c['memory_in_use'])}/{format_bytes(c['memory_budget'])}    "
+                + "  ".join(parts)
+            )
+        )
+
+
+# ─── QuarantinePanel ──────────────────────────────────────────────────────────
+
+class QuarantinePanel(ctk.CTkFrame):
+    """List of quarantined files (core.quarantine) with Refresh / Release all buttons."""
+
+    def __init__(self, parent, **kwargs):
+        super().__init__(parent, **kwargs)
+
+        self._label = ctk.CTkLabel(self, text="", anchor="w")
+        self._label.pack(fill="x", padx=10, pady=(6, 0))
+
+        self._text = ctk.CTkTextbox(
+            self,
+            font=("Courier New", 11),
+            wrap="none",
+            state="disabled",
+        )
+        self._text.pack(fill="both", expand=True, padx=6, pady=(6, 0))
+
+        buttons = ctk.CTkFrame(self, fg_color="transparent")
+        buttons.pack(anchor="e", padx=6, pady=3)
+        ctk.CTkButton(
+            buttons, text="Vernieuwen", height=24, command=self.refresh
+        ).pack(side="left", padx=(0, 6))
+        ctk.CTkButton(
+            buttons, text="Alles vrijgeven", height=24, command=self._release_all
+        ).pack(side="left")
+
+        self.refresh()
+
+    def refresh(self):
+        held = quarantine.entries()
+        self._label.configure(
+            text=f"{_dutch(len(held))} bestand(en) in quarantaine — worden overgeslagen "
+                 "tot ze wijzigen of worden vrijgegeven"
+        )
+        self._text.configure(state="normal")
+        self._text.delete("1.0", "end")
+        for path, entry in held:
+            self._text.insert(
+                "end",
+                f"{entry.get('date', '')}  {entry.get('reason', '')} "
+                f"({entry.get('failures', 0)}×)  {path}\n",
+            )
+        self._text.configure(state="disabled")
+
+    def _release_all(self):
+        quarantine.release()
+        self.refresh()
+
+
 # ─── StartStopButton ──────────────────────────────────────────────────────────
 
 class StartStopButton(ctk.CTkButton):
@@ -228,10 +314,11 @@ class BaseTab(ctk.CTkFrame):
       _get_compressor_main()   — returns the compressor main function
     """
 
-    def __init__(self, parent, config: dict, tab_name: str, **kwargs):
+    def __init__(self, parent, config: dict, tab_name: str, governor=None, **kwargs):
         super().__init__(parent, fg_color="transparent", **kwargs)
         self.config = config
         self.tab_name = tab_name
+        self.governor = governor
         self._thread: threading.Thread | None = None
         self._stop_event: threading.Event | None = None
 
@@ -257,6 +344,16 @@ class BaseTab(ctk.CTkFrame):
         settings.pack(fill="x", pady=(0, 4))
         self._build_settings(settings)
 
+        # Watch mode (keeps running after the first pass)
+        self._watch_var = ctk.BooleanVar(
+            value=self.config.get(self.tab_name, {}).get("watch", False)
+        )
+        ctk.CTkCheckBox(
+            top,
+            text="Map blijven bewaken (nieuwe en gewijzigde bestanden verwerken)",
+            variable=self._watch_var,
+        ).pack(anchor="w", padx=10, pady=(0, 4))
+
         # Start/stop button
         self.start_stop_btn = StartStopButton(
             top, on_start=self.start, on_stop=self.stop, height=30
@@ -311,21 +408,30 @@ class BaseTab(ctk.CTkFrame):
         if self._stop_event:
             self._stop_event.set()
 
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
     # ── Worker ────────────────────────────────────────────────────────────────
 
     def _run(self):
+        lease = self.governor.register(self.tab_name) if self.governor else None
         try:
             kwargs = self._get_run_kwargs()
+            kwargs["watch"] = bool(self._watch_var.get())
+            self.config[self.tab_name]["watch"] = kwargs["watch"]
             kwargs["stop_event"] = self._stop_event
             kwargs["progress_callback"] = self._on_progress
             kwargs["log_callback"] = self._on_log
             kwargs["stats_callback"] = self._on_stats
+            kwargs["lease"] = lease
 
             stats = self._get_compressor_main()(**kwargs)
         except Exception as e:
             self.after(0, self.log_viewer.append, f"Onverwachte fout: {e}")
             stats = {"total": 0, "successful": 0, "skipped": 0, "failed": 0, "bytes_saved": 0}
         finally:
+            if lease:
+                lease.close()
             self.after(0, self._on_done, stats)
 
     # ── Callbacks (called from worker thread → schedule on main thread) ───────
@@ -373,3 +479,62 @@ def make_quality_row(frame, row: int, default_value: int) -> ctk.CTkSlider:
     frame.columnconfigure(1, weight=1)
 
     return slider
+
+
+# ─── Shared helper: perceptual target row ────────────────────────────────────
+
+def make_target_row(frame, row: int, cfg: dict) -> tuple:
+    """
+    Adds a 'Doel-SSIM' checkbox + entry to a grid frame. When enabled, the
+    compressor picks JPEG quality per image within the config's
+    min_quality..max_quality instead of using the slider value.
+    Returns (enabled_var, entry).
+    """
+    target = cfg.get("target_ssim")
+    enabled_var = ctk.BooleanVar(value=bool(target))
+    ctk.CTkCheckBox(frame, text="Doel-SSIM:", variable=enabled_var).grid(
+        row=row, column=0, padx=(10, 6), pady=3, sticky="w"
+    )
+
+    entry = ctk.CTkEntry(frame, width=80)
+    entry.insert(0, str(target or 0.97))
+    entry.grid(row=row, column=1, padx=6, pady=3, sticky="w")
+
+    return enabled_var, entry
+
+
+def read_target(enabled_var, entry) -> float | None:
+    """Returns the SSIM target from make_target_row widgets, or None if disabled/invalid."""
+    if not enabled_var.get():
+        return None
+    try:
+        value = float(entry.get().replace(",", "."))
+    except ValueError:
+        return None
+    return value if 0 < value < 1 else None
+
+
+# ─── Shared helper: encoder preset row ───────────────────────────────────────
+
+_ENCODER_PRESETS = {"Kleinst": "smallest", "Snel": "fast"}
+
+
+def make_encoder_row(frame, row: int, cfg: dict) -> ctk.StringVar:
+    """
+    Adds an 'Encoder' dropdown (Kleinst / Snel) to a grid frame.
+    Returns the StringVar; pass it to read_encoder_preset().
+    """
+    ctk.CTkLabel(frame, text="Encoder:", anchor="w").grid(
+        row=row, column=0, padx=(10, 6), pady=3, sticky="w"
+    )
+    current = cfg.get("encoder_preset", "smallest")
+    label = next((k for k, v in _ENCODER_PRESETS.items() if v == current), "Kleinst")
+    var = ctk.StringVar(value=label)
+    ctk.CTkOptionMenu(frame, values=list(_ENCODER_PRESETS), variable=var).grid(
+        row=row, column=1, padx=6, pady=3, sticky="w"
+    )
+    return var
+
+
+def read_encoder_preset(var) -> str:
+    return _ENCODER_PRESETS.get(var.get(), "smallest")
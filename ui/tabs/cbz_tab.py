@@ -1,7 +1,17 @@
 import customtkinter as ctk
 
-from core import cbz_compressor
-from ui.components import BaseTab, make_quality_row
+from ui.components import (
+    BaseTab, make_quality_row, make_target_row, read_target,
+    make_encoder_row, read_encoder_preset,
+)
+
+
+# Option label -> cbz_compressor cbr_output
+_CBR_OUTPUTS = {
+    "CBR (rar.exe)": "cbr",
+    "CBZ in plaats van CBR": "cbz",
+    "CBZ naast CBR": "cbz_alongside",
+}
 
 
 class CbzTab(BaseTab):
@@ -24,21 +34,80 @@ class CbzTab(BaseTab):
         # Quality slider
         self._quality_slider = make_quality_row(frame, row=1, default_value=cfg.get("quality", 70))
 
+        # Perceptual target (quality chosen per image)
+        self._target_var, self._target_entry = make_target_row(frame, row=2, cfg=cfg)
+
+        # Encoder preset
+        self._encoder_var = make_encoder_row(frame, row=3, cfg=cfg)
+
+        # Output format
+        ctk.CTkLabel(frame, text="Uitvoerformaat:", anchor="w").grid(
+            row=4, column=0, padx=(10, 6), pady=3, sticky="w"
+        )
+        # Probes Pillow's codecs, so only when this tab is first shown
+        from core.cbz_compressor import available_output_formats
+        formats = available_output_formats()
+        current = cfg.get("output_format", "jpeg")
+        self._format_var = ctk.StringVar(value=current if current in formats else "jpeg")
+        ctk.CTkOptionMenu(
+            frame,
+            values=formats,
+            variable=self._format_var,
+        ).grid(row=4, column=1, padx=6, pady=3, sticky="w")
+
+        # CBR output (rar.exe repack or native conversion to CBZ)
+        ctk.CTkLabel(frame, text="CBR uitvoer:", anchor="w").grid(
+            row=5, column=0, padx=(10, 6), pady=3, sticky="w"
+        )
+        current = cfg.get("cbr_output", "cbr")
+        self._cbr_output_var = ctk.StringVar(
+            value=next((k for k, v in _CBR_OUTPUTS.items() if v == current), "CBR (rar.exe)")
+        )
+        ctk.CTkOptionMenu(
+            frame,
+            values=list(_CBR_OUTPUTS),
+            variable=self._cbr_output_var,
+        ).grid(row=5, column=1, padx=6, pady=3, sticky="w")
+
+        # Keep smaller checkbox
+        self._keep_smaller_var = ctk.BooleanVar(value=cfg.get("keep_smaller", True))
+        ctk.CTkCheckBox(
+            frame,
+            text="Per pagina kleinste houden (vergelijk met JPEG)",
+            variable=self._keep_smaller_var,
+        ).grid(row=6, column=0, columnspan=3, padx=10, pady=3, sticky="w")
+
+        # Grayscale checkbox
+        self._grayscale_var = ctk.BooleanVar(value=cfg.get("detect_grayscale", True))
+        ctk.CTkCheckBox(
+            frame,
+            text="Grijswaarden herkennen (1 kanaal opslaan)",
+            variable=self._grayscale_var,
+        ).grid(row=7, column=0, columnspan=3, padx=10, pady=3, sticky="w")
+
+        # Crop margins checkbox
+        self._crop_var = ctk.BooleanVar(value=cfg.get("crop_margins", False))
+        ctk.CTkCheckBox(
+            frame,
+            text="Witte/zwarte randen automatisch bijsnijden",
+            variable=self._crop_var,
+        ).grid(row=8, column=0, columnspan=3, padx=10, pady=3, sticky="w")
+
         # Force checkbox
         self._force_var = ctk.BooleanVar(value=cfg.get("force", False))
         ctk.CTkCheckBox(
             frame,
             text="Force (herverwerk al verwerkte bestanden)",
             variable=self._force_var,
-        ).grid(row=2, column=0, columnspan=3, padx=10, pady=3, sticky="w")
+        ).grid(row=9, column=0, columnspan=3, padx=10, pady=3, sticky="w")
 
         # Info label about CBR
         ctk.CTkLabel(
             frame,
-            text="Opmerking: CBR compressie vereist rar.exe in PATH.",
+            text="Opmerking: CBR uitvoer vereist rar.exe in PATH; omzetten naar CBZ niet.",
             text_color="gray60",
             font=("", 11),
-        ).grid(row=3, column=0, columnspan=3, padx=10, pady=(2, 6), sticky="w")
+        ).grid(row=10, column=0, columnspan=3, padx=10, pady=(2, 6), sticky="w")
 
     def _get_run_kwargs(self) -> dict:
         try:
@@ -47,12 +116,26 @@ class CbzTab(BaseTab):
             width = 1200
 
         quality = int(self._quality_slider.get())
+        output_format = self._format_var.get()
+        keep_smaller = bool(self._keep_smaller_var.get())
+        cbr_output = _CBR_OUTPUTS.get(self._cbr_output_var.get(), "cbr")
+        target_ssim = read_target(self._target_var, self._target_entry)
+        encoder_preset = read_encoder_preset(self._encoder_var)
+        detect_grayscale = bool(self._grayscale_var.get())
+        crop_margins = bool(self._crop_var.get())
         force = bool(self._force_var.get())
 
         self.config["cbz"].update({
             "path": self.path_selector.get(),
             "target_width": width,
             "quality": quality,
+            "output_format": output_format,
+            "keep_smaller": keep_smaller,
+            "cbr_output": cbr_output,
+            "target_ssim": target_ssim,
+            "encoder_preset": encoder_preset,
+            "detect_grayscale": detect_grayscale,
+            "crop_margins": crop_margins,
             "force": force,
         })
 
@@ -60,8 +143,16 @@ class CbzTab(BaseTab):
             "path": self.path_selector.get(),
             "target_width": width,
             "quality": quality,
+            "output_format": output_format,
+            "keep_smaller": keep_smaller,
+            "cbr_output": cbr_output,
+            "target_ssim": target_ssim,
+            "encoder_preset": encoder_preset,
+            "detect_grayscale": detect_grayscale,
+            "crop_margins": crop_margins,
             "force": force,
         }
 
     def _get_compressor_main(self):
+        from core import cbz_compressor
         return cbz_compressor.main
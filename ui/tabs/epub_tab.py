@@ -1,7 +1,9 @@
 import customtkinter as ctk
 
-from core import epub_compressor
-from ui.components import BaseTab, make_quality_row
+from ui.components import (
+    BaseTab, make_quality_row, make_target_row, read_target,
+    make_encoder_row, read_encoder_preset,
+)
 
 
 class EpubTab(BaseTab):
@@ -24,13 +26,35 @@ class EpubTab(BaseTab):
         # Quality slider
         self._quality_slider = make_quality_row(frame, row=1, default_value=cfg.get("quality", 65))
 
+        # Perceptual target (quality chosen per image)
+        self._target_var, self._target_entry = make_target_row(frame, row=2, cfg=cfg)
+
+        # Encoder preset
+        self._encoder_var = make_encoder_row(frame, row=3, cfg=cfg)
+
+        # Grayscale checkbox
+        self._grayscale_var = ctk.BooleanVar(value=cfg.get("detect_grayscale", True))
+        ctk.CTkCheckBox(
+            frame,
+            text="Grijswaarden herkennen (1 kanaal opslaan)",
+            variable=self._grayscale_var,
+        ).grid(row=4, column=0, columnspan=3, padx=10, pady=3, sticky="w")
+
+        # Crop margins checkbox
+        self._crop_var = ctk.BooleanVar(value=cfg.get("crop_margins", False))
+        ctk.CTkCheckBox(
+            frame,
+            text="Witte/zwarte randen automatisch bijsnijden",
+            variable=self._crop_var,
+        ).grid(row=5, column=0, columnspan=3, padx=10, pady=3, sticky="w")
+
         # Force checkbox
         self._force_var = ctk.BooleanVar(value=cfg.get("force", False))
         ctk.CTkCheckBox(
             frame,
             text="Force (herverwerk al verwerkte bestanden)",
             variable=self._force_var,
-        ).grid(row=2, column=0, columnspan=3, padx=10, pady=3, sticky="w")
+        ).grid(row=6, column=0, columnspan=3, padx=10, pady=3, sticky="w")
 
     def _get_run_kwargs(self) -> dict:
         try:
@@ -39,12 +63,20 @@ class EpubTab(BaseTab):
             height = 450
 
         quality = int(self._quality_slider.get())
+        target_ssim = read_target(self._target_var, self._target_entry)
+        encoder_preset = read_encoder_preset(self._encoder_var)
+        detect_grayscale = bool(self._grayscale_var.get())
+        crop_margins = bool(self._crop_var.get())
         force = bool(self._force_var.get())
 
         self.config["epub"].update({
             "path": self.path_selector.get(),
             "target_height": height,
             "quality": quality,
+            "target_ssim": target_ssim,
+            "encoder_preset": encoder_preset,
+            "detect_grayscale": detect_grayscale,
+            "crop_margins": crop_margins,
             "force": force,
         })
 
@@ -52,8 +84,14 @@ class EpubTab(BaseTab):
             "path": self.path_selector.get(),
             "target_height": height,
             "quality": quality,
+            "target_ssim": target_ssim,
+            "encoder_preset": encoder_preset,
+            "detect_grayscale": detect_grayscale,
+            "crop_margins": crop_margins,
             "force": force,
         }
 
     def _get_compressor_main(self):
+        # Imported on first run: keeps Pillow out of application startup
+        from core import epub_compressor
         return epub_compressor.main
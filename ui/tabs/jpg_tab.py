@@ -1,7 +1,9 @@
 import customtkinter as ctk
 
-from core import jpg_compressor
-from ui.components import BaseTab, make_quality_row
+from ui.components import (
+    BaseTab, make_quality_row, make_target_row, read_target,
+    make_encoder_row, read_encoder_preset,
+)
 
 
 class JpgTab(BaseTab):
@@ -32,13 +34,27 @@ class JpgTab(BaseTab):
         # Quality slider
         self._quality_slider = make_quality_row(frame, row=2, default_value=cfg.get("quality", 70))
 
+        # Perceptual target (quality chosen per image)
+        self._target_var, self._target_entry = make_target_row(frame, row=3, cfg=cfg)
+
+        # Encoder preset
+        self._encoder_var = make_encoder_row(frame, row=4, cfg=cfg)
+
+        # Grayscale checkbox
+        self._grayscale_var = ctk.BooleanVar(value=cfg.get("detect_grayscale", True))
+        ctk.CTkCheckBox(
+            frame,
+            text="Grijswaarden herkennen (1 kanaal opslaan)",
+            variable=self._grayscale_var,
+        ).grid(row=5, column=0, columnspan=3, padx=10, pady=3, sticky="w")
+
         # Force checkbox
         self._force_var = ctk.BooleanVar(value=cfg.get("force", False))
         ctk.CTkCheckBox(
             frame,
             text="Force (herverwerk al verwerkte bestanden)",
             variable=self._force_var,
-        ).grid(row=3, column=0, columnspan=3, padx=10, pady=3, sticky="w")
+        ).grid(row=6, column=0, columnspan=3, padx=10, pady=3, sticky="w")
 
     def _get_run_kwargs(self) -> dict:
         try:
@@ -51,6 +67,9 @@ class JpgTab(BaseTab):
             height = 270
 
         quality = int(self._quality_slider.get())
+        target_ssim = read_target(self._target_var, self._target_entry)
+        encoder_preset = read_encoder_preset(self._encoder_var)
+        detect_grayscale = bool(self._grayscale_var.get())
         force = bool(self._force_var.get())
 
         # Persist to config
@@ -59,6 +78,9 @@ class JpgTab(BaseTab):
             "target_width": width,
             "target_height": height,
             "quality": quality,
+            "target_ssim": target_ssim,
+            "encoder_preset": encoder_preset,
+            "detect_grayscale": detect_grayscale,
             "force": force,
         })
 
@@ -67,8 +89,13 @@ class JpgTab(BaseTab):
             "target_width": width,
             "target_height": height,
             "quality": quality,
+            "target_ssim": target_ssim,
+            "encoder_preset": encoder_preset,
+            "detect_grayscale": detect_grayscale,
             "force": force,
         }
 
     def _get_compressor_main(self):
+        # Imported on first run: keeps Pillow out of application startup
+        from core import jpg_compressor
         return jpg_compressor.main
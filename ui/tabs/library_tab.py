@@ -0,0 +1,79 @@
+import customtkinter as ctk
+
+from ui.components import BaseTab
+
+
+# In core.library.TOOLS order; core.library itself is imported on first run
+_LABELS = {"jpg": "JPG", "epub": "EPUB", "pdf": "PDF", "cbz": "CBZ/CBR"}
+
+
+class LibraryTab(BaseTab):
+    """Tab that processes all formats in one pass, with the settings of the other tabs."""
+
+    def __init__(self, parent, config: dict, tool_tabs: dict = None, **kwargs):
+        # tool -> tab whose current settings are used for that type; tabs
+        # that haven't been built (shown) yet are absent and use the config
+        self._tool_tabs = tool_tabs if tool_tabs is not None else {}
+        super().__init__(parent, config, tab_name="library", **kwargs)
+
+    def _build_settings(self, frame: ctk.CTkFrame):
+        cfg = self.config["library"]
+        enabled = cfg.get("tools", list(_LABELS))
+
+        # Formats
+        ctk.CTkLabel(frame, text="Formaten:", anchor="w").grid(
+            row=0, column=0, padx=(10, 6), pady=3, sticky="w"
+        )
+        self._tool_vars = {}
+        for col, tool in enumerate(_LABELS, start=1):
+            var = ctk.BooleanVar(value=tool in enabled)
+            ctk.CTkCheckBox(frame, text=_LABELS[tool], variable=var).grid(
+                row=0, column=col, padx=6, pady=3, sticky="w"
+            )
+            self._tool_vars[tool] = var
+
+        # Force checkbox
+        self._force_var = ctk.BooleanVar(value=cfg.get("force", False))
+        ctk.CTkCheckBox(
+            frame,
+            text="Force (herverwerk al verwerkte bestanden)",
+            variable=self._force_var,
+        ).grid(row=1, column=0, columnspan=5, padx=10, pady=3, sticky="w")
+
+        # Info
+        ctk.CTkLabel(
+            frame,
+            text="De map wordt één keer doorlopen; elk bestand wordt verwerkt met de\n"
+                 "instellingen van zijn eigen tab (JPG, EPUB, PDF, CBZ/CBR).",
+            text_color="gray",
+            font=("", 11),
+            justify="left",
+        ).grid(row=2, column=0, columnspan=5, padx=10, pady=(0, 3), sticky="w")
+
+    def _tool_settings(self, tool: str) -> dict:
+        settings = dict(self.config[tool])
+        tab = self._tool_tabs.get(tool)
+        if tab is not None:
+            settings.update(tab._get_run_kwargs())
+        return settings
+
+    def _get_run_kwargs(self) -> dict:
+        tools = [t for t in _LABELS if self._tool_vars[t].get()]
+        force = bool(self._force_var.get())
+
+        self.config["library"].update({
+            "path": self.path_selector.get(),
+            "tools": tools,
+            "force": force,
+        })
+
+        return {
+            "path": self.path_selector.get(),
+            "settings": {tool: self._tool_settings(tool) for tool in tools},
+            "tools": tools,
+            "force": force,
+        }
+
+    def _get_compressor_main(self):
+        from core import library
+        return library.main
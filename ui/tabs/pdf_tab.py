@@ -2,7 +2,7 @@ import os
 
 import customtkinter as ctk
 
-from core import pdf_compressor
+from core.config import DEFAULT_CONFIG
 from ui.components import BaseTab, PathSelector
 
 
@@ -28,7 +28,7 @@ class PdfTab(BaseTab):
         frame.columnconfigure(1, weight=1)
 
         self._gs_entry = ctk.CTkEntry(gs_row)
-        self._gs_entry.insert(0, cfg.get("gs_path", pdf_compressor.DEFAULT_GS_PATH))
+        self._gs_entry.insert(0, cfg.get("gs_path", DEFAULT_CONFIG["pdf"]["gs_path"]))
         self._gs_entry.pack(side="left", fill="x", expand=True, padx=(0, 6))
         self._gs_entry.bind("<FocusOut>", self._check_gs_path)
 
@@ -105,4 +105,5 @@ class PdfTab(BaseTab):
         }
 
     def _get_compressor_main(self):
+        from core import pdf_compressor
         return pdf_compressor.main